@@ -0,0 +1,26 @@
+# Este codigo tiene que correrse en el repositorio de cb-da
+from entities.benchmark import benchmark_distance_backends
+from entities.distance_backends import RoadNetworkBackend
+from entities.synthetic_data import generate_synthetic_data, generate_synthetic_road_network
+import os
+
+##------------------------------------------------------------------------------------##
+# Directorio donde se generan los datos sinteticos de Tacna y la red vial sintetica (nodes.csv y edges.csv)
+##------------------------------------------------------------------------------------##
+
+work_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_data', 'distance_backends')
+
+##------------------------------------------------------------------------------------##
+
+generate_synthetic_data(dir=work_dir+'/', n_applicants=10000, seed=0)
+# Para usar una red vial real, reemplazar por los archivos de nodos y aristas de la region
+generate_synthetic_road_network(dir=work_dir+'/', seed=0)
+
+results = benchmark_distance_backends(work_dir+'/',
+                                      backends={'haversine': 'haversine',
+                                                'road_network': RoadNetworkBackend.from_csv(work_dir+'/nodes.csv', work_dir+'/edges.csv')},
+                                      max_imputed_options=20)
+
+# same_nearest: proporcion de postulantes con el mismo colegio imputado mas cercano que con la distancia geodesica
+# top_overlap: proporcion promedio de los primeros colegios imputados que coinciden con la distancia geodesica
+print(results.to_string())
@@ -0,0 +1,33 @@
+# Este codigo tiene que correrse en el repositorio de cb-da
+from entities.benchmark import run_benchmark, compare_benchmark_runs
+import os
+
+##------------------------------------------------------------------------------------##
+# Directorio donde se generan los datos sinteticos y archivo donde se acumulan los tiempos de cada corrida
+##------------------------------------------------------------------------------------##
+
+work_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_data')
+output_file = os.path.join(work_dir, 'benchmark_results.jsonl')
+
+##------------------------------------------------------------------------------------##
+
+results = run_benchmark(work_dir=work_dir,
+                        output_file=output_file,
+                        scales=(1000, 10000, 50000),
+                        types=('no_distance', 'calculated_distance'),
+                        engine='array',
+                        queue_type='heap',
+                        max_imputed_options=20,
+                        # Parametros de los datos sinteticos (ver generate_synthetic_data)
+                        schools_per_grade=50,
+                        nee_share=0.05,
+                        list_length=(1, 5))
+
+print(results.pivot_table(index=['n_applicants', 'type'], columns='stage', values='seconds', sort=False).to_string())
+
+##Comparacion con la corrida anterior (ratio > 1 es mas lento)
+try:
+    print(compare_benchmark_runs(output_file).to_string())
+except ValueError as e:
+    # Menos de dos corridas, o corridas con distinta configuracion (engine, queue_type, max_imputed_options, max_distance, repeats)
+    print(e)
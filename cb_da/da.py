@@ -6,7 +6,10 @@ Company: Consilium Bots Inc.
 Modified By:  Benjamín Madariaga at b.madariaga.e@gmail.com
 '''
 
+import pandas as pd
+
 from cb_da.entities.policymaker import PolicyMaker
+from cb_da.entities.simulator import simulate_assignment
 
 
 def da(vacancies, applicants, applications, priority_profiles, quota_order, 
@@ -17,16 +20,28 @@ def da(vacancies, applicants, applications, priority_profiles, quota_order,
         linked_postulation_activation= False,
         secured_enrollment_assignment= False,
         forced_secured_enrollment_assignment= False,
-        transfer_capacity_activation= False):
+        transfer_capacity_activation= False,
+        queue_type= 'list',
+        engine= 'object',
+        return_stats= False,
+        distance_tails= None):
     '''
-    Main method for the application of Deferred Acceptance Algorithm
+    Main method for the application of Deferred Acceptance Algorithm. With
+    return_stats it returns the results and a MatchingStats with the wall
+    times of the initialization stages and of each round, the proposals,
+    rejections and longest rejection chain of each round and the rejected
+    applicants of each program. distance_tails are the applications imputed
+    by distance that are generated during the matching (see prepare_data
+    with lazy_distance), only with the object engine.
     '''
     config_file = {'order': order,# Orden en el que se corre el algoritmo
                     'sibling_priority_activation': sibling_priority_activation, # Para activar prioridad de hermano entre niveles y tipos de asignación (NEE y Regular.)
                     'linked_postulation_activation': linked_postulation_activation, # Para activar postulación en bloque
                     'secured_enrollment_assignment': secured_enrollment_assignment, # Para activar el uso de secured enrollment
                     'forced_secured_enrollment_assignment': forced_secured_enrollment_assignment, # Para forzar la asignación SE en caso de no haber cupos
-                    'transfer_capacity_activation': transfer_capacity_activation}
+                    'transfer_capacity_activation': transfer_capacity_activation,
+                    'queue_type': queue_type, # 'list' o 'heap' (cola con heap, mismo resultado y mas rapida en programas grandes)
+                    'engine': engine} # 'object', 'array' (motor sobre arreglos, mismo resultado) o 'round' (propuestas por ronda, vectorizado)
     print('*******************************************************')
     print('*******************************************************')
     print('>>> SCHOOL MATCHING ALGORITHM  <<<')
@@ -48,6 +63,8 @@ def da(vacancies, applicants, applications, priority_profiles, quota_order,
         config_file['forced_secured_enrollment_assignment'])
     print('Transfer Capacity: ',
         config_file['transfer_capacity_activation'])
+    print('Queue type: ', config_file['queue_type'])
+    print('Engine: ', config_file['engine'])
     print('*******************************************************')
     print('*******************************************************')
 
@@ -60,7 +77,8 @@ def da(vacancies, applicants, applications, priority_profiles, quota_order,
                                 quota_order = quota_order,
                                 siblings = siblings,
                                 links = links,
-                                config = config_file)
+                                config = config_file,
+                                distance_tails = distance_tails)
 
     print('>> Starting matching algorithm')
     policy_maker.match_applicants_and_programs()
@@ -74,4 +92,79 @@ def da(vacancies, applicants, applications, priority_profiles, quota_order,
     print('>>> CONSILIUM BOTS INC.  <<<')
     print('*******************************************************')
     print('*******************************************************')
+    if return_stats:
+        return output, policy_maker.get_stats()
     return output
+
+
+def compare_da_engines(vacancies, applicants, applications, priority_profiles,
+        quota_order, engines=('object', 'array'), **kwargs):
+    '''
+    Runs da with each engine over copies of the same inputs and returns the
+    rows of the results where the engines disagree. An empty DataFrame means
+    that all engines returned the same matching.
+    '''
+    results = []
+    for engine in engines:
+        output = da(vacancies=vacancies.copy(),
+                    applicants=applicants.copy(),
+                    applications=applications.copy(),
+                    priority_profiles=priority_profiles.copy(),
+                    quota_order=quota_order.copy(),
+                    engine=engine,
+                    **kwargs)
+        results.append(output.set_index('applicant_id').sort_index())
+    differences = pd.concat(results, axis=1, keys=engines)
+    mismatch = pd.Series(False, index=differences.index)
+    for engine_results in results[1:]:
+        mismatch |= ~((results[0] == engine_results) |
+                    (results[0].isna() & engine_results.isna())).all(axis=1)
+    return differences[mismatch]
+
+
+def simulate_da(vacancies, applicants, applications, priority_profiles,
+        quota_order,
+        siblings=None,
+        links=None,
+        seeds=range(100),
+        lotteries=None,
+        workers=1,
+        order= 'descending',
+        sibling_priority_activation= False,
+        linked_postulation_activation= False,
+        secured_enrollment_assignment= False,
+        forced_secured_enrollment_assignment= False,
+        transfer_capacity_activation= False,
+        queue_type= 'list',
+        engine= 'object'):
+    '''
+    Runs the Deferred Acceptance Algorithm once per lottery seed, drawing new
+    lottery numbers each time, and returns a SimulationResults with the
+    assignment probabilities and the cutoff scores of each replication.
+    lotteries is a list of lottery configs (see AssignmentSimulator), by
+    default a single tie break lottery over all the applications. The rest
+    of the arguments are the same as in da.
+    '''
+    if lotteries is None:
+        lotteries = [{'tie_break_method': 'single'}]
+    config_file = {'order': order,
+                    'sibling_priority_activation': sibling_priority_activation,
+                    'linked_postulation_activation': linked_postulation_activation,
+                    'secured_enrollment_assignment': secured_enrollment_assignment,
+                    'forced_secured_enrollment_assignment': forced_secured_enrollment_assignment,
+                    'transfer_capacity_activation': transfer_capacity_activation,
+                    'queue_type': queue_type,
+                    'engine': engine}
+    print('>> Simulating '+str(len(seeds))+' lotteries with '+str(workers)+' workers')
+    return simulate_assignment(seeds=seeds,
+                                workers=workers,
+                                vacancies=vacancies,
+                                applicants=applicants,
+                                applications=applications,
+                                priority_profiles=priority_profiles,
+                                quota_order=quota_order,
+                                siblings=siblings,
+                                links=links,
+                                config=config_file,
+                                lotteries=lotteries)
+
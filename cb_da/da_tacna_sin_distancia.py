@@ -1,7 +1,7 @@
 # Este codigo tiene que correrse en el repositorio de cb-da
 from cb_da import da
 from cb_lottery_maker import lottery_maker
-from entities.data_processing import data_preparation, output_preparation
+from entities.data_processing import prepare_data, output_preparation
 import pandas as pd
 import os
 
@@ -14,15 +14,16 @@ dir = '/Users/oscar/OneDrive/Escritorio/verificacion_DA/sin_distancia_VDISTANCE/
 
 ##------------------------------------------------------------------------------------##
 
-processed_dir = data_preparation(dir, type="no_distance")
+##Para guardar las tablas procesadas como csv (auditoría), usar write_files=True
+prepared = prepare_data(dir, type="no_distance", write_files=False)
 
-applicants = pd.read_csv(processed_dir+'applicants.csv',dtype={'secured_enrollment_program_id':int,'secured_enrollment_quota_id':int})
-vacancies = pd.read_csv(processed_dir+'vacancies.csv')
-applications = pd.read_csv(processed_dir+'applications.csv')
-priority_profiles = pd.read_csv(processed_dir+'priority_profiles.csv')
-quota_order = pd.read_csv(processed_dir+'quota_order.csv')
-siblings = pd.read_csv(processed_dir+'siblings.csv')
-links = pd.read_csv(processed_dir+'links.csv')
+applicants = prepared.applicants
+vacancies = prepared.vacancies
+applications = prepared.applications
+priority_profiles = prepared.priority_profiles
+quota_order = prepared.quota_order
+siblings = prepared.siblings
+links = prepared.links
 
 
 # In case lotteries don't come with the data
@@ -47,16 +48,7 @@ results = da(vacancies=vacancies,
             forced_secured_enrollment_assignment= False,
             transfer_capacity_activation= True)
 
-asignaciones, applications_with_lottery = output_preparation(results, applications, dir)
+asignaciones, applications_with_lottery = output_preparation(results, applications, prepared=prepared)
 
 asignaciones.to_csv(dir+'asignaciones.csv',index=False)
 applications_with_lottery.to_csv(dir+'lottery_numbers.csv',index=False)
-
-os.remove(processed_dir+'applicants.csv')
-os.remove(processed_dir+'vacancies.csv')
-os.remove(processed_dir+'applications.csv')
-os.remove(processed_dir+'priority_profiles.csv')
-os.remove(processed_dir+'quota_order.csv')
-os.remove(processed_dir+'siblings.csv')
-os.remove(processed_dir+'links.csv')
-os.rmdir(processed_dir)
\ No newline at end of file
@@ -1,5 +1,8 @@
-from cb_da.entities.applicants_queue import Applicant_Queue
+from cb_da.entities.applicants_queue import Applicant_Queue, Heap_Applicant_Queue
 from cb_da.entities.applicants import Applicant
 from cb_da.entities.match import DeferredAcceptanceAlgorithm
+from cb_da.entities.match_stats import MatchingStats
+from cb_da.entities.array_match import ArrayDeferredAcceptanceAlgorithm, RoundDeferredAcceptanceAlgorithm
 from cb_da.entities.policymaker import PolicyMaker
 from cb_da.entities.programs import Program
+from cb_da.entities.simulator import AssignmentSimulator, SimulationResults, simulate_assignment
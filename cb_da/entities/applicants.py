@@ -25,6 +25,20 @@ eval_dict={'<':operator.lt,
 
 
 class Applicant():
+    # Fixed attributes, without a __dict__ per applicant. Applicant
+    # characteristics get their own slots in the subclasses returned by
+    # get_applicant_class.
+    __slots__ = ('__id', '__special_assignment', '__grade', '__vsiblings',
+                 '__vlinks', '__vdistance', '__original_vpostulation',
+                 '__original_vinstitution_id', '__original_vquota_id',
+                 '__positions', '__original_scores', '__original_priorities',
+                 '__original_priority_profiles', '__se_program_id',
+                 '__se_quota_id', 'vpostulation', 'vinstitution_id',
+                 'vquota_id', 'scores', 'priorities', 'priority_profiles',
+                 'option_n', 'match', 'dynamic_priority', 'linked_postulation',
+                 'assigned_vacancy', 'linked_postulation_bool',
+                 'cut_postulation', 'reassign_quota_order', 'linked_grades')
+
     def __init__(self,
                  applicant_id: Any,
                  special_assignment: int,
@@ -60,7 +74,9 @@ class Applicant():
             se_program_id (int): 0 or program_id
             se_quota_id (int): 0 or quota_id
             applicant_characteristics (dict, optional): Dictionary with
-                aditional characteristics needed for the assignment
+                aditional characteristics needed for the assignment. The
+                applicant must be built with the class returned by
+                get_applicant_class for these characteristics.
         '''
         self.__id = applicant_id
         self.__special_assignment = special_assignment
@@ -71,17 +87,13 @@ class Applicant():
         self.__original_vpostulation = vpostulation
         self.__original_vinstitution_id = vinstitution_id
         self.__original_vquota_id = vquota_id
-        # self.__original_vpostulation_scores = {(program_id,quota_id):postulation_score for program_id,quota_id,postulation_score in zip(vpostulation,vquota_id,vpostulation_scores)}
-        # self.__original_vpriorities = {(program_id,quota_id):priority for program_id,quota_id,priority in zip(vpostulation,vquota_id,vpriorities)}
-        aux_dict_1 = {program_id:{} for program_id in vpostulation}
-        for program_id,quota_id,postulation_score in zip(vpostulation,vquota_id,vpostulation_scores):
-            aux_dict_1[program_id].update({quota_id:postulation_score})
-        self.__original_vpostulation_scores = aux_dict_1
-        aux_dict_2 = {program_id:{} for program_id in vpostulation}
-        for program_id,quota_id,priority in zip(vpostulation,vquota_id,vpriorities):
-            aux_dict_2[program_id].update({quota_id:priority})
-        self.__original_vpriorities = aux_dict_2
-        self.__original_vpriority_profile = {program_id:priority_profiles for program_id,priority_profiles in zip(vpostulation,vpriority_profile)}
+        # Scores, priorities and priority profiles are kept in arrays aligned
+        # with the original applications, and found by (program_id, quota_id)
+        self.__positions = {pointer:position for position,pointer
+            in enumerate(zip(vpostulation,vquota_id))}
+        self.__original_scores = np.array(vpostulation_scores)
+        self.__original_priorities = np.array(vpriorities)
+        self.__original_priority_profiles = np.array(vpriority_profile)
         self.__se_program_id = se_program_id if (se_program_id!=0) else None
         self.__se_quota_id = se_quota_id if (se_program_id!=0) else None
 
@@ -89,7 +101,6 @@ class Applicant():
             self._unpack_applicant_characteristics(applicant_characteristics)
 
         self._reset_matching_attributes()
-        # self._init_priority_and_score_method()
 
 
     @property
@@ -124,20 +135,126 @@ class Applicant():
     def se_quota_id(self):
         return self.__se_quota_id
 
+    @property
+    def vpostulation_scores(self) -> Dict[Any, Dict[int, float]]:
+        '''
+        Scores as {program_id: {quota_id: score}}. Built on each call, use
+        get_score in the matching.
+        '''
+        return self._by_program_and_quota(self.scores)
+
+    @property
+    def vpriorities(self) -> Dict[Any, Dict[int, int]]:
+        '''
+        Priorities as {program_id: {quota_id: priority}}. Built on each call,
+        use get_score in the matching.
+        '''
+        return self._by_program_and_quota(self.priorities)
+
+    @property
+    def vpriority_profile(self) -> Dict[Any, int]:
+        '''
+        Priority profiles as {program_id: priority_profile}.
+        '''
+        return {program_id:priority_profile for program_id,priority_profile
+            in zip(self.__original_vpostulation,self.priority_profiles)}
+
+    def get_score(self, program_id, quota_id) -> float:
+        '''
+        Score plus priority of the application to program_id and quota_id.
+
+        Args:
+            program_id (Any): Hashable present in vpostulation
+            quota_id (int): Quota of the application
+
+        Returns:
+            float: score plus priority
+        '''
+        position = self.__positions[(program_id, quota_id)]
+        return self.scores[position] + self.priorities[position]
+
+    def _by_program_and_quota(self, values) -> Dict[Any, Dict[int, Any]]:
+        '''
+        Nested dict {program_id: {quota_id: value}} of an array aligned with
+        the original applications.
+        '''
+        nested = {program_id:{} for program_id in self.__original_vpostulation}
+        for (program_id,quota_id),position in self.__positions.items():
+            nested[program_id][quota_id] = values[position]
+        return nested
+
 
     def modify_original_vpostulation_scores(
             self,
             program_id,quota_id,lottery) -> None:
         '''
-        Modifies the original_vpostulation_scores and sets new_vpostulation_scores as score
+        Sets lottery as the original score of the application to program_id
+        and quota_id.
 
         Args:
-            original_vpostulation_scores_to_be_transfered (int): Capacity to be added
+            program_id (Any): Hashable present in vpostulation
+            quota_id (int): Quota of the application
+            lottery (float): New score
         '''
-        # self.__original_vpostulation_scores[(program_id,quota_id)] = lottery
-        self.__original_vpostulation_scores[program_id][quota_id] = lottery
+        if self.scores is self.__original_scores:
+            # The current scores keep their values until the next reset
+            self.scores = self.scores.copy()
+        self.__original_scores[self.__positions[(program_id, quota_id)]] = \
+            lottery
 
 
+    def extend_postulation(
+            self,
+            vpostulation: List[Any],
+            vinstitution_id: List[Any],
+            vquota_id: List[int],
+            vpostulation_scores: List[float],
+            vpriorities: List[int],
+            vpriority_profile: List[int],
+            vdistance: List[int]) -> None:
+        '''
+        Appends applications after the original ones, as the least
+        preferred. The current postulation keeps its order and gets them at
+        the end too (see DistanceTails).
+
+        Args:
+            vpostulation (List[Any]): List of program_id where to apply
+            vinstitution_id (List[Any]): List of institution_id
+            vquota_id (List[int]): List of quotas
+            vpostulation_scores (List[float]): List of scores
+            vpriorities (List[int]): List of priorities
+            vpriority_profile (List[int]): List of priority profiles
+            vdistance (List[int]): 1 for applications imputed by distance
+        '''
+        n_original = len(self.__original_vpostulation)
+        for position,pointer in enumerate(zip(vpostulation,vquota_id)):
+            self.__positions[pointer] = n_original+position
+
+        def extended(current, original, values):
+            new_original = np.concatenate([original, values])
+            if current is original:
+                return new_original, new_original
+            return np.concatenate([current, values]), new_original
+
+        self.vpostulation, self.__original_vpostulation = extended(
+            self.vpostulation, self.__original_vpostulation, vpostulation)
+        self.vinstitution_id, self.__original_vinstitution_id = extended(
+            self.vinstitution_id, self.__original_vinstitution_id,
+            vinstitution_id)
+        self.vquota_id, self.__original_vquota_id = extended(
+            self.vquota_id, self.__original_vquota_id, vquota_id)
+        self.scores, self.__original_scores = extended(
+            self.scores, self.__original_scores, vpostulation_scores)
+        self.priorities, self.__original_priorities = extended(
+            self.priorities, self.__original_priorities, vpriorities)
+        self.priority_profiles, self.__original_priority_profiles = extended(
+            self.priority_profiles, self.__original_priority_profiles,
+            vpriority_profile)
+        self.__vdistance = np.concatenate([np.asarray(self.__vdistance),
+                                           vdistance])
+        self.dynamic_priority = self.dynamic_priority + \
+            [False]*len(vpostulation)
+
     def _unpack_applicant_characteristics(
             self,
             applicant_characteristics) -> None:
@@ -151,18 +268,25 @@ class Applicant():
         # for columns,value in applicant_characteristics.iteritems():
         #     setattr(self, columns, value)
         for key,value in applicant_characteristics.items():
-            setattr(self, key, value)
+            try:
+                setattr(self, key, value)
+            except AttributeError:
+                raise ValueError(f'Applicant characteristic {key} has no slot.\
+                 Build the applicant with get_applicant_class.')
 
     def _reset_matching_attributes(self) -> None:
         '''
         Reset all attributes related to matching algorithm.
         '''
-        self.vpostulation = self.__original_vpostulation.copy()
-        self.vinstitution_id = self.__original_vinstitution_id.copy()
-        self.vquota_id = self.__original_vquota_id.copy()
-        self.vpostulation_scores = self.__original_vpostulation_scores.copy()
-        self.vpriorities = self.__original_vpriorities.copy()
-        self.vpriority_profile = self.__original_vpriority_profile.copy()
+        # The arrays are shared with the original ones until they are
+        # modified in place, and then copied (see reorder_postulation_by_quota
+        # and reasign_priority_profile)
+        self.vpostulation = self.__original_vpostulation
+        self.vinstitution_id = self.__original_vinstitution_id
+        self.vquota_id = self.__original_vquota_id
+        self.scores = self.__original_scores
+        self.priorities = self.__original_priorities
+        self.priority_profiles = self.__original_priority_profiles
         self.option_n = 0
         self.match = False
         self.dynamic_priority = [False]*len(self.vpostulation)
@@ -188,13 +312,18 @@ class Applicant():
         '''
         program_id = self.vpostulation[index]
         quota_id = self.vquota_id[index]
+        position = self.__positions[(program_id, quota_id)]
+        if self.priorities is self.__original_priorities:
+            self.priorities = self.priorities.copy()
+            self.priority_profiles = self.priority_profiles.copy()
         priority_profile = self.vpriority_profile[program_id]
         new_priority_profile = \
             transition['priority_profile_sibling_transition'][priority_profile]
-        self.vpriority_profile[program_id] = new_priority_profile
-        # self.vpriorities[(program_id,quota_id)] = \
-        #     transition[f'priority_q{quota_id}'][new_priority_profile]
-        self.vpriorities[program_id][quota_id] = \
+        # The priority profile is the same for all the quotas of the program
+        self.priority_profiles[
+            np.asarray(self.__original_vpostulation)==program_id] = \
+            new_priority_profile
+        self.priorities[position] = \
             transition[f'priority_q{quota_id}'][new_priority_profile]
         self.dynamic_priority[index] = True
 
@@ -279,6 +408,7 @@ class Applicant():
             ordered_quotas (List): List containing the proper quota order.
         '''
         indexes_to_modify = np.where(self.vpostulation==program_id)[0]
+        self.vquota_id = self.vquota_id.copy()
         if len(indexes_to_modify)!=len(ordered_quotas):
             postulation_quotas = self.vquota_id[indexes_to_modify]
             self.vquota_id[indexes_to_modify]=[q for q in ordered_quotas if q in postulation_quotas]
@@ -286,24 +416,25 @@ class Applicant():
             self.vquota_id[indexes_to_modify]=ordered_quotas
 
 
-    def _init_priority_and_score_method(self):
-        '''
-        '''
-        unique_scores = list(set(self.__original_vpostulation_scores.values()))
-        if len(unique_scores)==1:
-            def get_vpostulation_scores(*args):
-                return unique_scores[0]
-            self.get_vpostulation_scores = get_vpostulation_scores
-            return
-        unique_vpostulation = np.unique(self.__original_vpostulation)
-        if len(unique_scores)==len(unique_vpostulation):
-            aux_dict = {program_id:postulation_score for (program_id,quota_id),postulation_score in self.__original_vpostulation_scores.items()}
-            def get_vpostulation_scores(pointer):
-                return aux_dict[pointer[0]]
-            self.get_vpostulation_scores = get_vpostulation_scores
-            return
-        else:
-            def get_vpostulation_scores(pointer):
-                return self.__original_vpostulation_scores[pointer]
-            self.get_vpostulation_scores = get_vpostulation_scores
-        return
+_applicant_classes = {}
+
+
+def get_applicant_class(characteristics: List[str]) -> type:
+    '''
+    Returns Applicant, or a subclass of Applicant with a slot for each
+    applicant characteristic. Subclasses are cached by characteristics, so
+    all the applicants with the same characteristics share their class.
+
+    Args:
+        characteristics (List[str]): Names of the applicant characteristics
+
+    Returns:
+        type: Applicant class
+    '''
+    characteristics = tuple(characteristics)
+    if len(characteristics) == 0:
+        return Applicant
+    if characteristics not in _applicant_classes:
+        _applicant_classes[characteristics] = type(
+            'Applicant', (Applicant,), {'__slots__': characteristics})
+    return _applicant_classes[characteristics]
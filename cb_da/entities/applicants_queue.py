@@ -6,6 +6,8 @@ Company: Consilium Bots Inc.
 Modified By: Benjamín Madariaga at b.madariaga.e@gmail.com
 '''
 
+import heapq
+
 from cb_da.entities.applicants import Applicant
 
 
@@ -40,6 +42,26 @@ class Applicant_Queue:
         '''
         self.__capacity = self.__capacity + capacity_to_be_transfered
 
+    def modify_original_capacity(
+            self,
+            capacity: int) -> None:
+        '''
+        Sets a new original capacity, which is kept by reset_assignment, and
+        the current capacity.
+
+        Args:
+            capacity (int): New capacity
+        '''
+        self.__original_capacity = capacity
+        self.__capacity = capacity
+
+    def restore_capacity(self) -> None:
+        '''
+        Sets the capacity back to the original capacity, undoing the
+        transfers of capacity.
+        '''
+        self.__capacity = self.__original_capacity
+
     def modify_over_capacity(
             self,
             capacity_to_be_transfered: int):
@@ -137,6 +159,34 @@ class Applicant_Queue:
         self.vassigned_applicants[self.vassigned_applicants.index(
             old_applicant)] = new_applicant
 
+    def remove_applicant_from_program(
+            self,
+            applicant: Applicant) -> None:
+        '''
+        Removes applicant and his/her score from the queue.
+
+        Args:
+            applicant (Applicant): Assigned applicant to remove
+        '''
+        slot = self.vassigned_applicants.index(applicant)
+        self.vassigned_applicants.pop(slot)
+        self.vassigned_scores.pop(slot)
+
+    def set_assignment(
+            self,
+            vassigned_applicants,
+            vassigned_scores) -> None:
+        '''
+        Replace vassigned_applicants and vassigned_scores. Used by matching
+        engines that run outside the queue and write the result back.
+
+        Args:
+            vassigned_applicants (List[Applicant]): Applicants by slot
+            vassigned_scores (List[float]): Scores by slot
+        '''
+        self.vassigned_applicants = list(vassigned_applicants)
+        self.vassigned_scores = list(vassigned_scores)
+
     def reset_assignment(self) -> None:
         '''
         Reset all attributes related to matching.
@@ -146,3 +196,136 @@ class Applicant_Queue:
         self.vassigned_applicants = []
         self.vassigned_scores = []
         self.tranfer_capacity = False
+
+
+class Heap_Applicant_Queue(Applicant_Queue):
+    def __init__(self,
+                capacity: int):
+        '''
+        Init a Heap_Applicant_Queue class. Same interface as Applicant_Queue,
+        but the worst admitted applicant is kept at the top of a max-heap, so
+        the cut off lookup and the eviction cost O(log capacity) instead of
+        O(capacity).
+
+        vassigned_applicants and vassigned_scores are kept aligned by slot, as
+        in Applicant_Queue. Heap entries are (-score, slot, applicant), so ties
+        in score are broken by the lowest slot, which is the same applicant
+        that list.index returns in Applicant_Queue.
+
+        Args:
+            capacity (int): Queue capacity
+        '''
+        super().__init__(capacity)
+
+    def add_score_to_program(self, score: float) -> None:
+        '''
+        Appends a float to vassigned_scores array and pushes it to the heap
+        with the applicant in the same slot. It must be called after
+        add_applicant_to_program.
+
+        Args:
+            score (float): Score to append
+        '''
+        slot = len(self.vassigned_scores)
+        self.vassigned_scores.append(score)
+        heapq.heappush(self._heap,
+                        (-score, slot, self.vassigned_applicants[slot]))
+
+    def get_cut_off_score(self) -> float:
+        '''
+        If the queue has capacity and it is filled, returns the highest score
+        from the top of the heap.
+
+        Returns:
+            float: cut off score
+        '''
+        # First case: 0 vacancies. -> Return inf
+        if (self.capacity == 0):
+            return float('inf')
+
+        # Second case: capacity constrains -> Return top of the heap.
+        if self.check_capacity_contraints():
+            return -self._heap[0][0]
+
+        # Third case: no capacity constrains -> Return 0.
+        else:
+            return 0
+
+    def get_cut_off_applicant(self, cut_off_score: float) -> Applicant:
+        '''
+        Returns the Applicant instance at the top of the heap, associated
+        with cut_off_score.
+
+        Args:
+            cut_off_score (float): Score at the top of the heap.
+
+        Returns:
+            Applicant: Applicant asociated with cut_off_score.
+        '''
+        return self._heap[0][2]
+
+    def reassign_applicants_and_scores(
+            self,
+            new_applicant,
+            new_score: float,
+            old_applicant) -> None:
+        '''
+        Replace the position of old_applicant with new_applicant and new_score
+        in vassigned_scores, vassigned_applicants and the heap.
+
+        Args:
+            new_applicant (Applicant): Applicant te be added
+            new_score (float): Score to be added
+            old_applicant (Applicant): Applicant to remove
+        '''
+        if self._heap[0][2] is old_applicant:
+            slot = self._heap[0][1]
+            heapq.heapreplace(self._heap, (-new_score, slot, new_applicant))
+        else:
+            # old_applicant is not the cut off applicant. Rebuild the heap.
+            slot = self.vassigned_applicants.index(old_applicant)
+            position = [entry[1] for entry in self._heap].index(slot)
+            self._heap[position] = (-new_score, slot, new_applicant)
+            heapq.heapify(self._heap)
+        self.vassigned_scores[slot] = new_score
+        self.vassigned_applicants[slot] = new_applicant
+
+    def remove_applicant_from_program(
+            self,
+            applicant: Applicant) -> None:
+        '''
+        Removes applicant and his/her score from the queue and rebuilds the
+        heap, since the slots after the removed one change.
+
+        Args:
+            applicant (Applicant): Assigned applicant to remove
+        '''
+        super().remove_applicant_from_program(applicant)
+        self.set_assignment(self.vassigned_applicants, self.vassigned_scores)
+
+    def set_assignment(
+            self,
+            vassigned_applicants,
+            vassigned_scores) -> None:
+        '''
+        Replace vassigned_applicants and vassigned_scores and rebuild the heap.
+
+        Args:
+            vassigned_applicants (List[Applicant]): Applicants by slot
+            vassigned_scores (List[float]): Scores by slot
+        '''
+        super().set_assignment(vassigned_applicants, vassigned_scores)
+        self._heap = [(-score, slot, applicant) for slot, (applicant, score)
+            in enumerate(zip(self.vassigned_applicants, self.vassigned_scores))]
+        heapq.heapify(self._heap)
+
+    def reset_assignment(self) -> None:
+        '''
+        Reset all attributes related to matching.
+        '''
+        super().reset_assignment()
+        self._heap = []
+
+
+queue_types = {'list': Applicant_Queue,
+                'heap': Heap_Applicant_Queue}
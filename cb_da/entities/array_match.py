@@ -0,0 +1,447 @@
+'''
+File: array_match.py
+Created Date: Monday October 12th 2026
+Author: Benjamín Madariaga
+Company: Consilium Bots Inc.
+'''
+
+from typing import Any, Dict, Tuple
+import heapq
+
+import numpy as np
+
+from cb_da.entities.programs import Program
+from cb_da.entities.applicants import Applicant
+
+
+class ArrayDeferredAcceptanceAlgorithm:
+    '''
+    Deferred Acceptance over integer indices. Each call to run compiles the
+    applicants of the round into flat arrays (CSR preference lists, integer
+    scores per edge and a capacity array per program and assignment type),
+    runs the proposals over those arrays and writes the matching back into
+    the Applicant and Program objects, so PolicyMaker can apply the same
+    adjustments between rounds as with DeferredAcceptanceAlgorithm.
+
+    Proposals are processed in the same order as DeferredAcceptanceAlgorithm
+    and ties are broken the same way, so both engines return the same
+    matching.
+    '''
+    def __init__(self):
+        # Proposals, rejections and longest rejection chain of the last run
+        self.run_stats = {}
+
+    def run(self,
+            applicants: Dict[int, Applicant],
+            programs: Dict[Tuple[int, int], Program]) -> None:
+        '''
+        Run Deferred Acceptance matching algorithm
+
+        Args:
+            applicants (dict): Applicants to be matched
+            programs (dict): Programs to be matched
+        '''
+        compiled = self.compile(applicants, programs)
+        state = self.run_proposals(compiled)
+        self.run_stats = state['run_stats']
+        self.write_back(compiled, state)
+
+    def compile(self,
+            applicants: Dict[int, Applicant],
+            programs: Dict[Tuple[int, int], Program]) -> Dict[str, Any]:
+        '''
+        Build the arrays of the round. Applicants already assigned to the
+        queues involved in the round are compiled too, since they can be
+        rejected and propose again.
+
+        Args:
+            applicants (dict): Applicants to be matched
+            programs (dict): Programs to be matched
+
+        Returns:
+            Dict[str, Any]: Compiled round
+        '''
+        applicants_list = list(applicants.values())
+        applicant_index = {id(applicant): i
+            for i, applicant in enumerate(applicants_list)}
+        queue_index = {}
+        queues = []
+        queues_program = []
+        edge_queue = []
+        edge_score = []
+        lengths = []
+
+        def get_queue(program_pointer, assignment_type):
+            key = (program_pointer, assignment_type)
+            if key not in queue_index:
+                try:
+                    program = programs[program_pointer]
+                except KeyError:
+                    raise ValueError(f'Error while assigning applicant\
+                        :{applicant.id} to program:{program_pointer}')
+                queue_index[key] = len(queues)
+                queues.append(program.get_assignment_type_queue(
+                    assignment_type=assignment_type))
+                queues_program.append(program)
+            return queue_index[key]
+
+        a = 0
+        scanned_queues = 0
+        while a < len(applicants_list):
+            applicant = applicants_list[a]
+            vpostulation = applicant.vpostulation
+            vquota_id = applicant.vquota_id
+            for program_id, quota_id in zip(vpostulation, vquota_id):
+                edge_queue.append(get_queue((program_id, quota_id),
+                                            applicant.special_assignment))
+                edge_score.append(applicant.get_score(program_id, quota_id))
+            lengths.append(len(vpostulation))
+            a += 1
+            if a == len(applicants_list):
+                # Applicants already assigned to the queues of the round.
+                for queue in queues[scanned_queues:]:
+                    for holder in queue.vassigned_applicants:
+                        if id(holder) not in applicant_index:
+                            applicant_index[id(holder)] = \
+                                len(applicants_list)
+                            applicants_list.append(holder)
+                scanned_queues = len(queues)
+
+        holder_queue = []
+        holder_slot = []
+        holder_applicant = []
+        holder_score = []
+        for q, queue in enumerate(queues):
+            for slot, (holder, score) in enumerate(
+                    zip(queue.vassigned_applicants, queue.vassigned_scores)):
+                holder_queue.append(q)
+                holder_slot.append(slot)
+                holder_applicant.append(applicant_index[id(holder)])
+                holder_score.append(score)
+
+        indptr = np.zeros(len(applicants_list) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(lengths)
+        edge_score = np.array(edge_score, dtype=float)
+        holder_score = np.array(holder_score, dtype=float)
+        # Integer scores: equal floats get equal ranks.
+        _, ranks = np.unique(np.concatenate([edge_score, holder_score]),
+                                return_inverse=True)
+        capacity = np.array([queue.capacity for queue in queues],
+                                dtype=np.int64)
+
+        return {'applicants': applicants_list,
+                'n_proposing': len(applicants),
+                'queues': queues,
+                'queues_program': queues_program,
+                'indptr': indptr,
+                'edge_queue': np.array(edge_queue, dtype=np.int64),
+                'edge_score': edge_score,
+                'edge_rank': ranks[:len(edge_score)],
+                'capacity': capacity,
+                'holder_queue': np.array(holder_queue, dtype=np.int64),
+                'holder_slot': np.array(holder_slot, dtype=np.int64),
+                'holder_applicant': np.array(holder_applicant,
+                                                dtype=np.int64),
+                'holder_score': holder_score,
+                'holder_rank': ranks[len(edge_score):]}
+
+    @staticmethod
+    def run_proposals(compiled: Dict[str, Any]) -> Dict[str, Any]:
+        '''
+        Applicant proposing Deferred Acceptance over the compiled arrays.
+        Each queue is a max-heap of (-rank, slot, applicant), as in
+        Heap_Applicant_Queue.
+
+        Args:
+            compiled (Dict[str, Any]): Output of compile
+
+        Returns:
+            Dict[str, Any]: Final state of applicants and queues
+        '''
+        applicants = compiled['applicants']
+        indptr = compiled['indptr'].tolist()
+        edge_queue = compiled['edge_queue'].tolist()
+        edge_rank = compiled['edge_rank'].tolist()
+        edge_score = compiled['edge_score'].tolist()
+        capacity = compiled['capacity'].tolist()
+        n_queues = len(capacity)
+
+        option = [applicant.option_n for applicant in applicants]
+        match = [applicant.match for applicant in applicants]
+        # Queue index of the assigned vacancy, -1 for None and -2 for the
+        # assigned vacancy before the round.
+        assigned = [-2]*len(applicants)
+        slot_applicant = [[] for _ in range(n_queues)]
+        slot_score = [[] for _ in range(n_queues)]
+        heaps = [[] for _ in range(n_queues)]
+        for q, slot, a, rank, score in zip(
+                compiled['holder_queue'].tolist(),
+                compiled['holder_slot'].tolist(),
+                compiled['holder_applicant'].tolist(),
+                compiled['holder_rank'].tolist(),
+                compiled['holder_score'].tolist()):
+            slot_applicant[q].append(a)
+            slot_score[q].append(score)
+            heaps[q].append((-rank, slot, a))
+        for heap in heaps:
+            heapq.heapify(heap)
+        waitlist = []
+        proposals = 0
+        chain = 0
+        longest_chain = 0
+
+        remaining_proposals = list(range(compiled['n_proposing']))
+        while len(remaining_proposals) > 0:
+            a = remaining_proposals.pop()
+            if match[a]:
+                continue
+            proposals += 1
+            if option[a] >= indptr[a+1] - indptr[a]:
+                raise ValueError(f'Error while assigning applicant\
+                    :{applicants[a].id}. There are no options left.')
+            e = indptr[a] + option[a]
+            q = edge_queue[e]
+            rank = edge_rank[e]
+            rejected = -1
+            if capacity[q] == 0:
+                rejected = a
+                rejected_score = edge_score[e]
+            elif (capacity[q] > len(slot_applicant[q])) or \
+                    (slot_score[q][heaps[q][0][1]] == 0):
+                # A cut off score of 0 is taken as free capacity, as in
+                # Applicant_Queue.get_cut_off_score.
+                match[a] = True
+                assigned[a] = q
+                heapq.heappush(heaps[q], (-rank, len(slot_applicant[q]), a))
+                slot_applicant[q].append(a)
+                slot_score[q].append(edge_score[e])
+            elif -heaps[q][0][0] <= rank:
+                rejected = a
+                rejected_score = edge_score[e]
+            else:
+                slot = heaps[q][0][1]
+                _, _, rejected = heapq.heapreplace(heaps[q],
+                                                    (-rank, slot, a))
+                rejected_score = slot_score[q][slot]
+                match[a] = True
+                assigned[a] = q
+                slot_applicant[q][slot] = a
+                slot_score[q][slot] = edge_score[e]
+            if rejected >= 0:
+                waitlist.append((q, rejected, rejected_score))
+                chain += 1
+                if chain > longest_chain:
+                    longest_chain = chain
+                option[rejected] += 1
+                if option[rejected] < indptr[rejected+1] - indptr[rejected]:
+                    match[rejected] = False
+                    assigned[rejected] = -1
+                    remaining_proposals.append(rejected)
+                else:
+                    chain = 0
+                    match[rejected] = True
+                    assigned[rejected] = -1
+            else:
+                chain = 0
+
+        return {'option': option,
+                'match': match,
+                'assigned': assigned,
+                'slot_applicant': slot_applicant,
+                'slot_score': slot_score,
+                'waitlist': waitlist,
+                'run_stats': {'proposals': proposals,
+                                'rejections': len(waitlist),
+                                'longest_rejection_chain': longest_chain}}
+
+    @staticmethod
+    def write_back(
+            compiled: Dict[str, Any],
+            state: Dict[str, Any]) -> None:
+        '''
+        Set the matching attributes of Applicant and Program objects from the
+        final state of run_proposals.
+
+        Args:
+            compiled (Dict[str, Any]): Output of compile
+            state (Dict[str, Any]): Output of run_proposals
+        '''
+        applicants = compiled['applicants']
+        queues_program = compiled['queues_program']
+        for applicant, option, match, assigned in zip(applicants,
+                state['option'], state['match'], state['assigned']):
+            applicant.option_n = option
+            applicant.match = match
+            if assigned != -2:
+                applicant.assigned_vacancy = \
+                    queues_program[assigned] if assigned >= 0 else None
+        for queue, slot_applicant, slot_score in zip(compiled['queues'],
+                state['slot_applicant'], state['slot_score']):
+            queue.set_assignment([applicants[a] for a in slot_applicant],
+                                    slot_score)
+        for q, a, score in state['waitlist']:
+            queues_program[q].add_applicant_to_waitlist(applicants[a],
+                                                        score//1)
+
+
+class RoundDeferredAcceptanceAlgorithm(ArrayDeferredAcceptanceAlgorithm):
+    '''
+    Round-synchronous Deferred Acceptance over the compiled arrays. In each
+    round every free applicant proposes to his/her next option at once and
+    each queue keeps its best capacity candidates among the current holders
+    and the new proposers, using np.lexsort. Current holders win ties with
+    new proposers, as in Applicant_Queue.
+
+    Without ties in the scores the result is the same stable matching as
+    DeferredAcceptanceAlgorithm. round_stats keeps the proposals and
+    rejections of each round of the last run. Since a rejected applicant
+    proposes again in the next round, the longest rejection chain is taken
+    as the number of rounds with rejections.
+    '''
+    def __init__(self):
+        super().__init__()
+        self.round_stats = []
+
+    def run_proposals(self, compiled: Dict[str, Any]) -> Dict[str, Any]:
+        '''
+        Round-synchronous Deferred Acceptance over the compiled arrays.
+
+        Args:
+            compiled (Dict[str, Any]): Output of compile
+
+        Returns:
+            Dict[str, Any]: Final state of applicants and queues
+        '''
+        applicants = compiled['applicants']
+        n_applicants = len(applicants)
+        indptr = compiled['indptr']
+        lengths = np.diff(indptr)
+        edge_queue = compiled['edge_queue']
+        edge_rank = compiled['edge_rank']
+        edge_score = compiled['edge_score']
+        capacity = compiled['capacity']
+        n_queues = len(capacity)
+
+        option = np.array([applicant.option_n for applicant in applicants],
+                            dtype=np.int64)
+        match = np.array([applicant.match for applicant in applicants],
+                            dtype=bool)
+        assigned = np.full(n_applicants, -2, dtype=np.int64)
+
+        # Current holder state by applicant. hold_queue is -1 if the
+        # applicant is not in any queue of the round.
+        hold_queue = np.full(n_applicants, -1, dtype=np.int64)
+        hold_rank = np.zeros(n_applicants, dtype=np.int64)
+        hold_score = np.zeros(n_applicants, dtype=float)
+        hold_slot = np.zeros(n_applicants, dtype=np.int64)
+        holder_applicant = compiled['holder_applicant']
+        hold_queue[holder_applicant] = compiled['holder_queue']
+        hold_rank[holder_applicant] = compiled['holder_rank']
+        hold_score[holder_applicant] = compiled['holder_score']
+        hold_slot[holder_applicant] = compiled['holder_slot']
+
+        # Queues over capacity (forced secured enrollment) keep their size.
+        effective_capacity = np.maximum(capacity, np.bincount(
+            compiled['holder_queue'], minlength=n_queues))
+
+        free = np.zeros(n_applicants, dtype=bool)
+        free[:compiled['n_proposing']] = ~match[:compiled['n_proposing']]
+        waitlist = []
+        self.round_stats = []
+
+        while free.any():
+            proposers = np.flatnonzero(free)
+            exhausted = option[proposers] >= lengths[proposers]
+            if exhausted.any():
+                raise ValueError(f'Error while assigning applicant\
+                    :{applicants[proposers[exhausted][0]].id}. There are no\
+                    options left.')
+            edges = indptr[proposers] + option[proposers]
+            proposal_queue = edge_queue[edges]
+
+            # Proposals to queues with no capacity are rejected.
+            closed = capacity[proposal_queue] == 0
+            rejected = [proposers[closed]]
+            rejected_queue = [proposal_queue[closed]]
+            rejected_score = [edge_score[edges[closed]]]
+            proposers = proposers[~closed]
+            edges = edges[~closed]
+            proposal_queue = proposal_queue[~closed]
+
+            # Candidates: holders of the queues with proposals and proposers.
+            # The extra last position is False, for hold_queue == -1.
+            affected = np.zeros(n_queues + 1, dtype=bool)
+            affected[proposal_queue] = True
+            holders = np.flatnonzero(affected[hold_queue])
+            candidate = np.concatenate([holders, proposers])
+            candidate_queue = np.concatenate([hold_queue[holders],
+                                                proposal_queue])
+            candidate_rank = np.concatenate([hold_rank[holders],
+                                                edge_rank[edges]])
+            candidate_score = np.concatenate([hold_score[holders],
+                                                edge_score[edges]])
+            candidate_new = np.concatenate([
+                np.zeros(len(holders), dtype=np.int64),
+                np.ones(len(proposers), dtype=np.int64)])
+            candidate_order = np.concatenate([hold_slot[holders],
+                                                np.arange(len(proposers))])
+
+            order = np.lexsort((candidate_order, candidate_new,
+                                candidate_rank, candidate_queue))
+            sorted_queue = candidate_queue[order]
+            position = np.arange(len(order)) - \
+                np.searchsorted(sorted_queue, sorted_queue, side='left')
+            keep = position < effective_capacity[sorted_queue]
+
+            kept = candidate[order[keep]]
+            hold_queue[kept] = sorted_queue[keep]
+            hold_rank[kept] = candidate_rank[order[keep]]
+            hold_score[kept] = candidate_score[order[keep]]
+            hold_slot[kept] = position[keep]
+            match[kept] = True
+            assigned[kept] = sorted_queue[keep]
+            free[kept] = False
+
+            out = order[~keep]
+            rejected.append(candidate[out])
+            rejected_queue.append(sorted_queue[~keep])
+            rejected_score.append(candidate_score[out])
+            rejected = np.concatenate(rejected)
+            rejected_queue = np.concatenate(rejected_queue)
+            rejected_score = np.concatenate(rejected_score)
+
+            hold_queue[rejected] = -1
+            option[rejected] += 1
+            has_options = option[rejected] < lengths[rejected]
+            match[rejected] = ~has_options
+            assigned[rejected] = -1
+            free[rejected] = has_options
+            waitlist.extend(zip(rejected_queue.tolist(), rejected.tolist(),
+                                rejected_score.tolist()))
+            self.round_stats.append({'round': len(self.round_stats) + 1,
+                                    'proposals': len(edges) + int(closed.sum()),
+                                    'rejections': len(rejected)})
+
+        holders = np.flatnonzero(hold_queue >= 0)
+        holders = holders[np.lexsort((hold_slot[holders],
+                                        hold_queue[holders]))]
+        slot_applicant = [[] for _ in range(n_queues)]
+        slot_score = [[] for _ in range(n_queues)]
+        for a, q, score in zip(holders.tolist(),
+                                hold_queue[holders].tolist(),
+                                hold_score[holders].tolist()):
+            slot_applicant[q].append(a)
+            slot_score[q].append(score)
+
+        return {'option': option.tolist(),
+                'match': match.tolist(),
+                'assigned': assigned.tolist(),
+                'slot_applicant': slot_applicant,
+                'slot_score': slot_score,
+                'waitlist': waitlist,
+                'run_stats': {
+                    'proposals': sum(row['proposals']
+                                        for row in self.round_stats),
+                    'rejections': len(waitlist),
+                    'longest_rejection_chain': sum(
+                        row['rejections'] > 0 for row in self.round_stats)}}
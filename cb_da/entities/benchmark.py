@@ -0,0 +1,240 @@
+'''
+File: benchmark.py
+Created Date: Saturday October 17th 2026
+Author: Benjamín Madariaga
+Company: Consilium Bots Inc.
+'''
+
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import timeit
+from datetime import datetime
+from typing import Any, Dict, List, Sequence
+
+import numpy as np
+import pandas as pd
+
+from cb_da.entities.policymaker import PolicyMaker
+from cb_lottery_maker import lottery_maker
+from entities.data_processing import data_preparation, output_preparation, read_raw_csv
+from entities.distance_preference_imputator import impute_distance_preference
+from entities.synthetic_data import generate_synthetic_data
+
+
+##Settings of a run that change the times of the stages. Runs with different settings are not compared
+RUN_SETTINGS = ["engine", "queue_type", "max_imputed_options", "max_distance", "repeats"]
+
+
+def benchmark_stages(dir: str, type: str, engine: str = "object", queue_type: str = "list",
+                     max_imputed_options: int = None, max_distance: float = None, quiet: bool = True) -> List[Dict[str, Any]]:
+    '''
+    Runs the pipeline of the Tacna scripts over the raw files in dir and times each stage: data_preparation,
+    impute_distance_preference (only with type="calculated_distance", over the raw files, since data_preparation already
+    includes it), lottery_maker, PolicyMaker.__init__, match_applicants_and_programs, get_results and output_preparation.
+    The matching uses linked postulation and transfer capacity, as in the scripts, and engine is used by both the
+    lottery and the matching.
+
+    Returns:
+        List[Dict[str, Any]]: One row per stage with stage, seconds and rows (rows of the output of the stage)
+    '''
+    rows = []
+
+    def timed(stage, method, *args, **kwargs):
+        start = timeit.default_timer()
+        with contextlib.redirect_stdout(io.StringIO()) if quiet else contextlib.nullcontext():
+            output = method(*args, **kwargs)
+        rows.append({"stage": stage, "seconds": timeit.default_timer() - start,
+                     "rows": len(output) if isinstance(output, pd.DataFrame) else None})
+        return output
+
+    processed_dir = timed("data_preparation", data_preparation, dir, type, max_imputed_options=max_imputed_options,
+                          max_distance=max_distance)
+    if type == "calculated_distance":
+        vacancies = pd.read_csv(dir+"vacancies.csv")
+        if "latitud" in vacancies.columns:
+            vacancies = vacancies.rename(columns={"latitud": "latitude"})
+        timed("impute_distance_preference", impute_distance_preference, pd.read_csv(dir+"demand.csv"),
+              pd.read_csv(dir+"postulants.csv"), vacancies, max_imputed_options=max_imputed_options,
+              max_distance=max_distance)
+
+    applicants = pd.read_csv(processed_dir+"applicants.csv", dtype={"secured_enrollment_program_id": int, "secured_enrollment_quota_id": int})
+    vacancies = pd.read_csv(processed_dir+"vacancies.csv")
+    applications = pd.read_csv(processed_dir+"applications.csv")
+    priority_profiles = pd.read_csv(processed_dir+"priority_profiles.csv")
+    quota_order = pd.read_csv(processed_dir+"quota_order.csv")
+    siblings = pd.read_csv(processed_dir+"siblings.csv")
+    links = pd.read_csv(processed_dir+"links.csv")
+
+    def make_lotteries():
+        if type == "no_distance":
+            return lottery_maker(applicants=applicants, applications=applications, siblings=siblings,
+                                 tie_break_method="multiple", tie_break_level="program", sibling_lottery=True, seed=2021,
+                                 engine=engine)
+        with_distance = lottery_maker(applicants=applicants, applications=applications.loc[applications.distance],
+                                      siblings=siblings, tie_break_method="single", sibling_lottery=False, seed=2021,
+                                      engine=engine)
+        without_distance = lottery_maker(applicants=applicants, applications=applications.loc[~applications.distance],
+                                         siblings=siblings, tie_break_method="multiple", tie_break_level="program",
+                                         sibling_lottery=True, seed=2021, engine=engine)
+        return pd.concat((with_distance, without_distance))
+    applications = timed("lottery_maker", make_lotteries)
+
+    config = {"order": "descending",
+              "sibling_priority_activation": False,
+              "linked_postulation_activation": True,
+              "secured_enrollment_assignment": False,
+              "forced_secured_enrollment_assignment": False,
+              "transfer_capacity_activation": True,
+              "queue_type": queue_type,
+              "engine": engine}
+    policy_maker = timed("PolicyMaker.__init__", PolicyMaker, vacancies=vacancies, applicants=applicants,
+                         applications=applications, priority_profiles=priority_profiles, quota_order=quota_order,
+                         siblings=siblings, links=links, config=config)
+    timed("match_applicants_and_programs", policy_maker.match_applicants_and_programs)
+    results = timed("get_results", policy_maker.get_results)
+    timed("output_preparation", output_preparation, results, applications, dir)
+    return rows
+
+
+def run_benchmark(work_dir: str, output_file: str, scales: Sequence[int] = (1000, 10000, 50000),
+                  types: Sequence[str] = ("no_distance", "calculated_distance"), engine: str = "object",
+                  queue_type: str = "list", max_imputed_options: int = None, max_distance: float = None,
+                  seed: int = 0, repeats: int = 1, **generator_kwargs) -> pd.DataFrame:
+    '''
+    Generates synthetic data with n applicants for each n in scales (see generate_synthetic_data, generator_kwargs are
+    passed to it), times each stage of the pipeline with each type of data preparation (see benchmark_stages) and
+    appends the results to output_file as json lines, one line per stage, so runs over time can be compared with
+    compare_benchmark_runs. With repeats > 1 the pipeline runs repeats times and the fastest time of each stage is kept.
+    The files of each scale are written in work_dir.
+
+    Returns:
+        pd.DataFrame: The rows appended to output_file
+    '''
+    run = {"run_id": datetime.now().strftime("%Y%m%d%H%M%S%f"),
+           "commit": _get_commit(),
+           "python": platform.python_version(),
+           "numpy": np.__version__,
+           "pandas": pd.__version__,
+           "engine": engine,
+           "queue_type": queue_type,
+           "max_imputed_options": max_imputed_options,
+           "max_distance": max_distance,
+           "seed": seed,
+           "repeats": repeats}
+    records = []
+    for n_applicants in scales:
+        dir = os.path.join(work_dir, "synthetic_"+str(n_applicants), "")
+        generate_synthetic_data(dir, n_applicants=n_applicants, seed=seed, **generator_kwargs)
+        for type in types:
+            print('>> Benchmark: '+str(n_applicants)+' applicants, '+type)
+            fastest = {}
+            for _ in range(repeats):
+                for row in benchmark_stages(dir, type, engine=engine, queue_type=queue_type,
+                                            max_imputed_options=max_imputed_options, max_distance=max_distance):
+                    if row["stage"] not in fastest or row["seconds"] < fastest[row["stage"]]["seconds"]:
+                        fastest[row["stage"]] = row
+            for row in fastest.values():
+                records.append({**run, "n_applicants": n_applicants, "type": type, **row})
+
+    output_dir = os.path.dirname(output_file)
+    if output_dir and not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    with open(output_file, "a") as file:
+        for record in records:
+            file.write(json.dumps(record)+"\n")
+    return pd.DataFrame(records)
+
+
+def compare_benchmark_runs(output_file: str, baseline: str = None, current: str = None) -> pd.DataFrame:
+    '''
+    Compares the seconds of each stage between two runs of output_file, by default the last two. A ratio above 1 means
+    that the stage got slower. Runs can only be compared when they were made with the same settings (RUN_SETTINGS),
+    otherwise a ValueError is raised.
+
+    Returns:
+        pd.DataFrame: n_applicants, type, stage, baseline and current seconds, and ratio
+    '''
+    results = pd.read_json(output_file, lines=True, dtype={"run_id": str})
+    run_ids = list(dict.fromkeys(results["run_id"]))
+    if current is None:
+        current = run_ids[-1]
+    if baseline is None:
+        if len(run_ids) < 2:
+            raise ValueError('At least two runs are needed to compare.')
+        baseline = run_ids[run_ids.index(current) - 1]
+    settings = {run_id: results.loc[results["run_id"] == run_id].iloc[0].reindex(RUN_SETTINGS) for run_id in (baseline, current)}
+    different = [setting for setting in RUN_SETTINGS
+                 if not (pd.isna(settings[baseline][setting]) and pd.isna(settings[current][setting]))
+                 and settings[baseline][setting] != settings[current][setting]]
+    if different:
+        raise ValueError(f'Runs {baseline} and {current} have different settings: '
+                         + ', '.join(f'{setting} ({settings[baseline][setting]} vs {settings[current][setting]})' for setting in different))
+    keys = ["n_applicants", "type", "stage"]
+    comparison = results.loc[results["run_id"] == baseline, keys+["seconds"]].merge(
+        results.loc[results["run_id"] == current, keys+["seconds"]], how="inner", on=keys,
+        suffixes=("_baseline", "_current"))
+    comparison["ratio"] = comparison["seconds_current"]/comparison["seconds_baseline"]
+    return comparison
+
+
+def benchmark_distance_backends(dir: str, backends: Dict[str, Any], max_imputed_options: int = None,
+                                max_distance: float = None, top: int = 5, quiet: bool = True) -> pd.DataFrame:
+    '''
+    Runs impute_distance_preference over the raw files in dir with each backend (see get_distance_backend) and compares
+    the imputed schools with the ones of the geodesic backend, which is always run first as the reference.
+
+    Args:
+        dir (str): Folder with the raw files of the calculated_distance mode
+        backends (Dict[str, Any]): distance_backend argument of each backend, by name
+        max_imputed_options (int, optional): see impute_distance_preference
+        max_distance (float, optional): see impute_distance_preference
+        top (int): number of imputed schools compared with the reference
+        quiet (bool): hide the output of the imputation
+
+    Returns:
+        pd.DataFrame: One row per backend with seconds, imputed rows, same_nearest (share of postulants with the same
+            nearest imputed school as the reference) and top_overlap (mean share of the first top imputed schools that
+            are also among the first top of the reference)
+    '''
+    demand = read_raw_csv(dir, "demand.csv", "calculated_distance")
+    postulants = read_raw_csv(dir, "postulants.csv", "calculated_distance")
+    vacancies = read_raw_csv(dir, "vacancies.csv", "calculated_distance")
+    if "latitud" in vacancies.columns:
+        vacancies = vacancies.rename(columns={"latitud": "latitude"})
+
+    def first_imputed(imputed):
+        imputed = imputed.loc[imputed["distancePriority"]].sort_values(["postulantId", "order"])
+        return imputed.groupby("postulantId").head(top).groupby("postulantId")["localId"].apply(list)
+
+    rows = []
+    reference = None
+    for name, distance_backend in [("geodesic", None)] + [item for item in backends.items() if item[0] != "geodesic"]:
+        start = timeit.default_timer()
+        with contextlib.redirect_stdout(io.StringIO()) if quiet else contextlib.nullcontext():
+            imputed = impute_distance_preference(demand.copy(), postulants, vacancies, max_imputed_options=max_imputed_options,
+                                                 max_distance=max_distance, distance_backend=distance_backend)
+        seconds = timeit.default_timer() - start
+        schools = first_imputed(imputed)
+        if reference is None:
+            reference = schools
+        both = schools.index.intersection(reference.index)
+        same_nearest = np.mean([schools[i][0] == reference[i][0] for i in both]) if len(both) else np.nan
+        top_overlap = np.mean([len(set(schools[i]) & set(reference[i]))/len(reference[i]) for i in both]) if len(both) else np.nan
+        rows.append({"backend": name, "seconds": seconds, "rows": int(imputed["distancePriority"].sum()),
+                     "same_nearest": same_nearest, "top_overlap": top_overlap})
+    return pd.DataFrame(rows)
+
+
+def _get_commit():
+    '''
+    Returns the git commit of the package, or None if it is not a git repository.
+    '''
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(__file__),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
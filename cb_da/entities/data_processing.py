@@ -5,27 +5,179 @@ import pandas as pd
 import numpy as np
 import os
 import timeit
+import zipfile
 from datetime import datetime
-from entities.distance_preference_imputator import impute_distance_preference
-
-def data_preparation(dir, type):
-    
+from entities.distance_preference_imputator import impute_distance_preference, impute_nearest_distance_preference
+from entities.prepared_cache import prepared_data_key, frames_to_npz, frames_from_npz
+from entities.distance_cache import DistanceCache
+from entities.distance_backends import get_distance_backend
+
+
+##Dtypes of the columns of the raw files. "id" columns are read as int64 and downcast to int32 when all their values fit,
+##so large ids are never truncated. Columns without a dtype (None) are inferred by pandas
+RAW_DTYPES = {
+    "vacancies.csv": {"localId": "id", "serviceId": "id", "annex": "int32", "studentBodyId": "int32", "levelId": "int32", "gradeId": "int32", "shiftId": "int32",
+                      "studentModalityId": "int32", "classroomTypeId": "int32", "totalVacancyNna": "int32", "totalVacancyNnaNee": "int32", "roundNumber": "int32",
+                      "roundType": "category", "latitude": "float64", "latitud": "float64", "longitude": "float64"},
+    "postulations.csv": {"postulantId": "id", "guardianId": None, "typeId": "category"},
+    "postulants.csv": {"postulantId": "id", "priority": "bool", "latitude": "float64", "longitude": "float64"},
+    "demand.csv": {"postulantId": "id", "levelId": "int32", "gradeId": "int32", "order": "int32", "serviceId": "id", "localId": "id", "priority": "bool",
+                   "distancePriority": "bool", "roundTypeId": "category"},
+}
+
+##Columns read from each raw file by each type of preparation. With None all the columns are read (the demand with distance
+##is written back with all its columns)
+VACANCIES_COLUMNS = ["localId", "serviceId", "annex", "studentBodyId", "levelId", "gradeId", "shiftId", "studentModalityId", "classroomTypeId",
+                     "totalVacancyNna", "totalVacancyNnaNee", "roundNumber", "roundType"]
+RAW_COLUMNS = {
+    "no_distance": {"vacancies.csv": VACANCIES_COLUMNS,
+                    "postulations.csv": ["postulantId", "guardianId", "typeId"],
+                    "postulants.csv": ["postulantId", "priority"],
+                    "demand.csv": ["postulantId", "gradeId", "order", "localId", "priority"]},
+    "precalculated_distance": {"vacancies.csv": VACANCIES_COLUMNS,
+                               "postulations.csv": ["postulantId", "guardianId", "typeId"],
+                               "postulants.csv": ["postulantId", "priority"],
+                               "demand.csv": ["postulantId", "gradeId", "order", "localId", "priority", "distancePriority"]},
+    "calculated_distance": {"vacancies.csv": VACANCIES_COLUMNS + ["latitude", "longitude"],
+                            "postulations.csv": ["postulantId", "guardianId", "typeId"],
+                            "postulants.csv": ["postulantId", "priority", "latitude", "longitude"],
+                            "demand.csv": None},
+}
+
+class PreparedData:
+    '''
+    In-memory output of prepare_data. It holds the tables read by lottery_maker and da, and the id mappings used by
+    output_preparation, so they can be passed along without writing and reading csv files. With lazy_distance it also
+    holds the DistanceTails passed to da, which are neither written nor cached.
+    '''
+    def __init__(self, vacancies, applicants, applications, links, siblings, priority_profiles, quota_order, applicant_id_mapping, program_id_mapping, distance_tails=None):
+        self.vacancies = vacancies
+        self.applicants = applicants
+        self.applications = applications
+        self.links = links
+        self.siblings = siblings
+        self.priority_profiles = priority_profiles
+        self.quota_order = quota_order
+        self.applicant_id_mapping = applicant_id_mapping
+        self.program_id_mapping = program_id_mapping
+        self.distance_tails = distance_tails
+
+    def to_csv(self, dir, processed_dir):
+        '''
+        Writes the id mappings to dir and the processed tables to processed_dir, with the file names read by the scripts.
+        '''
+        ##Creating the folder that will host the processed data
+        if not os.path.isdir(processed_dir):
+            os.mkdir(processed_dir)
+
+        self.applicant_id_mapping.to_csv(dir+"applicant_id_mapping_with_grade.csv", index=False)
+        self.program_id_mapping.to_csv(dir+"program_id_mapping.csv", index=False)
+        self.vacancies.to_csv(processed_dir+"vacancies.csv", index=False)
+        self.applicants.to_csv(processed_dir+"applicants.csv", index=False)
+        self.applications.to_csv(processed_dir+"applications.csv", index=False)
+        self.links.to_csv(processed_dir+"links.csv", index=False)
+        self.siblings.to_csv(processed_dir+"siblings.csv", index=False)
+        self.priority_profiles.to_csv(processed_dir+"priority_profiles.csv", index=False)
+        self.quota_order.to_csv(processed_dir+"quota_order.csv", index=False)
+
+    def to_npz(self, path):
+        '''
+        Saves all the tables in a single npz file (see frames_to_npz).
+        '''
+        frames_to_npz(path, {name: df for name, df in vars(self).items() if name != "distance_tails"})
+
+    @classmethod
+    def from_npz(cls, path):
+        '''
+        Loads a PreparedData saved with to_npz.
+        '''
+        return cls(**frames_from_npz(path))
+
+
+def data_preparation(dir, type, max_imputed_options=None, max_distance=None, demand_chunksize=None, distance_cache_dir=None, distance_workers=1,
+                     distance_backend=None):
+    '''
+    Prepares the raw files in dir and writes the processed tables as csv files. Returns the folder with the processed
+    tables. See prepare_data for the arguments.
+    '''
     base_path = os.path.dirname(os.path.dirname(__file__))
+    prepare_data(dir, type, max_imputed_options=max_imputed_options, max_distance=max_distance, write_files=True, demand_chunksize=demand_chunksize,
+                 distance_cache_dir=distance_cache_dir, distance_workers=distance_workers, distance_backend=distance_backend)
+    return base_path+"/processed_data/"
+
 
-    ##Creating the folder that will host the processed data
-    if not os.path.isdir(base_path+"/processed_data/"):
-        os.mkdir(base_path+"/processed_data/")
+def prepare_data(dir, type, max_imputed_options=None, max_distance=None, write_files=False, cache_dir=None, demand_chunksize=None, lazy_distance=False,
+                 distance_cache_dir=None, distance_workers=1, distance_backend=None):
+    '''
+    Prepares the raw files in dir for the lottery and the matching and returns them as a PreparedData. With
+    type="calculated_distance", max_imputed_options and max_distance (km) limit the schools imputed by distance for each
+    postulant (see impute_distance_preference).
+
+    If write_files is True, the processed tables and the id mappings are also written as csv files, for audit.
+
+    If cache_dir is given, the prepared data is saved there as an npz file named after a hash of the raw files and the
+    arguments, and loaded from it in the next runs with the same inputs instead of being prepared again.
+
+    The raw files are read with the dtypes in RAW_DTYPES and only with the columns in RAW_COLUMNS. If demand_chunksize
+    is given, demand.csv is read and transformed into applications by chunks of demand_chunksize rows, so the whole raw
+    demand is never in memory. With type="calculated_distance" the distance imputation needs the whole demand, and only
+    the transformation of the imputed demand is done by chunks. The result does not depend on demand_chunksize.
+
+    With type="calculated_distance" and lazy_distance=True, only the nearest imputed school of each postulant is added to
+    the applications, and the next ones are generated during the matching from prepared.distance_tails (pass it to da as
+    distance_tails). The matching is the same as with all the imputed schools in the applications, with much less
+    memory. The orders of the applications of each postulant must go from 1 to the number of applications, and the
+    lottery of the applications with distance must have a single tie break. It can not be used with cache_dir.
+
+    With type="calculated_distance" and distance_cache_dir, the distances between postulants and schools are kept in a
+    DistanceCache in that folder, and the next runs only compute the distances of new postulant coordinates or new
+    schools, even if the raw files changed. With distance_workers > 1 the distance imputation runs in a pool of
+    distance_workers processes, with the same result.
+
+    distance_backend is the metric of the imputation: None or "geodesic" (straight line over the WGS-84 ellipsoid, the
+    default), "haversine" or a DistanceBackend, such as RoadNetworkBackend.from_csv(nodes_path, edges_path) for the
+    travel distance over a local road network (see impute_distance_preference).
+    '''
+    if lazy_distance and type != "calculated_distance":
+        raise ValueError('lazy_distance is only supported with type="calculated_distance".')
+    if lazy_distance and cache_dir is not None:
+        raise ValueError('lazy_distance can not be used with cache_dir.')
+    base_path = os.path.dirname(os.path.dirname(__file__))
+    distance_backend = get_distance_backend(distance_backend)
 
     print('*******************************************************')
     print('>>>            STARTING DATA PROCESSING.            <<<')
     print('*******************************************************')
     initial = timeit.default_timer()
 
-    ##Loading raw data
-    vacantes = pd.read_csv(dir+'vacancies.csv')
-    postulations = pd.read_csv(dir+'postulations.csv')
-    postulants = pd.read_csv(dir+'postulants.csv')
-    demand = pd.read_csv(dir+'demand.csv')
+    ##Loading the prepared data from the cache, if the raw files and the arguments did not change
+    cache_path = None
+    if cache_dir is not None:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        key = prepared_data_key(dir, type, max_imputed_options=max_imputed_options, max_distance=max_distance, distance_cache=distance_cache_dir is not None,
+                                distance_backend=distance_backend.key)
+        cache_path = os.path.join(cache_dir, "prepared_data_"+key+".npz")
+        prepared = None
+        if os.path.isfile(cache_path):
+            print('>>>           LOADING PREPARED DATA FROM CACHE      <<<')
+            try:
+                prepared = PreparedData.from_npz(cache_path)
+            except (ValueError, KeyError, OSError, zipfile.BadZipFile) as e:
+                ##A file that can not be read is deleted and the data is prepared again
+                print('Prepared data cache discarded: '+str(e))
+                os.remove(cache_path)
+        if prepared is not None:
+            if write_files:
+                prepared.to_csv(dir, base_path+"/processed_data/")
+            elapsed = timeit.default_timer() - initial
+            print('>>>             PROCESSING TIME:  '+format(round(elapsed, 3))+'            <<<')
+            return prepared
+
+    ##Loading raw data, with declared dtypes and only the columns used by this type of preparation
+    vacantes = read_raw_csv(dir, "vacancies.csv", type)
+    postulations = read_raw_csv(dir, "postulations.csv", type)
+    postulants = read_raw_csv(dir, "postulants.csv", type)
 
     ##Checking a spelling error in the vacancies file
     if 'latitud' in vacantes.columns:
@@ -34,9 +186,6 @@ def data_preparation(dir, type):
     ##Initializing dataframes
     vacancies_df = pd.DataFrame()
     applicants_df = pd.DataFrame()
-    applications_df = pd.DataFrame()
-    links_df = pd.DataFrame(columns=["applicant_id", "linked_id"])
-    siblings_df = pd.DataFrame(columns=["applicant_id", "sibling_id"])
     priority_profiles_df = pd.DataFrame(columns=["priority_profile", "priority_q1", "priority_profile_sibling_transition"])
     quota_order_df = pd.DataFrame(columns=["priority_profile", "secured_enrollment_indicator", "secured_enrollment_quota_id_criteria", "secured_enrollment_quota_id_value", "applicant_characteristic_1_criteria", "applicant_characteristic_1_value", "order_q1"])
     applicant_id_mapping_df = pd.DataFrame()
@@ -45,28 +194,47 @@ def data_preparation(dir, type):
 
     ##If distance priority enabled, we need to calculate distances for all students and schools. We do it on the input file demand.csv
     if type == "calculated_distance":
-        demand = impute_distance_preference(demand, postulants, vacantes)
-        priority_profiles_df["priority_profile"] = np.array([1, 2, 3])
-        priority_profiles_df["priority_q1"] = np.array([1, 0, 2])
-        priority_profiles_df["priority_profile_sibling_transition"] = np.array([2, 2, 3])
-    elif type == "precalculated_distance":
+        raw_demand = read_raw_csv(dir, "demand.csv", type)
+        distance_cache = DistanceCache(distance_cache_dir, distance_backend=distance_backend) if distance_cache_dir is not None else None
+        if lazy_distance:
+            ##Only the nearest imputed school of each postulant is added. The next ones come after all his/her applications
+            orders = raw_demand.groupby("postulantId")["order"].agg(["max", "size"])
+            if (orders["max"] > orders["size"]).any():
+                raise ValueError('lazy_distance needs the orders of each postulant to go from 1 to the number of applications.')
+            imputed_demand, distance_tails = impute_nearest_distance_preference(raw_demand, postulants, vacantes, max_imputed_options=max_imputed_options, max_distance=max_distance,
+                                                                                 distance_cache=distance_cache, workers=distance_workers, distance_backend=distance_backend)
+        else:
+            imputed_demand = impute_distance_preference(raw_demand, postulants, vacantes, max_imputed_options=max_imputed_options, max_distance=max_distance,
+                                                        distance_cache=distance_cache, workers=distance_workers, distance_backend=distance_backend)
+        del raw_demand
+        imputed_demand = imputed_demand.reset_index(drop=True)
+        imputed_demand.to_csv(dir+"demand_with_distance_postulations.csv")
+        ##The imputed demand is already in memory, but it is transformed by chunks to avoid full size copies in the merges
+        if demand_chunksize is None:
+            demand_chunks = [imputed_demand]
+        else:
+            demand_chunks = (imputed_demand.iloc[start:start+demand_chunksize] for start in range(0, len(imputed_demand), demand_chunksize))
         priority_profiles_df["priority_profile"] = np.array([1, 2, 3])
         priority_profiles_df["priority_q1"] = np.array([1, 0, 2])
         priority_profiles_df["priority_profile_sibling_transition"] = np.array([2, 2, 3])
     else:
-        priority_profiles_df["priority_profile"] = np.array([1, 2])
-        priority_profiles_df["priority_q1"] = np.array([1, 0])
-        priority_profiles_df["priority_profile_sibling_transition"] = np.array([2, 2])
+        demand_chunks = read_raw_csv(dir, "demand.csv", type, chunksize=demand_chunksize)
+        if demand_chunksize is None:
+            demand_chunks = [demand_chunks]
+        if type == "precalculated_distance":
+            priority_profiles_df["priority_profile"] = np.array([1, 2, 3])
+            priority_profiles_df["priority_q1"] = np.array([1, 0, 2])
+            priority_profiles_df["priority_profile_sibling_transition"] = np.array([2, 2, 3])
+        else:
+            priority_profiles_df["priority_profile"] = np.array([1, 2])
+            priority_profiles_df["priority_q1"] = np.array([1, 0])
+            priority_profiles_df["priority_profile_sibling_transition"] = np.array([2, 2])
 
     ##Creating auxiliary column to identify programs
-    demand["program_autogenerated_code"] = demand["localId"].astype(str) + "/" + demand["gradeId"].astype(str)
     vacantes["program_autogenerated_code"] = vacantes["localId"].astype(str) + "/" + vacantes["gradeId"].astype(str)
-    
 
     ##Using Autoincremental id for applicants and programs. Creating a mapping file for each
-    applicant_id_mapping_df["postulantId"] = postulations["postulantId"]
-    applicant_id_mapping_df = applicant_id_mapping_df.merge(demand.drop_duplicates(subset=["postulantId"])[["postulantId", "gradeId"]], how="left", on="postulantId")
-    applicant_id_mapping_df["applicant_id"] = range(1, len(postulations["postulantId"])+1)
+    postulant_ids = pd.DataFrame({"postulantId": postulations["postulantId"], "applicant_id": range(1, len(postulations["postulantId"])+1)})
 
     program_id_mapping_df["localId"] = vacantes["localId"]
     program_id_mapping_df["serviceId"] = vacantes["serviceId"]
@@ -81,22 +249,40 @@ def data_preparation(dir, type):
     program_id_mapping_df["roundTypeId"] = vacantes["roundType"]
     program_id_mapping_df["program_autogenerated_code"] = vacantes["program_autogenerated_code"]
     program_id_mapping_df["program_id"] = range(1, len(vacantes["localId"])+1)
-    
+
+    ##Imputed schools generated in the matching use the same ids
+    if lazy_distance:
+        distance_tails.set_ids(postulant_ids, program_id_mapping_df[["program_autogenerated_code", "program_id"]])
+    else:
+        distance_tails = None
+
+    ##Demand is transformed into applications by chunks. The grade of each postulant comes from his/her first application
+    applications_chunks = []
+    postulant_grades = []
+    for demand_chunk in demand_chunks:
+        applications_chunk, grades = prepare_applications(demand_chunk, postulant_ids, program_id_mapping_df, type)
+        applications_chunks.append(applications_chunk)
+        postulant_grades.append(grades)
+    applications_df = pd.concat(applications_chunks, ignore_index=True)
+    postulant_grades = pd.concat(postulant_grades).drop_duplicates(subset=["postulantId"])
+
+    applicant_id_mapping_df["postulantId"] = postulations["postulantId"]
+    applicant_id_mapping_df = applicant_id_mapping_df.merge(postulant_grades, how="left", on="postulantId")
+    applicant_id_mapping_df["applicant_id"] = range(1, len(postulations["postulantId"])+1)
+
     ##Inserting new id's to the raw tables
-    postulations = postulations.merge(applicant_id_mapping_df[["postulantId", "applicant_id"]], how="left", on="postulantId")
-    postulants = postulants.merge(applicant_id_mapping_df[["postulantId", "applicant_id"]], how="left", on="postulantId")
-    demand = demand.merge(applicant_id_mapping_df[["postulantId", "applicant_id"]], how="left", on="postulantId")
-    demand = demand.merge(program_id_mapping_df[["program_autogenerated_code", "program_id"]], how="left", on="program_autogenerated_code")
+    postulations = postulations.merge(postulant_ids, how="left", on="postulantId")
+    postulants = postulants.merge(postulant_ids, how="left", on="postulantId")
     vacantes = vacantes.merge(program_id_mapping_df[["program_autogenerated_code", "program_id"]], how="left", on="program_autogenerated_code")
-   
-    ##Creating tables  
+
+    ##Creating tables
     vacancies_df["program_id"] = vacantes["program_id"]
     vacancies_df["quota_id"] = 1
     vacancies_df["institution_id"] = vacantes["localId"]
     vacancies_df["grade_id"] = vacantes["gradeId"]
     vacancies_df["regular_vacancies"] = vacantes["totalVacancyNna"]
     vacancies_df["special_1_vacancies"] = vacantes["totalVacancyNnaNee"]
-    
+
     applicants_df["applicant_id"] = postulants["applicant_id"]
     applicants_df = applicants_df.merge(applicant_id_mapping_df[["applicant_id", "gradeId"]].rename(columns={'gradeId':'grade_id'}), how="left", on="applicant_id")
     applicants_df["special_assignment"] = [1 if priority==True else 0 for priority in postulants["priority"]]
@@ -104,6 +290,83 @@ def data_preparation(dir, type):
     applicants_df["secured_enrollment_quota_id"] = 0
     applicants_df["applicant_characteristics_1"] = 0
 
+    links_df, siblings_df = build_links_and_siblings(postulations)
+
+    prepared = PreparedData(vacancies=vacancies_df,
+                            applicants=applicants_df,
+                            applications=applications_df,
+                            links=links_df,
+                            siblings=siblings_df,
+                            priority_profiles=priority_profiles_df,
+                            quota_order=quota_order_df,
+                            applicant_id_mapping=applicant_id_mapping_df,
+                            program_id_mapping=program_id_mapping_df,
+                            distance_tails=distance_tails)
+
+    ##Saving the processed data
+    if write_files:
+        prepared.to_csv(dir, base_path+"/processed_data/")
+    if cache_path is not None:
+        try:
+            prepared.to_npz(cache_path)
+        except ValueError as e:
+            print('Prepared data not cached: '+str(e))
+
+    elapsed = timeit.default_timer() - initial
+    print('>>>             PROCESSING TIME:  '+format(round(elapsed, 3))+'            <<<')
+
+    return prepared
+
+
+
+def read_raw_csv(dir, file_name, type, chunksize=None):
+    '''
+    Reads a raw file with the dtypes of RAW_DTYPES and the columns that the type of preparation uses (RAW_COLUMNS). In
+    vacancies.csv, latitud is read in place of latitude. With chunksize it returns an iterator of DataFrames.
+    '''
+    header = pd.read_csv(dir+file_name, nrows=0).columns
+    columns = RAW_COLUMNS[type][file_name]
+    if columns is None:
+        columns = list(header)
+    else:
+        columns = [("latitud" if column == "latitude" and column not in header and "latitud" in header else column) for column in columns]
+        missing = [column for column in columns if column not in header]
+        if len(missing) > 0:
+            raise ValueError(f'Missing columns {missing} in {file_name}.')
+    dtypes = RAW_DTYPES[file_name]
+    dtype = {column: ("int64" if dtypes[column] == "id" else dtypes[column]) for column in columns if dtypes.get(column) is not None}
+    id_columns = [column for column in columns if column in dtypes and dtypes[column] in ("id", None)]
+
+    if chunksize is None:
+        return _downcast_ids(pd.read_csv(dir+file_name, usecols=columns, dtype=dtype), id_columns)
+    return (_downcast_ids(chunk, id_columns) for chunk in pd.read_csv(dir+file_name, usecols=columns, dtype=dtype, chunksize=chunksize))
+
+
+def _downcast_ids(df, columns):
+    '''
+    Converts the integer columns to int32 when all their values fit.
+    '''
+    int32 = np.iinfo(np.int32)
+    for column in columns:
+        values = df[column]
+        if values.dtype.kind == "i" and (len(values) == 0 or (values.min() >= int32.min and values.max() <= int32.max)):
+            df[column] = values.astype(np.int32)
+    return df
+
+
+def prepare_applications(demand: pd.DataFrame, postulant_ids: pd.DataFrame, program_id_mapping: pd.DataFrame, type: str):
+    '''
+    Transforms rows of demand into rows of the applications table, with the applicant_id of postulant_ids and the
+    program_id of program_id_mapping. Also returns the grade of the first row of each postulant in demand.
+    '''
+    grades = demand.drop_duplicates(subset=["postulantId"])[["postulantId", "gradeId"]]
+
+    ##Creating auxiliary column to identify programs and inserting the new id's
+    demand = demand.assign(program_autogenerated_code=demand["localId"].astype(str) + "/" + demand["gradeId"].astype(str))
+    demand = demand.merge(postulant_ids, how="left", on="postulantId")
+    demand = demand.merge(program_id_mapping[["program_autogenerated_code", "program_id"]], how="left", on="program_autogenerated_code")
+
+    applications_df = pd.DataFrame()
     applications_df["applicant_id"] = demand["applicant_id"]
     applications_df["program_id"] = demand["program_id"]
     applications_df["quota_id"] = 1
@@ -129,57 +392,47 @@ def data_preparation(dir, type):
         demand.loc[demand["priority"] == True, "priority_profile_program"] = 2
         demand.loc[demand["priority_profile_program"] == 1, "priority_number_quota"] = 1
         demand.loc[demand["priority_profile_program"] == 2, "priority_number_quota"] = 0
-        
+
         applications_df["priority_profile_program"] = demand["priority_profile_program"]
         applications_df["priority_number_quota"] = demand["priority_number_quota"]
 
+    return applications_df, grades
 
-    for index, row in postulations.iterrows():
-        student_id = postulations["applicant_id"][index]
 
-        linked_list = postulations[postulations["guardianId"]==postulations['guardianId'][index]].applicant_id.values
+def build_links_and_siblings(postulations: pd.DataFrame):
+    '''
+    Builds the links and siblings tables from postulations (with applicant_id). Applicants with the same guardianId are
+    siblings of each other, and an applicant is linked to a sibling when the sibling's typeId is "G". Edges are ordered
+    by the postulations row of the applicant and then by the row of the sibling.
+    '''
+    family = postulations[["guardianId", "applicant_id"]].dropna(subset=["guardianId"])
+    family = family.assign(applicant_row=np.arange(len(family)))
 
-        for linked_element in linked_list:
-            if linked_element != student_id:
-                if postulations[postulations["applicant_id"]==linked_element].typeId.values[0] == "G":
-                    instant_linked_df = pd.DataFrame([[student_id, linked_element]], columns=["applicant_id", "linked_id"])
-                    links_df = pd.concat([links_df, instant_linked_df])
+    ##All pairs of applicants with the same guardian, without self-edges
+    pairs = family.merge(family.rename(columns={"applicant_id": "sibling_id", "applicant_row": "sibling_row"}), how="inner", on="guardianId")
+    pairs = pairs[pairs["applicant_id"] != pairs["sibling_id"]].sort_values(by=["applicant_row", "sibling_row"])
 
-        siblings_list = postulations[postulations["guardianId"]==postulations['guardianId'][index]].applicant_id.values
-
-        for siblings_element in siblings_list:
-            if siblings_element != student_id:
-                    instant_sibling_df = pd.DataFrame([[student_id, siblings_element]], columns=["applicant_id", "sibling_id"])
-                    siblings_df = pd.concat([siblings_df, instant_sibling_df])
-    
-    ##Saving the processed data
-    applicant_id_mapping_df.to_csv(dir+"applicant_id_mapping_with_grade.csv", index=False)
-    program_id_mapping_df.to_csv(dir+"program_id_mapping.csv", index=False)
-    vacancies_df.to_csv(base_path+"/processed_data/vacancies.csv", index=False)
-    applicants_df.to_csv(base_path+"/processed_data/applicants.csv", index=False)
-    applications_df.to_csv(base_path+"/processed_data/applications.csv", index=False)
-    links_df.to_csv(base_path+"/processed_data/links.csv", index=False)
-    siblings_df.to_csv(base_path+"/processed_data/siblings.csv", index=False)
-    priority_profiles_df.to_csv(base_path+"/processed_data/priority_profiles.csv", index=False)
-    quota_order_df.to_csv(base_path+"/processed_data/quota_order.csv", index=False)
-    if type == "calculated_distance":
-        demand = demand.drop(columns=['program_autogenerated_code', 'applicant_id',"program_id","priority_profile_program","priority_number_quota"])
-        demand.to_csv(dir+"demand_with_distance_postulations.csv")
-
-    elapsed = timeit.default_timer() - initial
-    print('>>>             PROCESSING TIME:  '+format(round(elapsed, 3))+'            <<<')
-
-    return base_path+"/processed_data/"
+    siblings_df = pairs[["applicant_id", "sibling_id"]].reset_index(drop=True)
 
+    ##The typeId of each applicant is taken from his/her first postulation
+    type_id = postulations.drop_duplicates(subset=["applicant_id"]).set_index("applicant_id")["typeId"]
+    links_df = siblings_df[siblings_df["sibling_id"].map(type_id) == "G"].rename(columns={"sibling_id": "linked_id"}).reset_index(drop=True)
 
+    return links_df, siblings_df
 
-def output_preparation(results: pd.DataFrame, applications: pd.DataFrame, dir):
 
-    base_path = os.path.dirname(os.path.dirname(__file__))
-
-    ##Opening mapping files
-    applicant_mapping = pd.read_csv(dir + "applicant_id_mapping_with_grade.csv")
-    program_mapping = pd.read_csv(dir + "program_id_mapping.csv")
+def output_preparation(results: pd.DataFrame, applications: pd.DataFrame, dir=None, prepared: PreparedData = None):
+    '''
+    Maps the results and the lottery numbers back to the original ids. The id mappings are taken from prepared if it is
+    given, otherwise they are read from the csv files in dir.
+    '''
+    if prepared is not None:
+        applicant_mapping = prepared.applicant_id_mapping
+        program_mapping = prepared.program_id_mapping
+    else:
+        ##Opening mapping files
+        applicant_mapping = pd.read_csv(dir + "applicant_id_mapping_with_grade.csv")
+        program_mapping = pd.read_csv(dir + "program_id_mapping.csv")
 
     results = results.sort_values(by=["program_id"])
     results.loc[results["program_id"] >=0, "assigned"] = True
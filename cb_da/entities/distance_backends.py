@@ -0,0 +1,415 @@
+import abc
+import hashlib
+import heapq
+import numpy as np
+import pandas as pd
+from geopy import distance
+
+
+##WGS-84 ellipsoid, the same one used by geopy.distance.distance
+WGS84_A = 6378137.0
+WGS84_F = 1/298.257223563
+WGS84_B = (1 - WGS84_F)*WGS84_A
+
+##Mean earth radius, for the great circle distance
+EARTH_RADIUS = 6371.0088
+
+##Mean number of nodes in each cell of the grid used to snap points to a road network
+GRID_NODES_PER_CELL = 4
+
+##Margin in km of the bound used to stop the search of the nearest nodes, larger than the rounding of the distances
+SNAP_TOLERANCE = 1e-3
+
+
+def geodesic_distance(latitude_1, longitude_1, latitude_2, longitude_2, tolerance=1e-12, max_iterations=200):
+    '''
+    Distance in km between pairs of points over the WGS-84 ellipsoid (Vincenty's inverse formula). Inputs are broadcast
+    against each other. It agrees with geopy.distance.distance to a fraction of a millimeter. Each pair stops iterating
+    when it converges, so its distance does not depend on the other pairs. The few pairs that do not converge (nearly
+    antipodal points) are computed with geopy.
+
+    Returns:
+        np.ndarray: distances with the broadcast shape of the inputs
+    '''
+    latitude_1, longitude_1, latitude_2, longitude_2 = np.broadcast_arrays(*[np.asarray(x, dtype=float) for x in (latitude_1, longitude_1, latitude_2, longitude_2)])
+    shape = latitude_1.shape
+    latitude_1, longitude_1, latitude_2, longitude_2 = [x.ravel() for x in (latitude_1, longitude_1, latitude_2, longitude_2)]
+
+    L = np.radians(longitude_2) - np.radians(longitude_1)
+    U1 = np.arctan((1 - WGS84_F)*np.tan(np.radians(latitude_1)))
+    U2 = np.arctan((1 - WGS84_F)*np.tan(np.radians(latitude_2)))
+    sin_U1, cos_U1 = np.sin(U1), np.cos(U1)
+    sin_U2, cos_U2 = np.sin(U2), np.cos(U2)
+
+    lambda_ = L.copy()
+    sin_sigma = np.zeros(L.shape)
+    cos_sigma = np.zeros(L.shape)
+    sigma = np.zeros(L.shape)
+    cos_sq_alpha = np.zeros(L.shape)
+    cos_2_sigma_m = np.zeros(L.shape)
+    active = np.flatnonzero(~np.isnan(L + U1 + U2))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for _ in range(max_iterations):
+            if len(active) == 0:
+                break
+            a_L, a_lambda = L[active], lambda_[active]
+            a_sin_U1, a_cos_U1, a_sin_U2, a_cos_U2 = sin_U1[active], cos_U1[active], sin_U2[active], cos_U2[active]
+            sin_lambda, cos_lambda = np.sin(a_lambda), np.cos(a_lambda)
+            a_sin_sigma = np.sqrt((a_cos_U2*sin_lambda)**2 + (a_cos_U1*a_sin_U2 - a_sin_U1*a_cos_U2*cos_lambda)**2)
+            a_cos_sigma = a_sin_U1*a_sin_U2 + a_cos_U1*a_cos_U2*cos_lambda
+            a_sigma = np.arctan2(a_sin_sigma, a_cos_sigma)
+            sin_alpha = np.where(a_sin_sigma == 0, 0.0, a_cos_U1*a_cos_U2*sin_lambda/a_sin_sigma)
+            a_cos_sq_alpha = 1 - sin_alpha**2
+            ##Points over the equator have cos_sq_alpha = 0
+            a_cos_2_sigma_m = np.where(a_cos_sq_alpha == 0, 0.0, a_cos_sigma - 2*a_sin_U1*a_sin_U2/a_cos_sq_alpha)
+            C = WGS84_F/16*a_cos_sq_alpha*(4 + WGS84_F*(4 - 3*a_cos_sq_alpha))
+            new_lambda = a_L + (1 - C)*WGS84_F*sin_alpha*(a_sigma + C*a_sin_sigma*(a_cos_2_sigma_m + C*a_cos_sigma*(-1 + 2*a_cos_2_sigma_m**2)))
+
+            sin_sigma[active], cos_sigma[active], sigma[active] = a_sin_sigma, a_cos_sigma, a_sigma
+            cos_sq_alpha[active], cos_2_sigma_m[active] = a_cos_sq_alpha, a_cos_2_sigma_m
+            lambda_[active] = new_lambda
+            active = active[~(np.abs(new_lambda - a_lambda) < tolerance)]
+
+        u_sq = cos_sq_alpha*(WGS84_A**2 - WGS84_B**2)/WGS84_B**2
+        A = 1 + u_sq/16384*(4096 + u_sq*(-768 + u_sq*(320 - 175*u_sq)))
+        B = u_sq/1024*(256 + u_sq*(-128 + u_sq*(74 - 47*u_sq)))
+        delta_sigma = B*sin_sigma*(cos_2_sigma_m + B/4*(cos_sigma*(-1 + 2*cos_2_sigma_m**2) - B/6*cos_2_sigma_m*(-3 + 4*sin_sigma**2)*(-3 + 4*cos_2_sigma_m**2)))
+        distances = WGS84_B*A*(sigma - delta_sigma)/1000
+
+    distances[np.isnan(L + U1 + U2)] = np.nan
+    for i in active:
+        distances[i] = distance.distance((latitude_1[i], longitude_1[i]), (latitude_2[i], longitude_2[i])).km
+    return distances.reshape(shape)
+
+
+def geodesic_distance_matrix(latitude_1, longitude_1, latitude_2, longitude_2):
+    '''
+    Distance in km between every point 1 and every point 2 over the WGS-84 ellipsoid.
+
+    Returns:
+        np.ndarray: matrix of shape (len(latitude_1), len(latitude_2))
+    '''
+    return geodesic_distance(np.asarray(latitude_1, dtype=float)[:, None], np.asarray(longitude_1, dtype=float)[:, None], np.asarray(latitude_2, dtype=float)[None, :], np.asarray(longitude_2, dtype=float)[None, :])
+
+
+def haversine_distance_matrix(latitude_1, longitude_1, latitude_2, longitude_2):
+    '''
+    Great circle distance in km between every point 1 and every point 2 over a sphere of radius EARTH_RADIUS. It is
+    several times faster than the geodesic distance and differs from it by less than 0.5%.
+
+    Returns:
+        np.ndarray: matrix of shape (len(latitude_1), len(latitude_2))
+    '''
+    latitude_1, longitude_1 = np.radians(np.asarray(latitude_1, dtype=float))[:, None], np.radians(np.asarray(longitude_1, dtype=float))[:, None]
+    latitude_2, longitude_2 = np.radians(np.asarray(latitude_2, dtype=float))[None, :], np.radians(np.asarray(longitude_2, dtype=float))[None, :]
+    a = np.sin((latitude_2 - latitude_1)/2)**2 + np.cos(latitude_1)*np.cos(latitude_2)*np.sin((longitude_2 - longitude_1)/2)**2
+    return 2*EARTH_RADIUS*np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def unit_vectors(latitude, longitude):
+    '''
+    Points over the unit sphere as (x, y, z) rows.
+    '''
+    latitude = np.radians(np.asarray(latitude, dtype=float))
+    longitude = np.radians(np.asarray(longitude, dtype=float))
+    return np.column_stack([np.cos(latitude)*np.cos(longitude), np.cos(latitude)*np.sin(longitude), np.sin(latitude)])
+
+
+class DistanceBackend(abc.ABC):
+    '''
+    Metric used to impute schools by distance (see impute_distance_preference). A backend computes the distance in km
+    from every postulant to every school with distance_matrix, nan for unknown coordinates. key identifies the backend
+    and its data, and is part of the DistanceCache files. Both must be implemented, so an incomplete backend can not be
+    instantiated.
+    '''
+    name = None
+
+    @property
+    @abc.abstractmethod
+    def key(self) -> str:
+        '''
+        Identifier of the backend and its data, used in the names of the DistanceCache files.
+        '''
+
+    @abc.abstractmethod
+    def distance_matrix(self, latitude_1, longitude_1, latitude_2, longitude_2) -> np.ndarray:
+        '''
+        Distance in km from every point 1 (postulants) to every point 2 (schools).
+
+        Returns:
+            np.ndarray: matrix of shape (len(latitude_1), len(latitude_2))
+        '''
+
+
+class GeodesicBackend(DistanceBackend):
+    '''
+    Distance over the WGS-84 ellipsoid, the same as geopy.distance.distance (see geodesic_distance). It is the default
+    backend, and the only one that searches the nearest schools with a SchoolIndex.
+    '''
+    name = "geodesic"
+
+    @property
+    def key(self) -> str:
+        return self.name
+
+    def distance_matrix(self, latitude_1, longitude_1, latitude_2, longitude_2) -> np.ndarray:
+        return geodesic_distance_matrix(latitude_1, longitude_1, latitude_2, longitude_2)
+
+
+class HaversineBackend(DistanceBackend):
+    '''
+    Great circle distance over a sphere (see haversine_distance_matrix).
+    '''
+    name = "haversine"
+
+    @property
+    def key(self) -> str:
+        return self.name
+
+    def distance_matrix(self, latitude_1, longitude_1, latitude_2, longitude_2) -> np.ndarray:
+        return haversine_distance_matrix(latitude_1, longitude_1, latitude_2, longitude_2)
+
+
+class RoadNetworkBackend(DistanceBackend):
+    '''
+    Travel distance over a road network read from local files, without any online service.
+
+    Homes are snapped to their nearest node and schools to their snap_nodes nearest nodes (their entrances), with the
+    great circle distance as the access distance. For each school, one multi-source Dijkstra, started at its entrances
+    with their access distances and run over the reversed edges, gives the distance from every node to the school, so it
+    serves all the postulants at once. The distance from a home is its access distance plus the distance from its node.
+    The distances of each school are kept, so each Dijkstra runs once. Schools that can not be reached from a home are
+    at an infinite distance.
+    '''
+    name = "road_network"
+
+    def __init__(self, node_latitude, node_longitude, source, target, length=None, oneway=None, snap_nodes: int = 3, chunk_size: int = 256):
+        '''
+        Args:
+            node_latitude, node_longitude: coordinates of the nodes
+            source, target: positions of the nodes of each edge
+            length (optional): length of each edge in km. If None, the great circle distance between its nodes.
+            oneway (optional): True for the edges that can only be travelled from source to target. If None, all the
+                edges can be travelled both ways.
+            snap_nodes (int): number of nodes where each school can be entered
+            chunk_size (int): maximum number of points compared at once with the nodes of a block of cells
+        '''
+        self.node_latitude = np.asarray(node_latitude, dtype=float)
+        self.node_longitude = np.asarray(node_longitude, dtype=float)
+        source = np.asarray(source, dtype=np.int64)
+        target = np.asarray(target, dtype=np.int64)
+        n_nodes = len(self.node_latitude)
+        if len(source) and (min(source.min(), target.min()) < 0 or max(source.max(), target.max()) >= n_nodes):
+            raise ValueError('The edges have nodes that are not in the network.')
+        if length is None:
+            length = 2*EARTH_RADIUS*np.arcsin(np.clip(np.linalg.norm(unit_vectors(self.node_latitude[source], self.node_longitude[source]) - unit_vectors(self.node_latitude[target], self.node_longitude[target]), axis=1)/2, 0, 1))
+        length = np.asarray(length, dtype=float)
+        oneway = np.zeros(len(source), dtype=bool) if oneway is None else np.asarray(oneway, dtype=bool)
+        self.source, self.target, self.length, self.oneway = source, target, length, oneway
+        self.snap_nodes = min(snap_nodes, n_nodes)
+        self.chunk_size = chunk_size
+
+        ##Reversed edges (target to source, and source to target if the edge is not oneway) as a CSR adjacency, so the
+        ##Dijkstra from a school gives the distance from each node to it
+        tails = np.concatenate([target, source[~oneway]])
+        heads = np.concatenate([source, target[~oneway]])
+        lengths = np.concatenate([length, length[~oneway]])
+        order = np.argsort(tails, kind="stable")
+        self._offsets = np.concatenate([[0], np.cumsum(np.bincount(tails, minlength=n_nodes))]).tolist()
+        self._heads = heads[order].tolist()
+        self._lengths = lengths[order].tolist()
+        self._node_vectors = unit_vectors(self.node_latitude, self.node_longitude)
+
+        ##Grid of cells of about GRID_NODES_PER_CELL nodes, to snap points without comparing them with all the nodes.
+        ##Nodes are sorted by cell, and the nodes of a cell are _grid_nodes[_grid_starts[cell]:_grid_starts[cell+1]]
+        self._grid_origin = (self.node_latitude.min(), self.node_longitude.min())
+        scale = max(np.cos(np.radians(np.abs(self.node_latitude).max())), 1e-3)
+        area = (np.ptp(self.node_latitude) + 1e-9)*(np.ptp(self.node_longitude)*scale + 1e-9)
+        latitude_step = np.sqrt(area*GRID_NODES_PER_CELL/n_nodes)
+        self._grid_step = (latitude_step, latitude_step/scale)
+        row, column = self._grid_cells(self.node_latitude, self.node_longitude)
+        self._grid_shape = (int(row.max()) + 1, int(column.max()) + 1)
+        cell = row*self._grid_shape[1] + column
+        self._grid_nodes = np.argsort(cell, kind="stable")
+        self._grid_starts = np.searchsorted(cell[self._grid_nodes], np.arange(self._grid_shape[0]*self._grid_shape[1] + 1))
+        self._school_distances = {}
+        self._key = None
+
+    @classmethod
+    def from_csv(cls, nodes_path: str, edges_path: str, **kwargs):
+        '''
+        Reads the network from a nodes file (nodeId, latitude, longitude) and an edges file (source, target and,
+        optionally, length in km and oneway), where source and target are nodeId. Other columns are ignored.
+        '''
+        nodes = pd.read_csv(nodes_path, usecols=["nodeId", "latitude", "longitude"])
+        edges = pd.read_csv(edges_path)
+        missing = {"source", "target"} - set(edges.columns)
+        if missing:
+            raise ValueError(f'{edges_path} is missing the columns {sorted(missing)}.')
+        node_index = pd.Index(nodes["nodeId"])
+        source = node_index.get_indexer(edges["source"])
+        target = node_index.get_indexer(edges["target"])
+        if (source < 0).any() or (target < 0).any():
+            raise ValueError(f'{edges_path} has nodes that are not in {nodes_path}.')
+        return cls(nodes["latitude"].values, nodes["longitude"].values, source, target,
+                   length=edges["length"].values if "length" in edges.columns else None,
+                   oneway=edges["oneway"].values if "oneway" in edges.columns else None, **kwargs)
+
+    @property
+    def key(self) -> str:
+        ##Hash of the network, computed once
+        if self._key is None:
+            network = hashlib.sha1()
+            for values in (self.node_latitude, self.node_longitude, self.source, self.target, self.length, self.oneway):
+                network.update(np.ascontiguousarray(values).tobytes())
+            self._key = f"{self.name}_{self.snap_nodes}_{network.hexdigest()[:16]}"
+        return self._key
+
+    def snap(self, latitude, longitude, k: int = 1):
+        '''
+        Nearest k nodes of each point, by great circle distance. The nodes are searched in the grid cells around the
+        point, in blocks of cells that grow until no node outside the block can be nearer than the k-th node found, so
+        the work does not grow with the size of the network.
+
+        Returns:
+            nodes (np.ndarray): (points x k) positions of the nodes, -1 for unknown coordinates
+            access (np.ndarray): (points x k) distances in km to the nodes, nan for unknown coordinates
+        '''
+        latitude = np.atleast_1d(np.asarray(latitude, dtype=float))
+        longitude = np.atleast_1d(np.asarray(longitude, dtype=float))
+        vectors = unit_vectors(latitude, longitude)
+        k = min(k, len(self._node_vectors))
+        nodes = np.full((len(vectors), k), -1, dtype=np.int64)
+        access = np.full((len(vectors), k), np.nan)
+        pending = np.flatnonzero(~np.isnan(vectors).any(axis=1))
+        cells = np.column_stack(self._grid_cells(latitude[pending], longitude[pending]))
+        ring = 1
+        while len(pending) > 0:
+            unresolved = []
+            unique_cells, inverse = np.unique(cells, axis=0, return_inverse=True)
+            for i, (row, column) in enumerate(unique_cells):
+                points = pending[inverse.ravel() == i]
+                candidates, complete = self._grid_block(row, column, ring)
+                if len(candidates) < k:
+                    unresolved.append(points)
+                    continue
+                ##Points snapped at once, so the cosine matrix stays small when the block has many nodes
+                step = max(1, min(self.chunk_size, (1 << 20)//len(candidates)))
+                for start in range(0, len(points), step):
+                    batch = points[start:start+step]
+                    cosine = vectors[batch] @ self._node_vectors[candidates].T
+                    if k == 1:
+                        nearest = np.argmax(cosine, axis=1)[:, None]
+                    else:
+                        nearest = np.argpartition(-cosine, k-1, axis=1)[:, :k]
+                        ##Candidates are sorted, so ties are broken by the position of the node
+                        nearest = np.take_along_axis(nearest, np.lexsort((nearest, -np.take_along_axis(cosine, nearest, axis=1))), axis=1)
+                    ##The distances are taken from the chords, that are more precise than the cosines for near nodes
+                    chords = np.linalg.norm(vectors[batch][:, None, :] - self._node_vectors[candidates[nearest]], axis=2)
+                    distances = 2*EARTH_RADIUS*np.arcsin(np.clip(chords/2, 0, 1))
+                    found = complete | (distances[:, -1] + SNAP_TOLERANCE <= self._grid_bound(latitude[batch], longitude[batch], row, column, ring))
+                    nodes[batch[found]] = candidates[nearest[found]]
+                    access[batch[found]] = distances[found]
+                    unresolved.append(batch[~found])
+            pending = np.concatenate(unresolved) if unresolved else np.empty(0, dtype=np.int64)
+            cells = np.column_stack(self._grid_cells(latitude[pending], longitude[pending]))
+            ring *= 2
+        return nodes, access
+
+    def _grid_cells(self, latitude, longitude):
+        '''
+        Row and column of the grid cell of each point. Points outside the network get cells outside the grid.
+        '''
+        row = np.floor((latitude - self._grid_origin[0])/self._grid_step[0]).astype(np.int64)
+        column = np.floor((longitude - self._grid_origin[1])/self._grid_step[1]).astype(np.int64)
+        return row, column
+
+    def _grid_block(self, row, column, ring):
+        '''
+        Sorted positions of the nodes in the cells at most ring cells away from (row, column), and whether the block
+        covers the whole grid.
+        '''
+        n_rows, n_columns = self._grid_shape
+        first_row, last_row = max(row - ring, 0), min(row + ring, n_rows - 1)
+        first_column, last_column = max(column - ring, 0), min(column + ring, n_columns - 1)
+        complete = row - ring <= 0 and row + ring >= n_rows - 1 and column - ring <= 0 and column + ring >= n_columns - 1
+        if first_row > last_row or first_column > last_column:
+            return np.empty(0, dtype=np.int64), complete
+        starts = self._grid_starts
+        blocks = [self._grid_nodes[starts[cell*n_columns + first_column]:starts[cell*n_columns + last_column + 1]]
+                  for cell in range(first_row, last_row + 1)]
+        return np.sort(np.concatenate(blocks)), complete
+
+    def _grid_bound(self, latitude, longitude, row, column, ring):
+        '''
+        Lower bound of the great circle distance in km from each point to any node outside the block of _grid_block:
+        the distance to the nearest parallel or meridian of the border of the block.
+        '''
+        latitude_step, longitude_step = self._grid_step
+        low_latitude = self._grid_origin[0] + (row - ring)*latitude_step
+        low_longitude = self._grid_origin[1] + (column - ring)*longitude_step
+        to_parallel = np.radians(np.minimum(latitude - low_latitude, low_latitude + (2*ring + 1)*latitude_step - latitude))
+        to_meridian = np.radians(np.minimum(longitude - low_longitude, low_longitude + (2*ring + 1)*longitude_step - longitude))
+        to_meridian = np.arcsin(np.clip(np.cos(np.radians(latitude))*np.sin(np.minimum(to_meridian, np.pi/2)), 0, 1))
+        return EARTH_RADIUS*np.minimum(to_parallel, to_meridian)
+
+    def distance_matrix(self, latitude_1, longitude_1, latitude_2, longitude_2) -> np.ndarray:
+        home_nodes, home_access = self.snap(latitude_1, longitude_1)
+        home_nodes, home_access = home_nodes[:, 0], home_access[:, 0]
+        distances = np.full((len(home_nodes), len(np.atleast_1d(latitude_2))), np.nan)
+        for j, (latitude, longitude) in enumerate(zip(np.atleast_1d(latitude_2), np.atleast_1d(longitude_2))):
+            to_school = self._distances_to_school(latitude, longitude)
+            if to_school is not None:
+                distances[:, j] = np.where(home_nodes >= 0, to_school[home_nodes] + home_access, np.nan)
+        return distances
+
+    def _distances_to_school(self, latitude, longitude):
+        '''
+        Distance in km from every node to the school at (latitude, longitude), None for unknown coordinates.
+        '''
+        if (latitude, longitude) not in self._school_distances:
+            entrances, access = self.snap([latitude], [longitude], k=self.snap_nodes)
+            if entrances[0, 0] < 0:
+                self._school_distances[(latitude, longitude)] = None
+            else:
+                self._school_distances[(latitude, longitude)] = self._dijkstra(entrances[0].tolist(), access[0].tolist())
+        return self._school_distances[(latitude, longitude)]
+
+    def _dijkstra(self, sources, initial_distances) -> np.ndarray:
+        '''
+        Shortest distances over the reversed edges from the nearest of the sources, each one starting at its initial
+        distance.
+        '''
+        offsets, heads, lengths = self._offsets, self._heads, self._lengths
+        distances = [np.inf]*(len(offsets) - 1)
+        heap = []
+        for node, initial in zip(sources, initial_distances):
+            if initial < distances[node]:
+                distances[node] = initial
+                heap.append((initial, node))
+        heapq.heapify(heap)
+        while heap:
+            node_distance, node = heapq.heappop(heap)
+            if node_distance > distances[node]:
+                continue
+            for i in range(offsets[node], offsets[node+1]):
+                new_distance = node_distance + lengths[i]
+                if new_distance < distances[heads[i]]:
+                    distances[heads[i]] = new_distance
+                    heapq.heappush(heap, (new_distance, heads[i]))
+        return np.array(distances)
+
+
+def get_distance_backend(distance_backend=None) -> DistanceBackend:
+    '''
+    Backend of a distance_backend argument: None or "geodesic" for a GeodesicBackend, "haversine" for a
+    HaversineBackend, or a DistanceBackend, that is returned as it is.
+    '''
+    if distance_backend is None or distance_backend == "geodesic":
+        return GeodesicBackend()
+    if distance_backend == "haversine":
+        return HaversineBackend()
+    if isinstance(distance_backend, DistanceBackend):
+        return distance_backend
+    raise ValueError(f'Unknown distance backend {distance_backend!r}. Please use "geodesic", "haversine" or a DistanceBackend '
+                     'such as RoadNetworkBackend.from_csv(...).')
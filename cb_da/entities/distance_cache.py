@@ -0,0 +1,154 @@
+import os
+import numpy as np
+import pandas as pd
+from entities.distance_backends import get_distance_backend
+
+
+##Coordinates that are nan are stored with this key, and their distances are nan
+MISSING_COORDINATE = np.iinfo(np.int64).min
+
+
+class DistanceCache:
+    '''
+    Persistent cache of the distances between postulants and programs, computed with a DistanceBackend, to be reused
+    by the next runs of the distance imputation (dry runs, appeal reruns, rounds). Only the distances of new postulant
+    coordinates or new schools are computed, and the rest are read from disk without copies.
+
+    There is one block of files per backend and (levelId, gradeId) in cache_dir, where <key> is the key of the backend:
+        distances_<key>_<levelId>_<gradeId>_<decimals>.npy: float32 matrix of distances in km (rows x columns)
+        distances_<key>_<levelId>_<gradeId>_<decimals>_rows.npy: coordinates of each row, rounded to decimals, as integers
+        distances_<key>_<levelId>_<gradeId>_<decimals>_columns.npy: localId and rounded coordinates of each column
+
+    Rows are keyed by the rounded coordinates of the postulants, so postulants at the same point share a row, and
+    columns by localId and the rounded coordinates of the school, so a school that moves gets a new column. Distances are
+    computed between the rounded coordinates (with 8 decimals they move about a millimeter) and stored as float32, so
+    they can differ from the distances without cache in about a millimeter, and only schools at almost the same distance
+    can swap. The matrix is read with np.load and
+    mmap_mode="r". When a block grows it is written again to a temporary file and then moved, so a block is never left
+    half written.
+    '''
+    def __init__(self, cache_dir: str, decimals: int = 8, chunk_size: int = 2048, distance_backend=None):
+        '''
+        Args:
+            cache_dir (str): folder of the cache files. It is created if it does not exist.
+            decimals (int): decimals of the coordinates in the keys
+            chunk_size (int): rows of the new distances computed at once
+            distance_backend (optional): metric of the distances (see get_distance_backend). Geodesic if None.
+        '''
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        self.cache_dir = cache_dir
+        self.decimals = decimals
+        self.chunk_size = chunk_size
+        self.distance_backend = get_distance_backend(distance_backend)
+        ##Blocks already loaded: matrix, row index and column index
+        self._blocks = {}
+
+    def get_distances(self, level, grade, latitude, longitude, local_ids, school_latitude, school_longitude):
+        '''
+        Makes sure that the block of (level, grade) has the distances between all the points and all the schools, and
+        returns the matrix with the row of each point and the column of each school. The distances between the points
+        and the schools are matrix[np.ix_(rows, columns)], and only the rows that are read are loaded into memory.
+
+        Returns:
+            matrix (np.ndarray): float32 memory-mapped matrix of the block
+            rows (np.ndarray): row of each point
+            columns (np.ndarray): column of each school
+        '''
+        row_keys = self._coordinate_keys(latitude, longitude)
+        column_keys = np.column_stack([np.asarray(local_ids, dtype=np.int64), self._coordinate_keys(school_latitude, school_longitude)])
+        block = self._load_block(level, grade)
+        rows = block["row_index"].get_indexer(pd.MultiIndex.from_arrays(row_keys.T))
+        columns = block["column_index"].get_indexer(pd.MultiIndex.from_arrays(column_keys.T))
+        if (rows < 0).any() or (columns < 0).any():
+            new_rows = np.unique(row_keys[rows < 0], axis=0)
+            new_columns = np.unique(column_keys[columns < 0], axis=0)
+            block = self._extend_block(level, grade, block, new_rows, new_columns)
+            rows = block["row_index"].get_indexer(pd.MultiIndex.from_arrays(row_keys.T))
+            columns = block["column_index"].get_indexer(pd.MultiIndex.from_arrays(column_keys.T))
+        return block["matrix"], rows, columns
+
+    def _coordinate_keys(self, latitude, longitude) -> np.ndarray:
+        '''
+        Rounded coordinates as (n x 2) integers, MISSING_COORDINATE for nan.
+        '''
+        coordinates = np.column_stack([np.asarray(latitude, dtype=float), np.asarray(longitude, dtype=float)])
+        missing = np.isnan(coordinates)
+        keys = np.round(np.where(missing, 0, coordinates)*10**self.decimals).astype(np.int64)
+        keys[missing] = MISSING_COORDINATE
+        return keys
+
+    def _key_coordinates(self, keys: np.ndarray) -> np.ndarray:
+        '''
+        Coordinates of the keys of _coordinate_keys.
+        '''
+        coordinates = keys/10**self.decimals
+        coordinates[keys == MISSING_COORDINATE] = np.nan
+        return coordinates
+
+    def _block_path(self, level, grade, suffix=""):
+        return os.path.join(self.cache_dir, f"distances_{self.distance_backend.key}_{level}_{grade}_{self.decimals}{suffix}.npy")
+
+    def _load_block(self, level, grade):
+        '''
+        Loads the block of (level, grade) from disk, or an empty block if there is none or its files do not match.
+        '''
+        if (level, grade) in self._blocks:
+            return self._blocks[(level, grade)]
+        row_keys = np.empty((0, 2), dtype=np.int64)
+        column_keys = np.empty((0, 3), dtype=np.int64)
+        matrix = np.empty((0, 0), dtype=np.float32)
+        paths = [self._block_path(level, grade, suffix) for suffix in ("", "_rows", "_columns")]
+        if all(os.path.isfile(path) for path in paths):
+            stored_matrix = np.load(paths[0], mmap_mode="r")
+            stored_rows = np.load(paths[1])
+            stored_columns = np.load(paths[2])
+            if stored_matrix.shape == (len(stored_rows), len(stored_columns)):
+                matrix, row_keys, column_keys = stored_matrix, stored_rows, stored_columns
+        return self._set_block(level, grade, matrix, row_keys, column_keys)
+
+    def _set_block(self, level, grade, matrix, row_keys, column_keys):
+        self._blocks[(level, grade)] = {"matrix": matrix,
+                                        "row_keys": row_keys,
+                                        "column_keys": column_keys,
+                                        "row_index": pd.MultiIndex.from_arrays(row_keys.T, names=["latitude", "longitude"]),
+                                        "column_index": pd.MultiIndex.from_arrays(column_keys.T, names=["localId", "latitude", "longitude"])}
+        return self._blocks[(level, grade)]
+
+    def _extend_block(self, level, grade, block, new_rows, new_columns):
+        '''
+        Writes the block again with the new rows and columns. Only the distances of the new rows to all the columns and
+        of the old rows to the new columns are computed.
+        '''
+        old_matrix = block["matrix"]
+        n_rows, n_columns = old_matrix.shape
+        row_keys = np.concatenate([block["row_keys"], new_rows])
+        column_keys = np.concatenate([block["column_keys"], new_columns])
+        row_coordinates = self._key_coordinates(row_keys)
+        column_coordinates = self._key_coordinates(column_keys[:, 1:])
+
+        path = self._block_path(level, grade)
+        temporary_path = path+".tmp"
+        matrix = np.lib.format.open_memmap(temporary_path, mode="w+", dtype=np.float32, shape=(len(row_keys), len(column_keys)))
+        ##Old rows are copied, and only their distances to the new columns are computed
+        for start in range(0, n_rows, self.chunk_size):
+            end = min(start + self.chunk_size, n_rows)
+            matrix[start:end, :n_columns] = old_matrix[start:end]
+            if len(new_columns) > 0:
+                matrix[start:end, n_columns:] = self.distance_backend.distance_matrix(row_coordinates[start:end, 0], row_coordinates[start:end, 1], column_coordinates[n_columns:, 0], column_coordinates[n_columns:, 1])
+        for start in range(n_rows, len(row_keys), self.chunk_size):
+            end = start + self.chunk_size
+            matrix[start:end] = self.distance_backend.distance_matrix(row_coordinates[start:end, 0], row_coordinates[start:end, 1], column_coordinates[:, 0], column_coordinates[:, 1])
+        matrix.flush()
+        del matrix, old_matrix
+        block["matrix"] = None
+
+        ##The matrix is moved first. If the keys are not written, the shapes do not match and the block is discarded
+        os.replace(temporary_path, path)
+        for suffix, keys in (("_rows", row_keys), ("_columns", column_keys)):
+            keys_path = self._block_path(level, grade, suffix)
+            with open(keys_path+".tmp", "wb") as f:
+                np.save(f, keys)
+            os.replace(keys_path+".tmp", keys_path)
+        return self._set_block(level, grade, np.load(path, mmap_mode="r"), row_keys, column_keys)
+
@@ -1,56 +1,644 @@
 from wsgiref.util import request_uri
+import numpy as np
 import pandas as pd
-from geopy import distance
 from datetime import datetime
 from tqdm import tqdm
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from entities.distance_backends import EARTH_RADIUS, geodesic_distance, geodesic_distance_matrix, unit_vectors, GeodesicBackend, get_distance_backend
 
 
-def impute_distance_preference(demand: pd.DataFrame, postulants: pd.DataFrame, vacancies: pd.DataFrame):
-    
-    demand["distancePriority"] = False
-    print('>>>              CALCULATING DISTANCES              <<<')     
-    for index, row in tqdm(postulants.iterrows(), total=postulants.shape[0]):
+##Bounds for the ratio between the WGS-84 geodesic and the great circle distance over the sphere of EARTH_RADIUS, for the
+##spherical screening of SchoolIndex (the local radii of curvature of WGS-84 go from 6335 to 6400 km)
+MIN_GEODESIC_RATIO = 0.99
+MAX_GEODESIC_RATIO = 1.01
+
+IMPUTED_COLUMNS = ["postulantId", "levelId", "gradeId", "order", "serviceId", "annex", "localId", "latitude", "longitude", "priority", "roundNumber", "roundTypeId", "sendDate", "distancePriority"]
+
+
+class SchoolIndex:
+    '''
+    Spatial index over the coordinates of the programs offering a (levelId, gradeId). It answers k nearest and radius
+    queries with the same order as sorting the geodesic distances to all the programs (ties are broken by the program
+    position, as a stable sort does).
+
+    Programs are stored as unit vectors. A query screens all of them with one matrix product (great circle distance over
+    a sphere) and computes the geodesic distance only for the candidates that can be among the results, using the
+    bounds of the ratio between both distances.
+    '''
+    def __init__(self, latitude, longitude):
+        self.latitude = np.asarray(latitude, dtype=float)
+        self.longitude = np.asarray(longitude, dtype=float)
+        self.unit_vectors = unit_vectors(self.latitude, self.longitude)
+
+    def __len__(self):
+        return len(self.latitude)
 
-        ##Extracting info for each postulant
-        postulant_id = row["postulantId"]
-        postulating_level = demand[demand["postulantId"]==postulant_id].levelId.values[0]
-        postulating_grade = demand[demand["postulantId"]==postulant_id].gradeId.values[0]
+    def query(self, latitude, longitude, k=None, max_distance=None):
+        '''
+        Nearest programs of each point, ordered by distance.
 
-        postulant_latitude = row["latitude"]
-        postulant_longitude = row["longitude"]
-        postulant_coordinates = (postulant_latitude, postulant_longitude)
+        Args:
+            latitude, longitude: coordinates of the points
+            k (int, optional): number of programs to return for each point. All if None.
+            max_distance (float, optional): only programs at max_distance km or less are returned.
 
-        postulated_schools = demand[demand["postulantId"]==postulant_id].localId.values
+        Returns:
+            positions (np.ndarray): (points x k) positions of the programs, -1 where there is no program to return
+            distances (np.ndarray): (points x k) geodesic distances in km, inf where there is no program to return
+        '''
+        k = len(self) if k is None else min(k, len(self))
+        if k == 0 or len(latitude) == 0:
+            return np.full((len(latitude), k), -1, dtype=np.int64), np.full((len(latitude), k), np.inf)
 
-        ##Getting all programs that meet the student's postulation grade and level
-        possible_programs = vacancies.loc[(vacancies["levelId"]==postulating_level) & (vacancies["gradeId"]==postulating_grade)].copy(deep=True)
+        ##Great circle distance to every program
+        cosine = np.clip(unit_vectors(latitude, longitude) @ self.unit_vectors.T, -1, 1)
+        spherical = EARTH_RADIUS*np.arccos(cosine)
+        spherical[np.isnan(spherical)] = np.inf
 
+        ##Any program among the k nearest is at most this far over the sphere
+        bound = np.full(len(latitude), np.inf)
+        if k < len(self):
+            kth = np.partition(spherical, k-1, axis=1)[:, k-1]
+            bound = kth*MAX_GEODESIC_RATIO/MIN_GEODESIC_RATIO + 1e-6
+        if max_distance is not None:
+            bound = np.minimum(bound, max_distance/MIN_GEODESIC_RATIO + 1e-6)
+        candidates = spherical <= bound[:, None]
 
-        ##Calculating the distance from student's place to each possible school
-        possible_programs["distance"] = [distance.distance(postulant_coordinates, (row["latitude"], row["longitude"])).km for index, row in possible_programs.iterrows()]
+        ##Geodesic distance only for the candidates, in the same positions order
+        n_candidates = max(candidates.sum(axis=1).max(), 1)
+        positions = np.argsort(~candidates, axis=1, kind="stable")[:, :n_candidates]
+        valid = np.take_along_axis(candidates, positions, axis=1)
+        distances = geodesic_distance(np.asarray(latitude, dtype=float)[:, None], np.asarray(longitude, dtype=float)[:, None], self.latitude[positions], self.longitude[positions])
+        distances[~valid | np.isnan(distances)] = np.inf
+        if max_distance is not None:
+            distances[distances > max_distance] = np.inf
 
+        order = np.lexsort((positions, distances), axis=1)[:, :k]
+        positions = np.take_along_axis(positions, order, axis=1)
+        distances = np.take_along_axis(distances, order, axis=1)
+        positions[np.isinf(distances)] = -1
+        return positions, distances
 
-        ##Sorting by distance
-        possible_programs = possible_programs.sort_values(by=["distance"])
-        possible_programs["postulantId"] = postulant_id
 
-        ##Removing the programs that the student had already chosen
-        programs_already_chosen = possible_programs["localId"].isin(postulated_schools)
-        possible_remaining_programs = possible_programs[~programs_already_chosen].copy(deep=True)
-        possible_remaining_programs = possible_remaining_programs.drop_duplicates(subset=["localId"])
+def impute_distance_preference(demand: pd.DataFrame, postulants: pd.DataFrame, vacancies: pd.DataFrame, chunk_size: int = 2048, max_imputed_options: int = None, max_distance: float = None, distance_cache=None, workers: int = 1, distance_backend=None):
+    '''
+    For each postulant, appends to demand all the schools offering the postulant's level and grade that he/she did not
+    choose, ordered by distance and with distancePriority=True.
 
-        ##Adding additional fields that will be necessary to append these schools to the demand table
-        possible_remaining_programs["order"] = range(len(postulated_schools)+1, len(postulated_schools)+len(possible_remaining_programs["localId"])+1)  ##the student had already selected some schools. The distance preference order starts after that ones
-        possible_remaining_programs["distancePriority"] = True   ##All new schools are imputed by distance
-        possible_remaining_programs["priority"] = False  ##None of them has a different type of priority
-        possible_remaining_programs["roundNumber"] = 1
-        possible_remaining_programs["roundTypeId"] = "R"
-        possible_remaining_programs["sendDate"] = datetime.now().strftime("%m/%d/%Y %H:%M:%S")
-        
-        instant_demand = possible_remaining_programs[["postulantId", "levelId", "gradeId", "order", "serviceId", "annex", "localId", "latitude", "longitude", "priority", "roundNumber", "roundTypeId", "sendDate", "distancePriority"]]
+    Postulants and vacancies are grouped by (levelId, gradeId) and the distances are computed as a point x school matrix
+    for the distinct coordinates of chunks of chunk_size postulants, so postulants at the same point (siblings,
+    neighbours) share one ranking of the schools. The imputed rows are added to demand in one concatenation.
+
+    If max_imputed_options or max_distance (km) are given, only the nearest max_imputed_options schools, or the schools
+    within max_distance, are imputed. With the geodesic distance they are searched with a SchoolIndex built once per
+    (levelId, gradeId).
+
+    distance_backend is the metric of the distances: None or "geodesic" (the default, over the WGS-84 ellipsoid),
+    "haversine" or a DistanceBackend, such as a RoadNetworkBackend (see get_distance_backend).
+
+    With a DistanceCache, the distances are read from it (and only the missing ones are computed and stored) instead of
+    being computed, and the schools are sorted over the cached distances.
+
+    With workers > 1 the chunks are ranked in a pool of workers processes (see _impute_programs). The result does not
+    depend on the number of workers.
+    '''
+    demand["distancePriority"] = False
+    print('>>>              CALCULATING DISTANCES              <<<')
+    chosen_count = demand.groupby("postulantId").size()
+    send_date = datetime.now().strftime("%m/%d/%Y %H:%M:%S")
 
-        demand = pd.concat([demand, instant_demand])
-        
+    imputed_demand = []
+    for chunk, possible_programs, (rows, programs, ranks) in _impute_programs(demand, postulants, vacancies, chunk_size, max_imputed_options, max_distance, distance_cache, workers, distance_backend):
+        imputed_demand.append(_imputed_rows(chunk, possible_programs, rows, programs, ranks, chosen_count, send_date))
 
+    demand = pd.concat([demand] + imputed_demand)
     demand = demand.sort_values(by=["postulantId","order"])
     return demand
+
+
+def impute_nearest_distance_preference(demand: pd.DataFrame, postulants: pd.DataFrame, vacancies: pd.DataFrame, chunk_size: int = 2048, max_imputed_options: int = None, max_distance: float = None, block_size: int = 8, distance_cache=None, workers: int = 1, distance_backend=None):
+    '''
+    Same as impute_distance_preference, but only the nearest imputed school of each postulant is appended to demand. The
+    next ones are kept in a DistanceTails, to be generated during the matching. The nearest block_size schools after the
+    first one are ranked here with the same distance matrices, so most of the applicants never compute distances again.
+
+    Returns:
+        demand (pd.DataFrame): demand with the nearest imputed school of each postulant
+        distance_tails (DistanceTails): the rest of the imputed schools
+    '''
+    demand["distancePriority"] = False
+    print('>>>              CALCULATING DISTANCES              <<<')
+    chosen_schools = demand[["postulantId", "localId"]]
+    chosen_count = demand.groupby("postulantId").size()
+    send_date = datetime.now().strftime("%m/%d/%Y %H:%M:%S")
+    ranked_options = block_size + 1 if max_imputed_options is None else min(block_size + 1, max_imputed_options)
+
+    distance_tails = DistanceTails(vacancies, chosen_schools, max_imputed_options=max_imputed_options, max_distance=max_distance, block_size=ranked_options, distance_cache=distance_cache, distance_backend=distance_backend)
+    imputed_demand = []
+    for chunk, possible_programs, (rows, programs, ranks) in _impute_programs(demand, postulants, vacancies, chunk_size, ranked_options, max_distance, distance_cache, workers, distance_backend):
+        nearest = ranks == 1
+        imputed_demand.append(_imputed_rows(chunk, possible_programs, rows[nearest], programs[nearest], ranks[nearest], chosen_count, send_date))
+        distance_tails.add_postulants(chunk, rows, programs, ranks)
+
+    demand = pd.concat([demand] + imputed_demand)
+    demand = demand.sort_values(by=["postulantId","order"])
+    return demand, distance_tails
+
+
+def _impute_programs(demand: pd.DataFrame, postulants: pd.DataFrame, vacancies: pd.DataFrame, chunk_size: int, max_imputed_options: int = None, max_distance: float = None, distance_cache=None, workers: int = 1, distance_backend=None):
+    '''
+    Groups the postulants by (levelId, gradeId) and yields, for chunks of chunk_size postulants, the chunk, the programs
+    offering their level and grade and the programs imputed to the postulants of the chunk (see ChunkRanker.rank).
+
+    Each group is sorted by (latitude, longitude), so the programs are ranked once for each point of a chunk. With a
+    DistanceCache, the missing distances of each group are computed and stored here, before ranking its chunks.
+
+    With workers > 1 the chunks are ranked in a pool of processes. The vacancies are shipped once to each worker
+    through shared memory, and the results are yielded in the order of the chunks, so they do not depend on the number
+    of workers.
+    '''
+    distance_backend = _get_backend(distance_backend, distance_cache)
+
+    ##Level and grade of each postulant come from his/her first application
+    first_application = demand.drop_duplicates(subset=["postulantId"])[["postulantId", "levelId", "gradeId"]]
+    postulants_info = postulants[["postulantId", "latitude", "longitude"]].merge(first_application, how="inner", on="postulantId")
+    chosen_count = demand.groupby("postulantId").size()
+    chosen_by_postulant = demand.set_index("postulantId")["localId"]
+
+    tasks = []
+    chunk_programs = []
+    for (level, grade), group in postulants_info.groupby(["levelId", "gradeId"], sort=False):
+
+        ##Getting all programs that meet the postulants' grade and level
+        possible_programs = vacancies.loc[(vacancies["levelId"]==level) & (vacancies["gradeId"]==grade)]
+        if len(possible_programs) == 0:
+            continue
+        repeated_programs = len(possible_programs) - possible_programs["localId"].nunique()
+
+        ##Postulants at the same point (siblings, neighbours) share the ranking of the programs
+        points = group.groupby(["latitude", "longitude"], sort=False, dropna=False).ngroup().values
+        by_point = np.argsort(points, kind="stable")
+        group = group.iloc[by_point]
+        points = points[by_point]
+        if distance_cache is not None:
+            distance_cache.get_distances(level, grade, group["latitude"].values, group["longitude"].values, possible_programs["localId"].values,
+                                         possible_programs["latitude"].values, possible_programs["longitude"].values)
+
+        for start in range(0, len(group), chunk_size):
+            chunk = group.iloc[start:start+chunk_size]
+            ##Chosen and repeated schools are removed after the query, so we ask for enough programs
+            k = None
+            if max_imputed_options is not None:
+                k = max_imputed_options + chosen_count.reindex(chunk["postulantId"]).max() + repeated_programs
+            chosen_schools = chosen_by_postulant.loc[chunk["postulantId"].values].reset_index()
+            tasks.append((level, grade, chunk, points[start:start+chunk_size], chosen_schools, k))
+            chunk_programs.append(possible_programs)
+
+    program_arrays = {"latitude": vacancies["latitude"].values.astype(float), "longitude": vacancies["longitude"].values.astype(float),
+                      "local_ids": vacancies["localId"].values, "level_ids": vacancies["levelId"].values, "grade_ids": vacancies["gradeId"].values}
+    ranker_options = {"max_imputed_options": max_imputed_options, "max_distance": max_distance, "distance_backend": distance_backend,
+                      "cache_dir": None if distance_cache is None else distance_cache.cache_dir,
+                      "decimals": None if distance_cache is None else distance_cache.decimals}
+    if workers <= 1 or len(tasks) <= 1:
+        ranker = ChunkRanker(program_arrays, distance_cache=distance_cache, **ranker_options)
+        results = (ranker.rank(*task) for task in tasks)
+        for task, possible_programs, result in zip(tasks, chunk_programs, tqdm(results, total=len(tasks))):
+            yield task[2], possible_programs, result
+        return
+
+    shared_block, layout = _share_arrays(program_arrays)
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(shared_block.name, layout, ranker_options)) as executor:
+            results = executor.map(_rank_worker, tasks)
+            for task, possible_programs, result in zip(tasks, chunk_programs, tqdm(results, total=len(tasks))):
+                yield task[2], possible_programs, result
+    finally:
+        shared_block.close()
+        shared_block.unlink()
+
+
+class ChunkRanker:
+    '''
+    Ranks the programs imputed by distance to chunks of postulants of the same (levelId, gradeId). It is used by
+    _impute_programs in the main process, or built once in each worker process over the vacancies in shared memory.
+    The programs and the SchoolIndex of each (levelId, gradeId) are built once.
+    '''
+    def __init__(self, program_arrays: dict, max_imputed_options: int = None, max_distance: float = None, distance_backend=None, distance_cache=None, cache_dir: str = None, decimals: int = None):
+        '''
+        Args:
+            program_arrays (dict): latitude, longitude, local_ids, level_ids and grade_ids of all the vacancies
+            max_imputed_options (int, optional): see impute_distance_preference
+            max_distance (float, optional): see impute_distance_preference
+            distance_backend (DistanceBackend, optional): metric of the distances. Geodesic if None.
+            distance_cache (DistanceCache, optional): cache with the distances of all the chunks
+            cache_dir (str, optional): folder of the DistanceCache, to open it in a worker process
+            decimals (int, optional): decimals of the DistanceCache
+        '''
+        self.program_arrays = program_arrays
+        self.max_imputed_options = max_imputed_options
+        self.max_distance = max_distance
+        self.distance_backend = get_distance_backend(distance_backend)
+        ##SchoolIndex only gives geodesic distances
+        self.use_index = ((max_imputed_options is not None) or (max_distance is not None)) and isinstance(self.distance_backend, GeodesicBackend)
+        if (distance_cache is None) and (cache_dir is not None):
+            ##Imported here because distance_cache imports this module
+            from entities.distance_cache import DistanceCache
+            distance_cache = DistanceCache(cache_dir, decimals=decimals, distance_backend=self.distance_backend)
+        self.distance_cache = distance_cache
+        self._groups = {}
+
+    def _get_group(self, level, grade) -> dict:
+        if (level, grade) not in self._groups:
+            positions = np.flatnonzero((self.program_arrays["level_ids"]==level) & (self.program_arrays["grade_ids"]==grade))
+            latitude, longitude = self.program_arrays["latitude"][positions], self.program_arrays["longitude"][positions]
+            local_ids = self.program_arrays["local_ids"][positions]
+            self._groups[(level, grade)] = {"latitude": latitude,
+                                            "longitude": longitude,
+                                            "local_ids": local_ids,
+                                            "programs": pd.DataFrame({"localId": local_ids}),
+                                            "school_index": SchoolIndex(latitude, longitude) if self.use_index and (self.distance_cache is None) else None}
+        return self._groups[(level, grade)]
+
+    def rank(self, level, grade, chunk: pd.DataFrame, points: np.ndarray, chosen_schools: pd.DataFrame, k: int = None):
+        '''
+        Sorts the programs of (level, grade) by distance once for each point of the chunk, fans the ranking out to the
+        postulants of each point, and keeps the imputed programs of each postulant (see _keep_imputed_programs).
+
+        Args:
+            level, grade: levelId and gradeId of the postulants of the chunk
+            chunk (pd.DataFrame): postulantId, latitude and longitude of the postulants
+            points (np.ndarray): code of the (latitude, longitude) of each postulant
+            chosen_schools (pd.DataFrame): postulantId and localId of the applications of the postulants
+            k (int, optional): programs to sort for each point, enough to impute max_imputed_options schools
+
+        Returns:
+            rows (np.ndarray): row in the chunk of the postulant of each imputed program
+            programs (np.ndarray): position of each imputed program among the programs of (level, grade)
+            ranks (np.ndarray): rank of each imputed program among the imputed programs of the postulant
+        '''
+        group = self._get_group(level, grade)
+        _, first, inverse = np.unique(points, return_index=True, return_inverse=True)
+        latitude, longitude = chunk["latitude"].values[first], chunk["longitude"].values[first]
+        if self.distance_cache is not None:
+            matrix, rows, columns = self.distance_cache.get_distances(level, grade, latitude, longitude, group["local_ids"], group["latitude"], group["longitude"])
+            sorted_programs = sort_distances(matrix[np.ix_(rows, columns)], k=k, max_distance=self.max_distance)
+        elif self.use_index:
+            sorted_programs, _ = group["school_index"].query(latitude, longitude, k=k, max_distance=self.max_distance)
+        else:
+            distances = self.distance_backend.distance_matrix(latitude, longitude, group["latitude"], group["longitude"])
+            ##Sorting by distance. Stable, so programs at the same distance keep the vacancies order
+            sorted_programs = sort_distances(distances, k=k, max_distance=self.max_distance)
+        sorted_programs = sorted_programs[inverse.reshape(-1)]
+
+        keep, imputed_count = _keep_imputed_programs(chunk, group["programs"], sorted_programs, chosen_schools, self.max_imputed_options)
+        rows, positions = np.nonzero(keep)
+        return rows, sorted_programs[rows, positions], imputed_count[rows, positions]
+
+
+def _get_backend(distance_backend, distance_cache):
+    '''
+    DistanceBackend of a distance_backend argument (see get_distance_backend), that must be the one of the
+    DistanceCache.
+    '''
+    distance_backend = get_distance_backend(distance_backend)
+    if (distance_cache is not None) and (distance_cache.distance_backend.key != distance_backend.key):
+        raise ValueError(f'The distance cache has distances of the backend {distance_cache.distance_backend.key}, not {distance_backend.key}.')
+    return distance_backend
+
+
+_worker_shared_block = None
+_worker_ranker = None
+
+
+def _init_worker(shared_name: str, layout: list, ranker_options: dict) -> None:
+    '''
+    Attaches a worker process to the vacancies in shared memory and builds its ChunkRanker once.
+    '''
+    global _worker_shared_block, _worker_ranker
+    _worker_shared_block, program_arrays = _attach_arrays(shared_name, layout)
+    _worker_ranker = ChunkRanker(program_arrays, **ranker_options)
+
+
+def _rank_worker(task: tuple):
+    '''
+    Ranks a chunk in the ChunkRanker of the worker process.
+    '''
+    return _worker_ranker.rank(*task)
+
+
+def _share_arrays(arrays: dict):
+    '''
+    Copies numeric arrays to one block of shared memory.
+
+    Returns:
+        shared_block (SharedMemory): the block, to be closed and unlinked by the caller
+        layout (list): name, dtype, shape and offset of each array (see _attach_arrays)
+    '''
+    layout = []
+    size = 0
+    for name, values in arrays.items():
+        values = np.asarray(values)
+        layout.append((name, values.dtype.str, values.shape, size))
+        ##Offsets aligned to 8 bytes
+        size += -(-values.nbytes//8)*8
+    shared_block = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    for (name, dtype, shape, offset), values in zip(layout, arrays.values()):
+        np.ndarray(shape, dtype=dtype, buffer=shared_block.buf, offset=offset)[...] = values
+    return shared_block, layout
+
+
+def _attach_arrays(shared_name: str, layout: list):
+    '''
+    Read-only views of the arrays copied by _share_arrays.
+
+    Returns:
+        shared_block (SharedMemory): the block, that must be kept while the arrays are used
+        arrays (dict): the arrays by name
+    '''
+    shared_block = shared_memory.SharedMemory(name=shared_name)
+    arrays = {}
+    for name, dtype, shape, offset in layout:
+        arrays[name] = np.ndarray(shape, dtype=dtype, buffer=shared_block.buf, offset=offset)
+        arrays[name].flags.writeable = False
+    return shared_block, arrays
+
+
+def sort_distances(distances: np.ndarray, k: int = None, max_distance: float = None) -> np.ndarray:
+    '''
+    Positions of the programs sorted by distance for each row of a postulant x program matrix, as SchoolIndex.query
+    returns them: stable (programs at the same distance keep their order), only the first k and -1 for the programs
+    beyond max_distance or without distance. Without k and max_distance it is the same as sorting all the programs.
+    '''
+    sorted_programs = np.argsort(distances, axis=1, kind="stable")
+    if (k is None) and (max_distance is None):
+        return sorted_programs
+    sorted_programs = sorted_programs[:, :k]
+    sorted_distances = np.take_along_axis(distances, sorted_programs, axis=1)
+    max_distance = np.inf if max_distance is None else max_distance
+    sorted_programs[~(sorted_distances <= max_distance)] = -1
+    return sorted_programs
+
+
+def _keep_imputed_programs(postulants: pd.DataFrame, possible_programs: pd.DataFrame, sorted_programs: np.ndarray, chosen_schools: pd.DataFrame, max_imputed_options: int = None):
+    '''
+    Marks the sorted programs that are imputed: the nearest program of each school not chosen by the postulant, at most
+    max_imputed_options of them.
+
+    Returns:
+        keep (np.ndarray): True for the imputed programs
+        imputed_count (np.ndarray): number of imputed programs up to each position (its rank if it is imputed)
+    '''
+    n_postulants = len(postulants)
+    postulant_ids = postulants["postulantId"].values
+
+    ##Schools already chosen by each postulant, as a postulant x school matrix. The last column stands for no program
+    school_codes, schools = pd.factorize(possible_programs["localId"])
+    rows = pd.DataFrame({"postulantId": postulant_ids, "row": np.arange(n_postulants)})
+    chosen = chosen_schools.merge(rows, how="inner", on="postulantId")
+    chosen_codes = schools.get_indexer(chosen["localId"])
+    already_chosen = np.zeros((n_postulants, len(schools) + 1), dtype=bool)
+    already_chosen[chosen["row"].values[chosen_codes >= 0], chosen_codes[chosen_codes >= 0]] = True
+    already_chosen[:, -1] = True
+
+    sorted_codes = np.where(sorted_programs >= 0, school_codes[sorted_programs], len(schools))
+    keep = ~np.take_along_axis(already_chosen, sorted_codes, axis=1)
+
+    ##Keeping only the nearest program of each school
+    if len(schools) < len(possible_programs):
+        by_school = np.argsort(sorted_codes, axis=1, kind="stable")
+        codes_by_school = np.take_along_axis(sorted_codes, by_school, axis=1)
+        first_by_school = np.ones(codes_by_school.shape, dtype=bool)
+        first_by_school[:, 1:] = codes_by_school[:, 1:] != codes_by_school[:, :-1]
+        first_of_school = np.empty(first_by_school.shape, dtype=bool)
+        np.put_along_axis(first_of_school, by_school, first_by_school, axis=1)
+        keep &= first_of_school
+
+    imputed_count = np.cumsum(keep, axis=1)
+    if max_imputed_options is not None:
+        keep &= imputed_count <= max_imputed_options
+    return keep, imputed_count
+
+
+def _imputed_rows(postulants: pd.DataFrame, possible_programs: pd.DataFrame, rows: np.ndarray, programs: np.ndarray, ranks: np.ndarray, chosen_count: pd.Series, send_date: str) -> pd.DataFrame:
+    '''
+    Imputed demand rows of the imputed programs (see ChunkRanker.rank).
+    '''
+    postulant_ids = postulants["postulantId"].values[rows]
+
+    ##The student had already selected some schools. The distance preference order starts after that ones
+    imputed = possible_programs.iloc[programs].copy()
+    imputed["postulantId"] = postulant_ids
+    imputed["order"] = chosen_count.reindex(postulant_ids).values + ranks
+    imputed["distancePriority"] = True   ##All new schools are imputed by distance
+    imputed["priority"] = False  ##None of them has a different type of priority
+    imputed["roundNumber"] = 1
+    imputed["roundTypeId"] = "R"
+    imputed["sendDate"] = send_date
+
+    return imputed[IMPUTED_COLUMNS]
+
+
+class DistanceTails:
+    '''
+    Schools imputed by distance that are generated during the matching instead of being added to demand (see
+    impute_nearest_distance_preference and lazy_distance in prepare_data). The applications only carry the nearest
+    imputed school of each postulant. When the matching runs out of the applications of an applicant, extend appends
+    the next imputed schools, in the same order and with the same ids that impute_distance_preference and
+    prepare_applications give them.
+
+    The next block_size - 1 imputed schools of each postulant are ranked with the distance matrices of the imputation
+    and kept as positions of the programs of his/her (levelId, gradeId). Beyond them, the distances from the postulant
+    to the programs are computed again, or read from the DistanceCache of the imputation.
+
+    The imputed applications get the score, priority and priority profile of the first one, so the lottery of the
+    applications with distance must have a single tie break, as in the Tacna scripts.
+    '''
+    def __init__(self, vacancies: pd.DataFrame, chosen_schools: pd.DataFrame, max_imputed_options: int = None, max_distance: float = None, block_size: int = 9, distance_cache=None, distance_backend=None):
+        '''
+        Args:
+            vacancies (pd.DataFrame): raw vacancies, with latitude and longitude
+            chosen_schools (pd.DataFrame): postulantId and localId of the applications of the postulants
+            max_imputed_options (int, optional): see impute_distance_preference
+            max_distance (float, optional): see impute_distance_preference
+            block_size (int): imputed schools ranked by the imputation for each postulant
+            distance_cache (DistanceCache, optional): cache of the distances used by the imputation
+            distance_backend (DistanceBackend, optional): metric of the distances of the imputation
+        '''
+        self.max_imputed_options = max_imputed_options
+        self.max_distance = max_distance
+        self.block_size = block_size
+        self._distance_backend = _get_backend(distance_backend, distance_cache)
+        self._use_index = ((max_imputed_options is not None) or (max_distance is not None)) and isinstance(self._distance_backend, GeodesicBackend)
+        self._distance_cache = distance_cache
+        ##Only the first imputed schools can be ranked, without the distances to all the programs
+        self._partial_ranking = self._use_index or (distance_cache is not None)
+        self._vacancies = vacancies
+        self._chosen_schools = chosen_schools
+        self._groups = {}
+        self._chunks = []
+        ##Number of imputed applications of the postulants whose imputed schools were all computed
+        self._tail_length = {}
+
+    def __len__(self):
+        return len(self._latitude)
+
+    def add_postulants(self, postulants: pd.DataFrame, rows: np.ndarray, programs: np.ndarray, ranks: np.ndarray) -> None:
+        '''
+        Keeps the first block_size imputed programs of a chunk of postulants of the same (levelId, gradeId) (see
+        ChunkRanker.rank). Postulants without imputed programs are left out.
+        '''
+        if self.block_size == 0:
+            return
+        key = (postulants["levelId"].values[0], postulants["gradeId"].values[0])
+        if key not in self._groups:
+            possible_programs = self._vacancies.loc[(self._vacancies["levelId"]==key[0]) & (self._vacancies["gradeId"]==key[1])]
+            school_codes, schools = pd.factorize(possible_programs["localId"])
+            self._groups[key] = {"number": len(self._groups),
+                                 "key": key,
+                                 "latitude": possible_programs["latitude"].values.astype(float),
+                                 "longitude": possible_programs["longitude"].values.astype(float),
+                                 "school_codes": school_codes,
+                                 "local_ids": possible_programs["localId"].values,
+                                 "codes": possible_programs["localId"].astype(str).values + "/" + possible_programs["gradeId"].astype(str).values,
+                                 "repeated_programs": len(possible_programs) - len(schools),
+                                 "school_index": SchoolIndex(possible_programs["latitude"].values, possible_programs["longitude"].values) if self._use_index and (self._distance_cache is None) else None}
+        first = np.full((len(postulants), self.block_size), -1, dtype=np.int32)
+        first[rows, ranks - 1] = programs
+        with_tail = first[:, 0] >= 0
+        self._chunks.append((postulants["postulantId"].values[with_tail], postulants["latitude"].values[with_tail].astype(float),
+                             postulants["longitude"].values[with_tail].astype(float), np.full(with_tail.sum(), self._groups[key]["number"], dtype=np.int32), first[with_tail]))
+
+    def set_ids(self, postulant_ids: pd.DataFrame, program_ids: pd.DataFrame) -> None:
+        '''
+        Sets the applicant_id of each postulant and the program_id of each program, after all the postulants are added.
+
+        Args:
+            postulant_ids (pd.DataFrame): postulantId and applicant_id
+            program_ids (pd.DataFrame): program_autogenerated_code and program_id of every program
+        '''
+        postulant, self._latitude, self._longitude, self._group, self._first = [np.concatenate(arrays) for arrays in zip(*self._chunks)] if self._chunks else \
+            [np.array([], dtype=dtype) for dtype in (np.int64, float, float, np.int32, np.int32)]
+        self._first = self._first.reshape(len(postulant), self.block_size)
+        self._chunks = []
+        applicant_ids = pd.Series(postulant_ids["applicant_id"].values, index=postulant_ids["postulantId"].values)
+        self._position = dict(zip(applicant_ids.reindex(postulant).tolist(), range(len(postulant))))
+
+        ##Schools chosen by each postulant
+        chosen = self._chosen_schools.merge(pd.DataFrame({"postulantId": postulant, "row": np.arange(len(postulant))}), how="inner", on="postulantId").sort_values("row", kind="stable")
+        self._chosen_offsets = np.concatenate([[0], np.cumsum(np.bincount(chosen["row"].values, minlength=len(postulant)))])
+        self._chosen_local_ids = chosen["localId"].values
+        self._chosen_schools = None
+
+        ##Program ids of the code of each program (more than one if the code is repeated, as in the merge of prepare_applications)
+        self._groups = sorted(self._groups.values(), key=lambda group: group["number"])
+        ids_by_code = program_ids.groupby("program_autogenerated_code", sort=False)["program_id"].apply(np.asarray)
+        for group in self._groups:
+            program_ids = ids_by_code.reindex(group.pop("codes")).values
+            ##Usually each code has one program, and the ids are kept as a flat array
+            if all(len(ids) == 1 for ids in program_ids):
+                program_ids = np.concatenate(program_ids) if len(program_ids) > 0 else np.array([], dtype=np.int64)
+            group["program_ids"] = program_ids
+        self._vacancies = None
+
+    def extend(self, applicant, complete: bool = False) -> bool:
+        '''
+        Appends the next imputed schools to the applications of applicant, at the end of the current postulation. Each
+        extension appends at least as many applications as the applicant already has imputed, or all the remaining ones
+        when they need new distances without a SchoolIndex.
+
+        Args:
+            applicant (Applicant): applicant whose postulation is exhausted
+            complete (bool): append all the remaining imputed schools
+
+        Returns:
+            bool: True if some application was appended
+        '''
+        position = self._position.get(applicant.id)
+        if (position is None) or applicant.cut_postulation:
+            return False
+        vdistance = np.asarray(applicant.vdistance)
+        imputed = np.flatnonzero(vdistance == 1)
+        if len(imputed) == 0:
+            return False
+        materialized = len(imputed)
+        if materialized >= self._tail_length.get(position, np.inf):
+            return False
+        target = None if complete else max(2*materialized, self.block_size)
+        if (target is not None) and (target > self.block_size) and not self._partial_ranking:
+            ##Beyond the ranked block all the distances of the postulant are computed, so all the schools are appended
+            target = None
+        program_ids, institution_ids = self.get_imputed_programs(position, target)
+        if target is None:
+            self._tail_length[position] = len(program_ids)
+        if len(program_ids) <= materialized:
+            return False
+        program_ids = program_ids[materialized:]
+        institution_ids = institution_ids[materialized:]
+
+        ##Same score, priority and priority profile as the first imputed application
+        first = imputed[0]
+        n = len(program_ids)
+        applicant.extend_postulation(vpostulation=program_ids,
+                                     vinstitution_id=institution_ids,
+                                     vquota_id=np.ones(n, dtype=np.asarray(applicant.vquota_id).dtype),
+                                     vpostulation_scores=np.full(n, applicant.scores[first]),
+                                     vpriorities=np.full(n, applicant.priorities[first]),
+                                     vpriority_profile=np.full(n, applicant.priority_profiles[first]),
+                                     vdistance=np.ones(n, dtype=vdistance.dtype))
+        return True
+
+    def get_imputed_programs(self, position: int, n: int = None):
+        '''
+        Imputed applications of the postulant in position, in order, until n imputed schools (all if None). Beyond the
+        ranked block it may return more.
+
+        Returns:
+            program_ids (np.ndarray), institution_ids (np.ndarray)
+        '''
+        group = self._groups[self._group[position]]
+        if self.max_imputed_options is not None:
+            n = self.max_imputed_options if n is None else min(n, self.max_imputed_options)
+        if n is not None and n <= self.block_size:
+            sorted_programs = self._first[position, :n]
+            sorted_programs = sorted_programs[sorted_programs >= 0]
+        else:
+            ##Without a SchoolIndex or a DistanceCache the distances to all the programs are computed again, so all the schools are returned
+            sorted_programs = self._rank_imputed_programs(position, group, n if self._partial_ranking else self.max_imputed_options)
+        program_ids = group["program_ids"][sorted_programs]
+        if program_ids.dtype != object:
+            return program_ids, group["local_ids"][sorted_programs]
+        if len(program_ids) == 0:
+            return np.array([], dtype=np.int64), np.array([], dtype=group["local_ids"].dtype)
+        institution_ids = np.repeat(group["local_ids"][sorted_programs], [len(ids) for ids in program_ids])
+        return np.concatenate(program_ids), institution_ids
+
+    def _rank_imputed_programs(self, position: int, group: dict, n: int = None) -> np.ndarray:
+        '''
+        Positions of the first n imputed programs of the postulant in position (all if None), with the same search and
+        filters as impute_distance_preference.
+        '''
+        chosen_local_ids = self._chosen_local_ids[self._chosen_offsets[position]:self._chosen_offsets[position+1]]
+        latitude, longitude = self._latitude[position:position+1], self._longitude[position:position+1]
+        k = None if n is None else n + len(chosen_local_ids) + group["repeated_programs"]
+        if self._distance_cache is not None:
+            matrix, rows, columns = self._distance_cache.get_distances(*group["key"], latitude, longitude, group["local_ids"], group["latitude"], group["longitude"])
+            sorted_programs = sort_distances(matrix[np.ix_(rows, columns)], k=k, max_distance=self.max_distance)[0]
+            sorted_programs = sorted_programs[sorted_programs >= 0]
+        elif self._use_index:
+            sorted_programs, _ = group["school_index"].query(latitude, longitude, k=k, max_distance=self.max_distance)
+            sorted_programs = sorted_programs[0]
+            sorted_programs = sorted_programs[sorted_programs >= 0]
+        else:
+            distances = self._distance_backend.distance_matrix(latitude, longitude, group["latitude"], group["longitude"])
+            sorted_programs = sort_distances(distances, k=k, max_distance=self.max_distance)[0]
+            sorted_programs = sorted_programs[sorted_programs >= 0]
+
+        ##Removing the chosen schools and keeping the nearest program of each school
+        keep = ~np.isin(group["local_ids"][sorted_programs], chosen_local_ids)
+        if group["repeated_programs"] > 0:
+            first_of_school = np.zeros(len(sorted_programs), dtype=bool)
+            first_of_school[np.unique(group["school_codes"][sorted_programs], return_index=True)[1]] = True
+            keep &= first_of_school
+        return sorted_programs[keep][:n]
@@ -14,8 +14,15 @@ from cb_da.entities.applicants import Applicant
 
 
 class DeferredAcceptanceAlgorithm:
-    def __init__(self):
-        pass
+    def __init__(self, distance_tails=None):
+        '''
+        Args:
+            distance_tails (DistanceTails, optional): Imputed applications
+                generated when an applicant runs out of applications
+        '''
+        # Proposals, rejections and longest rejection chain of the last run
+        self.run_stats = {}
+        self.distance_tails = distance_tails
 
     def run(self,
             applicants: Dict[int, Applicant],
@@ -28,6 +35,12 @@ class DeferredAcceptanceAlgorithm:
             programs (dict): Programs to be matched
         '''
         remaining_proposals = list(applicants.values())
+        proposals = 0
+        rejections = 0
+        # Rejected applicants propose right away (last in the stack), so a
+        # chain goes on while each proposal rejects somebody who proposes.
+        chain = 0
+        longest_chain = 0
         while len(remaining_proposals)>0:
             # Get next proposing applicant
             # applicant = remaining_proposals.pop(0)
@@ -46,19 +59,32 @@ class DeferredAcceptanceAlgorithm:
                 except:
                     raise ValueError(f'Error while assigning applicant\
                         :{applicant.id} to program:{program_pointer}')
+                proposals += 1
                 if rejected_applicant:
+                    rejections += 1
+                    chain += 1
+                    if chain > longest_chain:
+                        longest_chain = chain
                     rejected_applicant.option_n += 1
 
                     if (rejected_applicant.option_n <
-                            len(rejected_applicant.vpostulation)):
+                            len(rejected_applicant.vpostulation)) or \
+                            (self.distance_tails is not None and
+                             self.distance_tails.extend(rejected_applicant)):
                         (DeferredAcceptanceAlgorithm.
                             unmatch_applicant_of_program(
                             rejected_applicant))
                         remaining_proposals.append(rejected_applicant)
                     else:
+                        chain = 0
                         (DeferredAcceptanceAlgorithm
                             .applicant_match_with_None_program(
                             rejected_applicant))
+                else:
+                    chain = 0
+        self.run_stats = {'proposals': proposals,
+                            'rejections': rejections,
+                            'longest_rejection_chain': longest_chain}
 
     @staticmethod
     def match_applicant_to_program(
@@ -83,8 +109,7 @@ class DeferredAcceptanceAlgorithm:
         program = programs[program_pointer]
         rejected_applicant = None
         # Ocupar cupos que van quedando remanentes en el assignment.
-        assigned_applicants = program.get_assignment_type_queue(
-                                assignment_type=applicant.special_assignment)
+        assigned_applicants = program.queues[applicant.special_assignment]
 
         try:
             new_applicant_score = \
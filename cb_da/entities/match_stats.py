@@ -0,0 +1,71 @@
+'''
+File: match_stats.py
+Created Date: Saturday October 17th 2026
+Author: Benjamín Madariaga
+Company: Consilium Bots Inc.
+'''
+
+from typing import Any, Dict, List
+
+import pandas as pd
+
+
+class MatchingStats:
+    '''
+    Wall times and counters of a PolicyMaker run: time of each stage of
+    PolicyMaker.__init__, time, proposals, rejections and longest rejection
+    chain of each (grade, assignment_type) round, and the rejected
+    applicants of each program.
+    '''
+    def __init__(self,
+            stage_times: Dict[str, float],
+            round_stats: List[Dict[str, Any]],
+            program_stats: List[Dict[str, Any]]) -> None:
+        '''
+        Args:
+            stage_times (Dict[str, float]): Seconds of each init stage
+            round_stats (List[Dict]): One row per round
+            program_stats (List[Dict]): One row per program
+        '''
+        self.stages = pd.DataFrame(list(stage_times.items()),
+                                   columns=['stage', 'seconds'])
+        self.rounds = pd.DataFrame(round_stats, columns=[
+            'grade', 'assignment_type', 'seconds', 'applicants', 'proposals',
+            'rejections', 'longest_rejection_chain'])
+        self.programs = pd.DataFrame(program_stats, columns=[
+            'program_id', 'quota_id', 'grade_id', 'capacity', 'assigned',
+            'rejected'])
+
+    def get_most_contended_programs(self, n: int = 10) -> pd.DataFrame:
+        '''
+        Programs with the most rejected applicants.
+
+        Args:
+            n (int): Number of programs
+
+        Returns:
+            pd.DataFrame: program_id, quota_id, grade_id, capacity, assigned,
+                rejected and rejected_per_seat
+        '''
+        programs = self.programs.assign(
+            rejected_per_seat=self.programs['rejected'] /
+            self.programs['capacity'].where(self.programs['capacity'] > 0))
+        return programs.sort_values(['rejected', 'rejected_per_seat'],
+                                    ascending=False, kind='stable') \
+            .head(n).reset_index(drop=True)
+
+    def summary(self) -> Dict[str, Any]:
+        '''
+        Totals of the run.
+
+        Returns:
+            Dict[str, Any]: init_seconds, match_seconds, proposals,
+                rejections and longest_rejection_chain
+        '''
+        return {'init_seconds': float(self.stages['seconds'].sum()),
+                'match_seconds': float(self.rounds['seconds'].sum()),
+                'proposals': int(self.rounds['proposals'].sum()),
+                'rejections': int(self.rounds['rejections'].sum()),
+                'longest_rejection_chain':
+                    int(self.rounds['longest_rejection_chain'].max())
+                    if len(self.rounds) else 0}
@@ -6,13 +6,17 @@ Company: Consilium Bots Inc.
 Modified By:  Benjamín Madariaga at b.madariaga.e@gmail.com
 '''
 
-from typing import Any, Dict, Tuple, List
+from typing import Any, Callable, Dict, Tuple, List
+import time
 import pandas as pd
 import numpy as np
 
 from cb_da.entities.programs import Program
-from cb_da.entities.applicants import Applicant
+from cb_da.entities.applicants import Applicant, get_applicant_class
 from cb_da.entities.match import DeferredAcceptanceAlgorithm
+from cb_da.entities.array_match import ArrayDeferredAcceptanceAlgorithm, \
+    RoundDeferredAcceptanceAlgorithm
+from cb_da.entities.match_stats import MatchingStats
 
 
 class PolicyMaker:
@@ -28,7 +32,8 @@ class PolicyMaker:
             quota_order: pd.DataFrame,
             siblings: pd.DataFrame,
             links: pd.DataFrame,
-            config: Dict[str, Any]
+            config: Dict[str, Any],
+            distance_tails: Any = None
             ) -> None:
         '''
         Args:
@@ -41,28 +46,51 @@ class PolicyMaker:
             siblings (pd.DataFrame): DataFrame with siblings info.
             links (pd.DataFrame): DataFrame with links info.
             config (Dict): Dict with the set of rules fro the match
+            distance_tails (DistanceTails, optional): Applications imputed
+                by distance that are generated during the matching, when an
+                applicant runs out of applications (see prepare_data with
+                lazy_distance). Only with the object engine and without
+                sibling priority.
         '''
         self.config = config
+        self.distance_tails = distance_tails
+        # Seconds of each stage of the initialization
+        self.stage_times: Dict[str, float] = {}
         self._unpack_priority_profiles(priority_profiles)
         self._unpack_quota_order(quota_order)
         self._set_rules()
-        self.algorithm = DeferredAcceptanceAlgorithm()
-        applicants = self._add_sibling_and_linked_data(applicants=applicants,
-                                                        siblings=siblings,
-                                                        links=links)
-        applicants = self._add_postulation_data(applicants=applicants,
-                                                applications=applications)
-        self.applicants_df = self._init_applicants(applicants=applicants)
-        self.programs_df = self._init_programs(programs=vacancies)
-
-        self.applicants = self._get_applicants_dict()
-        self.programs = self._get_programs_dict()
+        self.algorithm = self._get_algorithm()
+        applicants = self._timed(self._add_sibling_and_linked_data,
+                                applicants=applicants,
+                                siblings=siblings,
+                                links=links)
+        applicants = self._timed(self._add_postulation_data,
+                                applicants=applicants,
+                                applications=applications)
+        self.applicants_df = self._timed(self._init_applicants,
+                                        applicants=applicants)
+        self.programs_df = self._timed(self._init_programs,
+                                        programs=vacancies)
+
+        self.applicants = self._timed(self._get_applicants_dict)
+        self.programs = self._timed(self._get_programs_dict)
+        self._round_applicants, self._round_se_applicants = \
+            self._get_round_partitions()
 
         self.ordered_grades = self._get_ordered_grades()
         self.assignment_types = self._get_assignment_types()
         self.first_round = self.ordered_grades[0]
         self.last_round = self.ordered_grades[-1]
         self.results: Dict[str, pd.DataFrame] = {}
+        self.round_stats: Dict[Tuple[int, int], pd.DataFrame] = {}
+        # Time and counters of each round of the last matching
+        self.match_stats: List[Dict[str, Any]] = []
+        self.rounds = [(grade, assignment_type)
+            for grade in self.ordered_grades
+            for assignment_type in self.assignment_types]
+        self._round_index = {matching_round: i
+            for i, matching_round in enumerate(self.rounds)}
+        self._current_round = None
 
 
     def match_applicants_and_programs(self) -> None:
@@ -71,8 +99,11 @@ class PolicyMaker:
         postulation order, linked postulation and secured enrollment between
         rounds according to the rules in config.
         '''
+        self.match_stats = []
         for grade in self.ordered_grades:
             for assignment_type in self.assignment_types:
+                self._current_round = (grade, assignment_type)
+                start = time.perf_counter()
 
                 applicants_to_be_assigned = \
                     self._prep_applicants_for_matching(
@@ -85,12 +116,24 @@ class PolicyMaker:
                 except:
                     raise ValueError(f'Error while assigning grade:{grade} and \
                     assignment_type:{assignment_type}')
+                if self._engine == 'round':
+                    # Proposals and rejections of each round, to check
+                    # convergence.
+                    self.round_stats[(grade, assignment_type)] = \
+                        pd.DataFrame(self.algorithm.round_stats)
 
                 self._after_round_adjustments(
                     applicants_to_be_assigned=applicants_to_be_assigned,
                     grade=grade,
                     assignment_type=assignment_type)
 
+                self.match_stats.append({
+                    'grade': grade,
+                    'assignment_type': assignment_type,
+                    'seconds': time.perf_counter() - start,
+                    'applicants': len(applicants_to_be_assigned),
+                    **self.algorithm.run_stats})
+
 
 
     def get_results(self) -> pd.DataFrame:
@@ -118,11 +161,52 @@ class PolicyMaker:
         results = pd.DataFrame(yield_applicants())
         return results
 
+    def get_stats(self) -> MatchingStats:
+        '''
+        Return the wall times of the initialization and of the rounds of the
+        last matching, with the proposals, rejections and longest rejection
+        chain of each round and the rejected applicants of each program.
+        The counters are kept by the engines on every run, so this only
+        gathers them.
+
+        Returns:
+            MatchingStats
+        '''
+        program_stats = [{
+            'program_id': program.program_id,
+            'quota_id': program.quota_id,
+            'grade_id': program.grade_id,
+            'capacity': sum(queue.capacity for queue in program.queues
+                            if queue is not None),
+            'assigned': sum(len(queue.vassigned_applicants)
+                            for queue in program.queues if queue is not None),
+            'rejected': len(program.waitlist_dict)}
+            for program in self.programs.values()]
+        return MatchingStats(stage_times=self.stage_times,
+                            round_stats=self.match_stats,
+                            program_stats=program_stats)
+
+    def _timed(self, method: Callable, **kwargs) -> Any:
+        '''
+        Run an initialization stage and keep its wall time in stage_times.
+
+        Args:
+            method (Callable): Stage of the initialization
+            kwargs: Arguments of method
+
+        Returns:
+            Any: Output of method
+        '''
+        start = time.perf_counter()
+        output = method(**kwargs)
+        self.stage_times[method.__name__] = time.perf_counter() - start
+        return output
+
     def _init_applicants(
             self,
             applicants: pd.DataFrame) -> pd.DataFrame:
         '''
-        Init all applicants objects in a df
+        Prepare the applicants df to build the applicant objects
 
         Args:
             applicants (pd.DataFrame): raw applicants dataframe
@@ -135,15 +219,13 @@ class PolicyMaker:
         applicants['secured_enrollment_program_id'] = applicants['secured_enrollment_program_id'].fillna(0)
         if not 'vdistance' in applicants.columns:
             applicants["vdistance"] = ""
-        applicants['applicant_object'] = \
-            applicants.apply(self._init_applicant_object, axis=1)
         return applicants
 
     def _init_programs(
             self,
             programs: pd.DataFrame) -> pd.DataFrame:
         '''
-        Init all program objects in a df
+        Prepare the programs df to build the program objects
 
         Args:
             programs (pd.DataFrame): raw programs dataframe
@@ -153,38 +235,115 @@ class PolicyMaker:
         '''
         self.special_assignment_cols = [col for col in programs.columns \
             if 'special' in col]
-        programs['program_object'] = \
-            programs.apply(self._init_program_object, axis=1)
         return programs
 
     def _get_applicants_dict(
             self,
-            query: str = '') -> Dict[int, Applicant]:
+            applicants: pd.DataFrame = None) -> Dict[int, Applicant]:
         '''
-        Returns the applicants as dict according to a query.
+        Builds the applicant objects from the columns of applicants, zipping
+        the columns instead of creating a Series for each row.
+
+        Args:
+            applicants (pd.DataFrame): Applicants df, self.applicants_df by
+                default
 
         Returns:
             Dict[int, Applicant]: {Applicant_id: Applicant_object}
         '''
+        if applicants is None:
+            applicants = self.applicants_df
+        columns = ['applicant_id', 'grade_id',
+                   'secured_enrollment_program_id',
+                   'secured_enrollment_quota_id', 'links', 'siblings',
+                   'vpostulation', 'vpostulation_scores', 'vinstitution_id',
+                   'vpriorities', 'vquota_id', 'vdistance',
+                   'vpriority_profile', 'special_assignment']
+        if len(self.applicant_characteristics) > 0:
+            characteristics = [dict(zip(self.applicant_characteristics, row))
+                for row in zip(*[applicants[col].tolist()
+                                 for col in self.applicant_characteristics])]
+        else:
+            characteristics = [{}]*len(applicants)
+
+        applicant_class = get_applicant_class(self.applicant_characteristics)
+        applicants_dict = {}
+        for (applicant_id, grade, se_program_id, se_quota_id, links, siblings,
+                vpostulation, vpostulation_scores, vinstitution_id,
+                vpriorities, vquota_id, vdistance, vpriority_profile,
+                special_assignment), applicant_characteristics in zip(
+                    zip(*[applicants[col].tolist() for col in columns]),
+                    characteristics):
+            applicants_dict[applicant_id] = applicant_class(
+                applicant_id=applicant_id,
+                grade=grade,
+                se_program_id=se_program_id,
+                se_quota_id=se_quota_id,
+                links=links,
+                siblings=siblings,
+                vpostulation=vpostulation,
+                vpostulation_scores=vpostulation_scores,
+                vinstitution_id=vinstitution_id,
+                vpriorities=vpriorities,
+                vquota_id=vquota_id,
+                vdistance=vdistance,
+                vpriority_profile=vpriority_profile,
+                special_assignment=special_assignment,
+                applicant_characteristics=applicant_characteristics)
+        return applicants_dict
+
+    def _get_round_partitions(self) -> Tuple[
+            Dict[Tuple[int, int], Dict[int, Applicant]],
+            Dict[Tuple[int, int], Dict[int, Applicant]]]:
+        '''
+        Splits the applicants by round, so each round gets its applicants
+        with a dict lookup instead of a query over applicants_df.
 
-        applicants_df = self.applicants_df
-        if len(query) > 0:
-            applicants_df = applicants_df.query(query)
-        return (applicants_df[['applicant_id', 'applicant_object']]
-                .set_index('applicant_id')
-                .to_dict(orient='dict'))['applicant_object']
+        Returns:
+            Tuple[Dict, Dict]: {(grade, assignment_type): {Applicant_id:
+            Applicant_object}} for all the applicants and for the applicants
+            with secured enrollment
+        '''
+        round_applicants = {}
+        round_se_applicants = {}
+        for applicant_id, applicant in self.applicants.items():
+            matching_round = (applicant.grade, applicant.special_assignment)
+            round_applicants.setdefault(matching_round, {})[applicant_id] = \
+                applicant
+            if applicant.se_program_id is not None:
+                round_se_applicants.setdefault(matching_round, {})[
+                    applicant_id] = applicant
+        return round_applicants, round_se_applicants
 
     def _get_programs_dict(self) -> Dict[Tuple[int, int], Program]:
         '''
-        Returns the applicants as dict according to a query.
+        Builds the program objects from the columns of self.programs_df,
+        zipping the columns instead of creating a Series for each row.
 
         Returns:
             Dict[Tuple[int, int], Program]: {(Program_id,Program_Quota_id): \
             Program_object}
         '''
-        return (self.programs_df[['program_id', 'quota_id','program_object']]
-                .set_index(['program_id', 'quota_id'])
-                .to_dict()['program_object'])
+        columns = ['program_id', 'institution_id', 'grade_id', 'quota_id',
+                   'regular_vacancies']
+        programs_dict = {}
+        for (program_id, institution_id, grade_id, quota_id,
+                regular_vacancies), special_vacancies in zip(
+                    zip(*[self.programs_df[col].tolist() for col in columns]),
+                    zip(*[self.programs_df[col].tolist()
+                          for col in self.special_assignment_cols])
+                    if len(self.special_assignment_cols) > 0
+                    else [()]*len(self.programs_df)):
+            programs_dict[(program_id, quota_id)] = Program(
+                program_id=program_id,
+                institution_id=institution_id,
+                grade_id=grade_id,
+                quota_id=quota_id,
+                regular_capacity=regular_vacancies,
+                special_vacancies=dict(zip(self.special_assignment_cols,
+                                           special_vacancies)),
+                queue_type=self._queue_type)
+        return programs_dict
 
     def _set_rules(self):
         '''
@@ -202,6 +361,34 @@ class PolicyMaker:
             self.config['secured_enrollment_assignment']
         self._forced_secured_enrollment_activation = \
             self.config['forced_secured_enrollment_assignment']
+        self._queue_type = self.config.get('queue_type', 'list')
+        self._engine = self.config.get('engine', 'object')
+
+    def _get_algorithm(self):
+        '''
+        Returns the matching engine according to config. All engines return
+        the same matching when there are no ties in the scores.
+
+        Returns:
+            DeferredAcceptanceAlgorithm or ArrayDeferredAcceptanceAlgorithm
+        '''
+        if self.distance_tails is not None:
+            if self._engine != 'object':
+                raise ValueError(f'Engine "{self._engine}" does not support\
+                 distance_tails. Please use the "object" engine.')
+            if self._sibling_priority_activation:
+                raise ValueError('Sibling priority is not supported with\
+                 distance_tails.')
+        if self._engine == 'object':
+            return DeferredAcceptanceAlgorithm(
+                distance_tails=self.distance_tails)
+        elif self._engine == 'array':
+            return ArrayDeferredAcceptanceAlgorithm()
+        elif self._engine == 'round':
+            return RoundDeferredAcceptanceAlgorithm()
+        else:
+            raise ValueError(f'Engine "{self._engine}" is not supported.\
+             Please enter "object", "array" or "round".')
 
     def _get_ordered_grades(self) -> List:
         '''
@@ -242,29 +429,43 @@ class PolicyMaker:
             grade (int)
             assignment_type (int)
         '''
-        q1 = (f'((grade_id == {grade}) &'
-              f' (special_assignment == {assignment_type}))')
-        stus_to_be_assigned_df = self.applicants_df.query(q1)
-        stus_to_be_assigned_se_df = stus_to_be_assigned_df[
-                stus_to_be_assigned_df.secured_enrollment_program_id!=0]
+        matching_round = (grade, assignment_type)
+        applicants_to_be_assigned = self._round_applicants.get(
+            matching_round, {})
         if grade != self.first_round:
             # Dynamic sibling priority
             if (self._sibling_priority_activation):
-                stus_to_be_assigned_df.loc[:, 'applicant_object'].apply(
-                  self._apply_sib_priority)
+                for applicant in applicants_to_be_assigned.values():
+                    self._apply_sib_priority(applicant)
         if grade != self.first_round:
             # reorder postulation
             if (self._linked_postulation_activation):
-                stus_to_be_assigned_df.loc[:, 'applicant_object'].apply(
-                    self._apply_linked_reorder)
+                for applicant in applicants_to_be_assigned.values():
+                    self._apply_linked_reorder(applicant)
         # #Get the right quota postulation order
-        stus_to_be_assigned_df.loc[:, 'applicant_object'].apply(
-        self._check_quota_postulation_order)
+        for applicant in applicants_to_be_assigned.values():
+            self._check_quota_postulation_order(applicant)
         if (self._secured_enrollment_activation):
-            stus_to_be_assigned_se_df.loc[:, 'applicant_object'].apply(
-                lambda applicant: \
-                applicant.set_secured_place_as_last_postulation())
-        return self._get_applicants_dict(query=q1)
+            for applicant in self._round_se_applicants.get(
+                    matching_round, {}).values():
+                self._complete_distance_tail(applicant)
+                applicant.set_secured_place_as_last_postulation()
+        return dict(applicants_to_be_assigned)
+
+    def _complete_distance_tail(
+            self,
+            applicant: Applicant) -> None:
+        '''
+        Appends all the applications imputed by distance of an applicant
+        whose secured enrollment program is not among his/her current
+        applications, so the postulation can be cut there.
+
+        Args:
+            applicant (Applicant)
+        '''
+        if (self.distance_tails is not None) and \
+                (applicant.se_program_id not in applicant.vpostulation):
+            self.distance_tails.extend(applicant, complete=True)
 
     def _after_round_adjustments(
             self,
@@ -285,15 +486,9 @@ class PolicyMaker:
                                             assignment_type=assignment_type)
 
         if (self._forced_secured_enrollment_activation):
-            subset = applicants_to_be_assigned.keys()
-            applicants_with_se = \
-                (self.applicants_df
-                [self.applicants_df.applicant_id.isin(subset)])
-            applicants_with_se = applicants_with_se[
-                applicants_with_se.secured_enrollment_program_id!=0]
-
-            (applicants_with_se.loc[:, 'applicant_object']
-             .apply(self._match_secured_enrollment_applicant))
+            for applicant in self._round_se_applicants.get(
+                    (grade, assignment_type), {}).values():
+                self._match_secured_enrollment_applicant(applicant)
 
     def _apply_sib_priority(
             self,
@@ -348,8 +543,10 @@ class PolicyMaker:
             for link_applicant_id in applicant.vlinks:
                 # Get the linked applicant from applicants graph
                 linked = self.applicants[link_applicant_id]
-                # Check if the linked is alredy matched to some program.
-                if (linked.match) and (linked.assigned_vacancy is not None):
+                # Check if the linked is alredy matched to some program in a
+                # previous round.
+                if (linked.match) and (linked.assigned_vacancy is not None) \
+                        and self._is_previous_round(linked):
                     # Give me the school where the linked was accepted and
                     # append it to the array.
                     schools_with_linked.add(
@@ -384,6 +581,23 @@ class PolicyMaker:
                                         new_postulation_arrays_order)
 
 
+    def _is_previous_round(
+            self,
+            applicant: Applicant) -> bool:
+        '''
+        True if the round of applicant is before the current round. In a
+        full match the applicants of the next rounds are not matched yet, but
+        in a rematch they keep the previous matching.
+
+        Args:
+            applicant (Applicant)
+        '''
+        if self._current_round is None:
+            return True
+        return self._round_index[(applicant.grade,
+                                  applicant.special_assignment)] < \
+            self._round_index[self._current_round]
+
     def _check_quota_postulation_order(
             self,
             applicant: Applicant) -> None:
@@ -395,14 +609,15 @@ class PolicyMaker:
         Args:
             applicant (Applicant)
         '''
+        vpriority_profile = applicant.vpriority_profile
         # If the applicant has a priority that needs reorder
-        if not set(applicant.vpriority_profile.values()).isdisjoint(self.quota_order_dict_keys):
+        if not set(vpriority_profile.values()).isdisjoint(self.quota_order_dict_keys):
             #Get the programs where the student has such priority
-            programs_to_modify = [program_id for program_id,priority_profiles in applicant.vpriority_profile.items() if priority_profiles in self.quota_order_dict_keys]
+            programs_to_modify = [program_id for program_id,priority_profiles in vpriority_profile.items() if priority_profiles in self.quota_order_dict_keys]
 
             for program_id in programs_to_modify:
                 # Loop over all programs that need reorder
-                priority_profile = applicant.vpriority_profile[program_id]
+                priority_profile = vpriority_profile[program_id]
                 pp_quota_order = self.quota_order_dict[priority_profile].copy()
                 secured_enrollment_indicator = \
                     (applicant.se_program_id==program_id)
@@ -480,56 +695,6 @@ class PolicyMaker:
             applicant.assigned_vacancy = secured_program
 
 
-    def _init_applicant_object(self, row: pd.DataFrame) -> Applicant:
-        '''
-        From applicants dataframe row, init an applicant object.
-
-        Args:
-            row (pd.DataFrame): Row of applicants dataframe
-
-        Returns:
-            Applicant: applicant object
-        '''
-        aux_dict = row.to_dict()
-        applicant_characteristics= {key:aux_dict[key] for key in self.applicant_characteristics}
-        applicant = Applicant(applicant_id=aux_dict['applicant_id'],
-                      grade=aux_dict['grade_id'],
-                      se_program_id=aux_dict['secured_enrollment_program_id'],
-                      se_quota_id=aux_dict['secured_enrollment_quota_id'],
-                      links=aux_dict['links'],
-                      siblings=aux_dict['siblings'],
-                      vpostulation=aux_dict['vpostulation'],
-                      vpostulation_scores=aux_dict['vpostulation_scores'],
-                      vinstitution_id=aux_dict['vinstitution_id'],
-                      vpriorities=aux_dict['vpriorities'],
-                      vquota_id=aux_dict['vquota_id'],
-                      vdistance=aux_dict['vdistance'],
-                      vpriority_profile=aux_dict['vpriority_profile'],
-                      special_assignment=aux_dict['special_assignment'],
-                      applicant_characteristics=applicant_characteristics)
-        return applicant
-
-
-    def _init_program_object(self, row: pd.DataFrame) -> Program:
-        '''
-        From vacancies dataframe row, init a program object.
-
-        Args:
-            row (pd.DataFrame): Row of programs dataframe
-
-        Returns:
-            Program: program object
-        '''
-        aux_dict = row.to_dict()
-        special_vacancies= {key:aux_dict[key] for key in self.special_assignment_cols}
-        prog = Program(program_id=aux_dict['program_id'],
-                       institution_id=aux_dict['institution_id'],
-                       grade_id=aux_dict['grade_id'],
-                       quota_id=aux_dict['quota_id'],
-                       regular_capacity=aux_dict['regular_vacancies'],
-                       special_vacancies=special_vacancies)
-        return prog
-
     def _add_sibling_and_linked_data(
             self,
             applicants: pd.DataFrame,
@@ -714,3 +879,332 @@ class PolicyMaker:
             program._reset_matching_attributes()
         for applicant in self.applicants.values():
             applicant._reset_matching_attributes()
+
+    def rematch(
+            self,
+            applications: pd.DataFrame = None,
+            vacancies: pd.DataFrame = None) -> None:
+        '''
+        Updates the current matching after changes in the applications of
+        some applicants or in the capacities of some programs, instead of
+        matching everyone again. Only the changed applicants, the applicants
+        rejected by programs that got free seats (and so on along the
+        rejection chains) and the applicants whose linked reorder changed are
+        matched again, round by round. Without ties in the scores the result
+        is the same matching as a full run with the new data.
+
+        match_applicants_and_programs must have been run before. Applicants
+        can not be added or removed. With sibling priority or forced secured
+        enrollment, all applicants are matched again. With distance_tails
+        only the vacancies can change.
+
+        Args:
+            applications (pd.DataFrame): All the applications of the changed
+                applicants, with the same columns as in __init__.
+            vacancies (pd.DataFrame): Rows of vacancies of the changed
+                programs, with the same columns as in __init__.
+        '''
+        if (applications is not None) and (self.distance_tails is not None):
+            raise ValueError('Changes in the applications are not supported\
+             with distance_tails.')
+        dirty_applicants = {matching_round: {} for matching_round in
+                            self.rounds}
+        dirty_queues = {matching_round: [] for matching_round in self.rounds}
+        previous_assignment = {}
+
+        if applications is not None:
+            for old_applicant in self._update_applications(applications):
+                applicant = self.applicants[old_applicant.id]
+                previous_assignment[applicant.id] = \
+                    old_applicant.assigned_vacancy
+                freed = self._detach_applicant(old_applicant, 0)
+                matching_round = (applicant.grade,
+                                  applicant.special_assignment)
+                dirty_applicants[matching_round][applicant.id] = applicant
+                dirty_queues[matching_round].extend(freed)
+        if vacancies is not None:
+            for program, assignment_type in \
+                    self._update_capacities(vacancies):
+                dirty_queues[(program.grade_id, assignment_type)].append(
+                    (program, assignment_type))
+
+        if self._sibling_priority_activation or \
+                self._forced_secured_enrollment_activation:
+            self.reset_matching()
+            self.match_applicants_and_programs()
+            return
+
+        linked_by = self._get_linked_by()
+        for grade in self.ordered_grades:
+            grade_programs = [program for program in self.programs.values()
+                              if program.grade_id == grade]
+            if self._transfer_capacity_activation:
+                # Transfers are computed again after the special rounds
+                regular_capacity = {}
+                for program in grade_programs:
+                    regular_capacity[program] = \
+                        program.regular_assignment.capacity
+                    for assignment_type in self.assignment_types:
+                        program.get_assignment_type_queue(
+                            assignment_type=assignment_type).restore_capacity()
+
+            for assignment_type in self.assignment_types:
+                matching_round = (grade, assignment_type)
+                self._current_round = matching_round
+                if self._transfer_capacity_activation and \
+                        assignment_type == 0:
+                    dirty_queues[matching_round].extend(
+                        (program, 0) for program in grade_programs
+                        if program.regular_assignment.capacity !=
+                        regular_capacity[program])
+
+                # Assignments that the next rounds use in the linked reorder
+                linked_applicants = {applicant_id: self.applicants[
+                    applicant_id].assigned_vacancy for applicant_id in
+                    linked_by.get(matching_round, {})}
+
+                pending = self._settle_round(
+                    dirty_applicants=dirty_applicants[matching_round],
+                    dirty_queues=dirty_queues[matching_round])
+                if len(pending) > 0:
+                    self.algorithm.run(applicants=pending,
+                                       programs=self.programs)
+
+                if (assignment_type != 0) and \
+                        (self._transfer_capacity_activation):
+                    self._reasign_programs_capacity(
+                        current_grade=grade,
+                        assignment_type=assignment_type)
+
+                # Applicants linked to moved applicants are matched again
+                moved = [applicant_id for applicant_id, assigned_vacancy in
+                         linked_applicants.items() if self.applicants[
+                         applicant_id].assigned_vacancy is not
+                         assigned_vacancy]
+                moved += [applicant_id for applicant_id in
+                          dirty_applicants[matching_round] if applicant_id
+                          in previous_assignment and self.applicants[
+                          applicant_id].assigned_vacancy is not
+                          previous_assignment[applicant_id]]
+                for applicant_id in moved:
+                    for linked_id in linked_by[matching_round].get(
+                            applicant_id, []):
+                        linked = self.applicants[linked_id]
+                        dirty_applicants[(linked.grade,
+                                          linked.special_assignment)][
+                                              linked_id] = linked
+
+    def _settle_round(
+            self,
+            dirty_applicants: Dict[int, Applicant],
+            dirty_queues: List[Tuple[Program, int]]) -> Dict[int, Applicant]:
+        '''
+        Takes the current matching back to a state from which Deferred
+        Acceptance gives the matching of a full run. Dirty applicants are
+        removed from their queues and prepared again from their first option.
+        Queues over capacity reject their worst applicants. In queues with
+        free seats the rejections are no longer justified, so all the
+        rejected applicants of the queue propose again from there, leaving
+        their current queues and so on.
+
+        Args:
+            dirty_applicants (Dict[int, Applicant]): Applicants to be
+                matched again from scratch
+            dirty_queues (List[Tuple[Program, int]]): Program and assignment
+                type of the queues that changed
+
+        Returns:
+            Dict[int, Applicant]: Applicants that have to propose
+        '''
+        pending = {}
+        dirty_queues = list(dirty_queues)
+        for applicant in dirty_applicants.values():
+            dirty_queues.extend(self._detach_applicant(applicant, 0))
+            applicant._reset_matching_attributes()
+            self._prep_applicant_for_rematching(applicant)
+            pending[applicant.id] = applicant
+
+        while len(dirty_queues) > 0:
+            program, assignment_type = dirty_queues.pop()
+            queue = program.get_assignment_type_queue(
+                assignment_type=assignment_type)
+            # Less capacity: reject the worst applicants
+            while len(queue.vassigned_applicants) > queue.capacity:
+                rejected_score = max(queue.vassigned_scores)
+                rejected = queue.get_cut_off_applicant(rejected_score)
+                queue.remove_applicant_from_program(rejected)
+                program.add_applicant_to_waitlist(rejected,
+                                                  rejected_score//1)
+                rejected.option_n += 1
+                rejected.assigned_vacancy = None
+                if (rejected.option_n < len(rejected.vpostulation)) or \
+                        (self.distance_tails is not None and
+                         self.distance_tails.extend(rejected)):
+                    rejected.match = False
+                    pending[rejected.id] = rejected
+                else:
+                    rejected.match = True
+
+            # Free seats: the rejected applicants propose again
+            if len(queue.vassigned_applicants) >= queue.capacity:
+                continue
+            candidates = [self.applicants[applicant_id]
+                          for applicant_id in program.waitlist_dict
+                          if self.applicants[applicant_id]
+                          .special_assignment == assignment_type]
+            for candidate in candidates:
+                option_n = next(i for i, pointer in enumerate(zip(
+                    candidate.vpostulation, candidate.vquota_id))
+                    if pointer == (program.program_id, program.quota_id))
+                dirty_queues.extend(self._detach_applicant(candidate,
+                                                           option_n))
+                candidate.option_n = option_n
+                candidate.match = False
+                pending[candidate.id] = candidate
+        return pending
+
+    def _detach_applicant(
+            self,
+            applicant: Applicant,
+            option_n: int) -> List[Tuple[Program, int]]:
+        '''
+        Removes applicant from his/her queue and from the waitlists of the
+        programs that rejected him/her from option_n on.
+
+        Args:
+            applicant (Applicant)
+            option_n (int): First option to detach
+
+        Returns:
+            List[Tuple[Program, int]]: Program and assignment type of the
+                queue that got a free seat, if any
+        '''
+        freed = []
+        if applicant.assigned_vacancy is not None:
+            program = applicant.assigned_vacancy
+            program.get_assignment_type_queue(
+                assignment_type=applicant.special_assignment) \
+                .remove_applicant_from_program(applicant)
+            freed.append((program, applicant.special_assignment))
+            applicant.assigned_vacancy = None
+        last_option = min(applicant.option_n, len(applicant.vpostulation))
+        for program_id, quota_id in zip(
+                applicant.vpostulation[option_n:last_option],
+                applicant.vquota_id[option_n:last_option]):
+            self.programs[(program_id, quota_id)].waitlist_dict.pop(
+                applicant.id, None)
+        return freed
+
+    def _prep_applicant_for_rematching(
+            self,
+            applicant: Applicant) -> None:
+        '''
+        Same preparation as _prep_applicants_for_matching, for one applicant
+        of the current round.
+
+        Args:
+            applicant (Applicant)
+        '''
+        if (applicant.grade != self.first_round) and \
+                (self._linked_postulation_activation):
+            self._apply_linked_reorder(applicant)
+        self._check_quota_postulation_order(applicant)
+        if (self._secured_enrollment_activation) and \
+                (applicant.se_program_id is not None):
+            self._complete_distance_tail(applicant)
+            applicant.set_secured_place_as_last_postulation()
+
+    def _get_linked_by(self) -> Dict[Tuple[int, int], Dict[int, List[int]]]:
+        '''
+        For each round, the applicants of the round that are linked to
+        applicants of later rounds, with the ids of those applicants.
+
+        Returns:
+            Dict[Tuple[int, int], Dict[int, List[int]]]: {round: {applicant_id:
+            [linked applicant_id]}}
+        '''
+        linked_by = {matching_round: {} for matching_round in self.rounds}
+        if not self._linked_postulation_activation:
+            return linked_by
+        for applicant in self.applicants.values():
+            if applicant.grade == self.first_round:
+                continue
+            for linked_id in applicant.vlinks:
+                linked = self.applicants[linked_id]
+                matching_round = (linked.grade, linked.special_assignment)
+                if self._round_index[matching_round] < self._round_index[
+                        (applicant.grade, applicant.special_assignment)]:
+                    linked_by[matching_round].setdefault(
+                        linked_id, []).append(applicant.id)
+        return linked_by
+
+    def _update_applications(
+            self,
+            applications: pd.DataFrame) -> List[Applicant]:
+        '''
+        Builds new Applicant objects for the applicants in applications.
+
+        Args:
+            applications (pd.DataFrame): All the applications of the changed
+                applicants
+
+        Returns:
+            List[Applicant]: Old objects of the changed applicants
+        '''
+        changed = self.applicants_df.applicant_id.isin(
+            applications.applicant_id.unique())
+        applicants = self.applicants_df[changed].drop(columns=[col for col in
+            ['vpostulation', 'vpostulation_scores', 'vpriorities',
+             'vinstitution_id', 'vquota_id', 'vpriority_profile', 'vdistance']
+            if col in self.applicants_df.columns])
+        applicants = self._add_postulation_data(applicants=applicants,
+                                                applications=applications)
+        if not 'vdistance' in applicants.columns:
+            applicants['vdistance'] = ""
+
+        old_applicants = []
+        for applicant in self._get_applicants_dict(applicants).values():
+            old_applicants.append(self.applicants[applicant.id])
+            self.applicants[applicant.id] = applicant
+            matching_round = (applicant.grade, applicant.special_assignment)
+            self._round_applicants[matching_round][applicant.id] = applicant
+            if applicant.se_program_id is not None:
+                self._round_se_applicants[matching_round][applicant.id] = \
+                    applicant
+        self.applicants_df = pd.concat([self.applicants_df[~changed],
+                                        applicants[self.applicants_df.columns]]) \
+            .loc[self.applicants_df.index]
+        return old_applicants
+
+    def _update_capacities(
+            self,
+            vacancies: pd.DataFrame) -> List[Tuple[Program, int]]:
+        '''
+        Sets the new capacities of the programs in vacancies.
+
+        Args:
+            vacancies (pd.DataFrame): Rows of vacancies of the changed
+                programs
+
+        Returns:
+            List[Tuple[Program, int]]: Program and assignment type of each
+                updated queue
+        '''
+        updated = []
+        for row in vacancies.to_dict('records'):
+            program = self.programs[(row['program_id'], row['quota_id'])]
+            capacities = {0: row['regular_vacancies']}
+            capacities.update({int(col.split('_')[1]): row[col]
+                               for col in self.special_assignment_cols})
+            for assignment_type, capacity in capacities.items():
+                program.get_assignment_type_queue(
+                    assignment_type=assignment_type) \
+                    .modify_original_capacity(capacity)
+                updated.append((program, assignment_type))
+            program_rows = (self.programs_df.program_id == row['program_id']) \
+                & (self.programs_df.quota_id == row['quota_id'])
+            self.programs_df.loc[program_rows, 'regular_vacancies'] = \
+                row['regular_vacancies']
+            for col in self.special_assignment_cols:
+                self.programs_df.loc[program_rows, col] = row[col]
+        return updated
@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+
+
+##Changing this value invalidates all the cached prepared data (e.g. when the preparation logic changes)
+CACHE_VERSION = 3
+
+RAW_FILES = ["vacancies.csv", "demand.csv", "postulants.csv", "postulations.csv"]
+
+
+def prepared_data_key(dir, type, **options):
+    '''
+    Hash of the content of the raw files in dir, the preparation type and the preparation options. Any change in one of
+    the raw files gives a different key, so the cached data is invalidated automatically.
+    '''
+    key = hashlib.sha256()
+    key.update(json.dumps({"version": CACHE_VERSION, "type": type, "options": options}, sort_keys=True, default=str).encode())
+    for file_name in RAW_FILES:
+        key.update(file_name.encode())
+        with open(dir+file_name, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                key.update(block)
+    return key.hexdigest()
+
+
+def _string_array(values, null):
+    '''
+    Non null values as a fixed width unicode array, so they are saved without pickles.
+    '''
+    values = np.asarray(values, dtype=object)[~null]
+    if not all(isinstance(value, str) for value in values):
+        raise ValueError("has values that are not strings.")
+    return values.astype(str) if len(values) > 0 else np.array([], dtype=str)
+
+
+def _is_string_dtype(dtype):
+    return dtype == object or isinstance(dtype, pd.StringDtype)
+
+
+def frames_to_npz(path, frames):
+    '''
+    Saves a dict of DataFrames in a single uncompressed npz file, one array per column, with a manifest of the column
+    names and dtypes. Object and string columns must hold strings (and nulls), and are saved as unicode arrays with a
+    null mask, like the string categories of categorical columns. Nullable (masked) columns are saved as their numpy
+    values and a null mask. Other extension dtypes are rejected, so no array is ever pickled. The file is written to a
+    temporary path and then moved, so a cache file is never left half written.
+    '''
+    arrays = {}
+    manifest = {}
+    for name, df in frames.items():
+        columns = []
+        for i, column in enumerate(df.columns):
+            key = f"{name}/{i}"
+            values = df[column]
+            try:
+                if isinstance(values.dtype, pd.CategoricalDtype):
+                    kind = "category"
+                    categories = values.cat.categories
+                    arrays[key] = values.cat.codes.values
+                    if _is_string_dtype(categories.dtype):
+                        arrays[key+"/categories"] = _string_array(categories, np.zeros(len(categories), dtype=bool))
+                    elif isinstance(categories.dtype, np.dtype):
+                        arrays[key+"/categories"] = categories.values
+                    else:
+                        raise ValueError(f"has categories of dtype {categories.dtype}.")
+                elif _is_string_dtype(values.dtype):
+                    kind = "string"
+                    null = values.isna().values
+                    arrays[key] = _string_array(values, null)
+                    arrays[key+"/null"] = null
+                elif isinstance(values.dtype, pd.api.extensions.ExtensionDtype):
+                    if not hasattr(values.dtype, "numpy_dtype"):
+                        raise ValueError(f"has the unsupported dtype {values.dtype}.")
+                    kind = "masked"
+                    null = values.isna().values
+                    arrays[key] = values.to_numpy(dtype=values.dtype.numpy_dtype, na_value=0)
+                    arrays[key+"/null"] = null
+                else:
+                    kind = "native"
+                    arrays[key] = values.values
+            except ValueError as e:
+                raise ValueError(f"Column {column} of {name} {e}")
+            if any(arrays[array_key].dtype.hasobject for array_key in (key, key+"/categories", key+"/null") if array_key in arrays):
+                raise ValueError(f"Column {column} of {name} can not be saved without pickles.")
+            columns.append({"name": column, "kind": kind, "dtype": str(values.dtype)})
+        manifest[name] = {"columns": columns, "length": len(df)}
+    arrays["__manifest__"] = np.array(json.dumps(manifest, default=str))
+
+    temporary_path = path+".tmp"
+    with open(temporary_path, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(temporary_path, path)
+
+
+def frames_from_npz(path):
+    '''
+    Loads the dict of DataFrames saved by frames_to_npz, with the same column names and dtypes.
+    '''
+    frames = {}
+    with np.load(path, allow_pickle=False) as arrays:
+        manifest = json.loads(str(arrays["__manifest__"]))
+        for name, frame_manifest in manifest.items():
+            data = {}
+            for i, column in enumerate(frame_manifest["columns"]):
+                key = f"{name}/{i}"
+                if column["kind"] == "category":
+                    categories = arrays[key+"/categories"]
+                    if categories.dtype.kind == "U":
+                        categories = categories.astype(object)
+                    data[column["name"]] = pd.Categorical.from_codes(arrays[key], categories=categories)
+                elif column["kind"] == "string":
+                    null = arrays[key+"/null"]
+                    values = np.full(len(null), np.nan, dtype=object)
+                    values[~null] = arrays[key].astype(object)
+                    data[column["name"]] = pd.Series(values, dtype=column["dtype"], copy=False)
+                elif column["kind"] == "masked":
+                    data[column["name"]] = pd.Series(arrays[key]).astype(column["dtype"]).mask(arrays[key+"/null"]).array
+                else:
+                    data[column["name"]] = arrays[key]
+            frames[name] = pd.DataFrame(data, index=pd.RangeIndex(frame_manifest["length"]), columns=[column["name"] for column in frame_manifest["columns"]])
+    return frames
@@ -6,19 +6,25 @@ Company: Consilium Bots Inc.
 Modified By: Benjamín Madariaga at b.madariaga.e@gmail.com
 '''
 
-from cb_da.entities.applicants_queue import Applicant_Queue
+from cb_da.entities.applicants_queue import Applicant_Queue, queue_types
 from cb_da.entities.applicants import Applicant
 
 
 
 class Program:
+    __slots__ = ('__queue_class', '__program_id', '__institution_id',
+                 '__grade_id', '__quota_id', 'special_assignment_types',
+                 'queues', 'tranfer_capacity', 'receive_capacity',
+                 'over_capacity', 'waitlist_dict')
+
     def __init__(self,
                  program_id: int,
                  institution_id: int,
                  grade_id: int,
                  quota_id: int,
                  regular_capacity: int,
-                 special_vacancies = []):
+                 special_vacancies = [],
+                 queue_type: str = 'list'):
         '''
         Init a Program instance. A program is defined by its program and
         quota id.
@@ -32,13 +38,21 @@ class Program:
             special_vacancies (pd.Series): Series with row names
             "special_i_vacancies" for i =0,...,n. Each row value must
             be an int representing a capacity.
+            queue_type (str): 'list' for Applicant_Queue or 'heap' for
+            Heap_Applicant_Queue. Both give the same results.
         '''
+        if queue_type not in queue_types:
+            raise ValueError(f'Queue type "{queue_type}" is not supported.\
+             Please enter "list" or "heap".')
+        self.__queue_class = queue_types[queue_type]
         self.__program_id = program_id
         self.__institution_id = institution_id
         self.__grade_id = grade_id
         self.__quota_id = quota_id
         self.special_assignment_types = []
-        self.regular_assignment = Applicant_Queue(regular_capacity)
+        # Queues indexed by assignment type: regular queue in 0 and special
+        # queue i in i
+        self.queues = [self.__queue_class(regular_capacity)]
 
         if len(special_vacancies)>0:
             self._unpack_special_vacancies(special_vacancies)
@@ -61,6 +75,10 @@ class Program:
     def quota_id(self) -> int:
         return self.__quota_id
 
+    @property
+    def regular_assignment(self):
+        return self.queues[0]
+
     def get_applicant_score_in_program(
             self,
             applicant: Applicant) -> float:
@@ -74,20 +92,9 @@ class Program:
         Returns:
             float: score associated to the program
         '''
-        # pointer = (self.program_id,self.quota_id)
-
-        # Score of the applicant at program + quota_id
-        # (could be selection score or lotery number)
-        # applicant_postulation_score = applicant.vpostulation_scores[pointer]
-        # applicant_postulation_score = applicant.get_vpostulation_scores(pointer)
-        applicant_postulation_score = applicant.vpostulation_scores[self.program_id][self.quota_id]
-
-        # Priority of the applicant at program + quota_id
-        # applicant_priority = applicant.vpriorities[pointer]
-        applicant_priority = applicant.vpriorities[self.program_id][self.quota_id]
-
-        return applicant_postulation_score + applicant_priority
-        # return applicant.vpostulation_scores[pointer]+applicant.vpriorities[pointer]
+        # Score of the applicant at program + quota_id (could be selection
+        # score or lotery number) plus his/her priority
+        return applicant.get_score(self.program_id, self.quota_id)
 
     def get_assignment_type_queue(
             self,
@@ -101,11 +108,7 @@ class Program:
         Returns:
             attr (Applicants_Queue): Applicants_Queue instance
         '''
-        if assignment_type==0:
-            # return getattr(self, 'regular_assignment')
-            return self.regular_assignment
-        else:
-            return getattr(self, f'special_{assignment_type}_assignment')
+        return self.queues[assignment_type]
 
     def get_capacity_to_transfer(self,
             from_assignment_type: int):
@@ -142,8 +145,8 @@ class Program:
             capacity_to_transfer (int): Capacity to be transfered.
         '''
         self.receive_capacity = True
-        self.regular_assignment.receive_capacity = True
-        self.regular_assignment.modify_capacity(capacity_to_transfer)
+        self.queues[0].receive_capacity = True
+        self.queues[0].modify_capacity(capacity_to_transfer)
 
     def _force_secured_enrollment_match(
             self,
@@ -182,28 +185,30 @@ class Program:
         self.tranfer_capacity = False
         self.receive_capacity = False
         self.over_capacity = False
-        self.regular_assignment.reset_assignment()
         self.waitlist_dict = {}
-        for i in self.special_assignment_types:
-            getattr(self, f'special_{i}_assignment').reset_assignment()
+        for queue in self.queues:
+            if queue is not None:
+                queue.reset_assignment()
 
 
     def _unpack_special_vacancies(
             self,
             special_vacancies) -> None:
         '''
-        Description: Set all special_vacancies as queue atributes.
+        Description: Set a queue for each special_vacancies in self.queues,
+        in the position of its assignment type.
 
         Args:
             special_vacancies (pd.Series): Series with row names
             "special_i_vacancies" for i =0,...,n. Each row value must
             be an int representing a capacity.
         '''
-        self.special_assignment_types = [keys.split('_')[1]
+        self.special_assignment_types = [int(keys.split('_')[1])
             for keys in special_vacancies.keys()]
+        self.queues += [None]*(max(self.special_assignment_types)+1-len(self.queues))
         for key,i in zip(special_vacancies.keys(),
                                     self.special_assignment_types):
-            setattr(self, f'special_{i}_assignment', Applicant_Queue(special_vacancies[key]))
+            self.queues[i] = self.__queue_class(special_vacancies[key])
 
     def add_applicant_to_waitlist(
         self,
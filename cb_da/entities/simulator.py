@@ -0,0 +1,264 @@
+'''
+File: simulator.py
+Created Date: Saturday October 17th 2026
+Author: Benjamín Madariaga
+Company: Consilium Bots Inc.
+'''
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from cb_da.entities.policymaker import PolicyMaker
+from cb_lottery_maker.entities.lottery import Lottery
+
+
+class AssignmentSimulator:
+    '''
+    Runs the matching many times with different lottery seeds. The lotteries
+    and the PolicyMaker are built once, and each replication only draws new
+    lottery numbers, loads them into the applicants and matches again.
+    '''
+    def __init__(
+            self,
+            vacancies: pd.DataFrame,
+            applicants: pd.DataFrame,
+            applications: pd.DataFrame,
+            priority_profiles: pd.DataFrame,
+            quota_order: pd.DataFrame,
+            siblings: pd.DataFrame,
+            links: pd.DataFrame,
+            config: Dict[str, Any],
+            lotteries: List[Dict[str, Any]]
+            ) -> None:
+        '''
+        Args:
+            vacancies, applicants, applications, priority_profiles,
+            quota_order, siblings, links: Same DataFrames as PolicyMaker.
+                applications does not need lottery numbers.
+            config (Dict): Dict with the set of rules for the match, as in
+                PolicyMaker.
+            lotteries (List[Dict]): Config of each lottery, as in Lottery
+                (without seed). The optional key 'rows' is a boolean mask
+                over applications with the rows of that lottery, all rows if
+                missing. All lotteries use the seed of the replication.
+        '''
+        applications = applications.reset_index(drop=True)
+        self.lotteries = []
+        outputs = []
+        for lottery_config in lotteries:
+            lottery_config = dict(lottery_config)
+            rows = lottery_config.pop('rows', None)
+            rows = np.ones(len(applications), dtype=bool) if rows is None \
+                else np.asarray(rows, dtype=bool)
+            lottery_config.setdefault('tie_break_level', '')
+            lottery_config.setdefault('sibling_lottery', False)
+            lottery_config.setdefault('engine', 'array')
+            lottery_config['seed'] = 0
+            lottery = Lottery(applicants=applicants,
+                              applications=applications[rows],
+                              siblings=siblings,
+                              config=lottery_config)
+            lottery.run()
+            self.lotteries.append(lottery)
+            outputs.append(lottery.get_output())
+        applications = pd.concat(outputs)
+
+        self.policy_maker = PolicyMaker(vacancies=vacancies.copy(),
+                                        applicants=applicants.copy(),
+                                        applications=applications,
+                                        priority_profiles=priority_profiles,
+                                        quota_order=quota_order,
+                                        siblings=siblings,
+                                        links=links,
+                                        config=config)
+
+        # Applicant, program and quota of each lottery number
+        applicants_dict = self.policy_maker.applicants
+        self._score_targets = [
+            (applicants_dict.get(applicant_id), program_id, quota_id)
+            for applicant_id, program_id, quota_id in
+            applications[['applicant_id', 'program_id', 'quota_id']]
+            .itertuples(index=False)]
+
+        # Assignment counts are kept per (applicant, program) pair of the
+        # applications, plus a count of replications without assignment
+        self.pairs = applications[['applicant_id', 'program_id']] \
+            .drop_duplicates().reset_index(drop=True)
+        self._pair_index = {pair: i for i, pair in enumerate(
+            self.pairs.itertuples(index=False, name=None))}
+        self.applicant_ids = list(applicants_dict.keys())
+
+        # Cutoffs are kept per program and assignment type
+        self.queues = pd.DataFrame(
+            [(program_id, quota_id, assignment_type)
+             for (program_id, quota_id) in self.policy_maker.programs.keys()
+             for assignment_type in self.policy_maker.assignment_types],
+            columns=['program_id', 'quota_id', 'assignment_type'])
+        self._queues = [self.policy_maker.programs[(program_id, quota_id)]
+                        .get_assignment_type_queue(
+                            assignment_type=assignment_type)
+                        for program_id, quota_id, assignment_type in
+                        self.queues.itertuples(index=False)]
+
+    def run(self,
+            seeds: List[int]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        '''
+        Runs one replication per seed.
+
+        Args:
+            seeds (List[int]): Lottery seeds
+
+        Returns:
+            counts (np.ndarray): Replications where each pair was assigned
+            unassigned (np.ndarray): Replications where each applicant was
+                not assigned
+            cutoffs (np.ndarray): Cutoff score of each queue (columns) in
+                each replication (rows)
+        '''
+        counts = np.zeros(len(self.pairs), dtype=np.int64)
+        unassigned = np.zeros(len(self.applicant_ids), dtype=np.int64)
+        cutoffs = np.zeros((len(seeds), len(self._queues)))
+        for i, seed in enumerate(seeds):
+            self._load_lottery(seed)
+            self.policy_maker.reset_matching()
+            self.policy_maker.match_applicants_and_programs()
+
+            assigned = np.fromiter(
+                (-1 if applicant.assigned_vacancy is None else
+                 self._pair_index[(applicant_id,
+                                   applicant.assigned_vacancy.program_id)]
+                 for applicant_id, applicant in
+                 self.policy_maker.applicants.items()),
+                dtype=np.int64, count=len(self.applicant_ids))
+            counts += np.bincount(assigned[assigned >= 0],
+                                  minlength=len(counts))
+            unassigned += assigned < 0
+            cutoffs[i] = [queue.get_cut_off_score() for queue in self._queues]
+        return counts, unassigned, cutoffs
+
+    def _load_lottery(self,
+            seed: int) -> None:
+        '''
+        Draws the lotteries with seed and loads the numbers into the
+        applicants.
+
+        Args:
+            seed (int): Lottery seed
+        '''
+        numbers = []
+        for lottery in self.lotteries:
+            lottery.rerun(seed)
+            numbers.append(lottery.get_lottery_numbers())
+        for (applicant, program_id, quota_id), lottery_number in \
+                zip(self._score_targets, np.concatenate(numbers).tolist()):
+            if applicant is not None:
+                applicant.modify_original_vpostulation_scores(
+                    program_id, quota_id, lottery_number)
+
+
+class SimulationResults:
+    '''
+    Assignment counts and cutoff scores of a set of replications.
+    '''
+    def __init__(self,
+            simulator: AssignmentSimulator,
+            seeds: List[int],
+            counts: np.ndarray,
+            unassigned: np.ndarray,
+            cutoffs: np.ndarray) -> None:
+        self.seeds = list(seeds)
+        self.pairs = simulator.pairs
+        self.applicant_ids = simulator.applicant_ids
+        self.queues = simulator.queues
+        self.counts = counts
+        self.unassigned = unassigned
+        self.cutoffs = cutoffs
+
+    def get_assignment_probabilities(self) -> pd.DataFrame:
+        '''
+        Share of replications where each applicant was assigned to each
+        program of his/her applications. Rows with program_id None hold the
+        share of replications without assignment.
+
+        Returns:
+            pd.DataFrame: applicant_id, program_id and probability
+        '''
+        assigned = self.pairs.assign(
+            probability=self.counts/len(self.seeds))
+        unassigned = pd.DataFrame({
+            'applicant_id': self.applicant_ids,
+            'program_id': None,
+            'probability': self.unassigned/len(self.seeds)})
+        return pd.concat([assigned, unassigned], ignore_index=True) \
+            .sort_values('applicant_id', kind='stable') \
+            .reset_index(drop=True)
+
+    def get_cutoffs(self) -> pd.DataFrame:
+        '''
+        Cutoff score of each program and assignment type in each replication,
+        as returned by the queues: 0 if there were vacancies left and inf if
+        there was no capacity.
+
+        Returns:
+            pd.DataFrame: seed, program_id, quota_id, assignment_type and
+                cutoff_score
+        '''
+        cutoffs = self.queues.loc[np.tile(np.arange(len(self.queues)),
+                                          len(self.seeds))]
+        cutoffs.insert(0, 'seed', np.repeat(self.seeds, len(self.queues)))
+        cutoffs['cutoff_score'] = self.cutoffs.reshape(-1)
+        return cutoffs.reset_index(drop=True)
+
+
+_worker_simulator = None
+
+
+def _init_worker(simulator_kwargs: Dict[str, Any]) -> None:
+    '''
+    Builds the simulator of a worker process once.
+    '''
+    global _worker_simulator
+    _worker_simulator = AssignmentSimulator(**simulator_kwargs)
+
+
+def _run_worker(seeds: List[int]):
+    '''
+    Runs a chunk of seeds in the simulator of the worker process.
+    '''
+    return _worker_simulator.run(seeds)
+
+
+def simulate_assignment(
+        seeds: List[int],
+        workers: int = 1,
+        **simulator_kwargs) -> SimulationResults:
+    '''
+    Runs one replication of the matching per seed. With workers > 1 the seeds
+    are split in chunks and run in a pool of processes, each one building its
+    own simulator once.
+
+    Args:
+        seeds (List[int]): Lottery seeds
+        workers (int): Number of processes
+        simulator_kwargs: Arguments of AssignmentSimulator
+
+    Returns:
+        SimulationResults
+    '''
+    seeds = [int(seed) for seed in seeds]
+    simulator = AssignmentSimulator(**simulator_kwargs)
+    if workers <= 1:
+        return SimulationResults(simulator, seeds, *simulator.run(seeds))
+
+    chunks = [list(chunk) for chunk in
+              np.array_split(seeds, min(len(seeds), 4*workers)) if len(chunk)]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(simulator_kwargs,)) as executor:
+        chunk_results = list(executor.map(_run_worker, chunks))
+    counts = sum(result[0] for result in chunk_results)
+    unassigned = sum(result[1] for result in chunk_results)
+    cutoffs = np.vstack([result[2] for result in chunk_results])
+    return SimulationResults(simulator, seeds, counts, unassigned, cutoffs)
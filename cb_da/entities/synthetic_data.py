@@ -0,0 +1,278 @@
+'''
+File: synthetic_data.py
+Created Date: Saturday October 17th 2026
+Author: Benjamín Madariaga
+Company: Consilium Bots Inc.
+'''
+
+import os
+from typing import Dict, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+##Center of Tacna, used as the default center of the homes and the schools
+TACNA_CENTER = (-18.0146, -70.2536)
+KM_PER_DEGREE_LATITUDE = 110.574
+KM_PER_DEGREE_LONGITUDE = 111.320
+
+SEND_DATE = "03/01/2022 10:00:00"
+
+
+def generate_synthetic_data(
+        dir: str = None,
+        n_applicants: int = 10000,
+        schools_per_grade: int = 50,
+        grades: Dict[int, int] = None,
+        nee_share: float = 0.05,
+        family_sizes: Sequence[float] = (0.75, 0.2, 0.05),
+        linked_share: float = 0.5,
+        spread_km: float = 4.0,
+        list_length: Tuple[int, int] = (1, 5),
+        distance_decay_km: float = 3.0,
+        seats_per_applicant: float = 1.1,
+        max_nee_vacancies: int = 2,
+        distance_priority_column: bool = True,
+        seed: int = 0) -> Dict[str, pd.DataFrame]:
+    '''
+    Generates raw files with the schema of the Tacna files read by
+    data_preparation (vacancies.csv, demand.csv, postulants.csv and
+    postulations.csv), to measure performance without real student data.
+
+    Homes and schools are drawn around the center of Tacna. Each applicant
+    applies to the schools of his/her grade, preferring popular and near
+    schools, and siblings share guardian and home.
+
+    Args:
+        dir (str): Folder where the csv files are written. If None, the
+            files are not written.
+        n_applicants (int): Number of applicants
+        schools_per_grade (int): Programs (schools) offering each grade
+        grades (Dict[int, int]): levelId of each gradeId. Applicants are
+            spread uniformly over the grades. Schools offer the grades of
+            one level.
+        nee_share (float): Share of applicants with NEE priority
+        family_sizes (Sequence[float]): Share of guardians with 1, 2, ...
+            applicants
+        linked_share (float): Share of applicants with typeId "G", so that
+            their siblings are linked to them
+        spread_km (float): Standard deviation in km of the homes and
+            schools around the center
+        list_length (Tuple[int, int]): Minimum and maximum number of
+            schools in the preference list of each applicant
+        distance_decay_km (float): Distance in km at which the preference
+            for a school falls by a factor e
+        seats_per_applicant (float): Regular vacancies of each grade per
+            applicant of the grade
+        max_nee_vacancies (int): Maximum NEE vacancies of a program
+        distance_priority_column (bool): Add the distancePriority column to
+            demand (all False), needed by the precalculated_distance mode
+        seed (int): Seed of the random generator
+
+    Returns:
+        Dict[str, pd.DataFrame]: vacancies, demand, postulants and
+            postulations
+    '''
+    if grades is None:
+        grades = {1: 1, 2: 1, 3: 1, 4: 2, 5: 2, 6: 2}
+    if schools_per_grade < 1:
+        raise ValueError('schools_per_grade must be at least 1.')
+    if not 1 <= list_length[0] <= list_length[1]:
+        raise ValueError(f'Invalid list_length {list_length}.')
+    rng = np.random.default_rng(seed)
+    center_latitude, center_longitude = TACNA_CENTER
+    longitude_km = KM_PER_DEGREE_LONGITUDE*np.cos(np.radians(center_latitude))
+
+    def draw_coordinates(n):
+        return (center_latitude + rng.normal(0, spread_km, n)/KM_PER_DEGREE_LATITUDE,
+                center_longitude + rng.normal(0, spread_km, n)/longitude_km)
+
+    ##Schools: each level has its own schools, and each grade of the level is offered by schools_per_grade of them
+    grade_ids = np.array(list(grades.keys()))
+    levels = sorted(set(grades.values()))
+    vacancies = []
+    next_local_id = 1
+    for level in levels:
+        level_grades = [grade for grade in grade_ids if grades[grade] == level]
+        n_schools = int(np.ceil(schools_per_grade*1.25))
+        local_ids = np.arange(next_local_id, next_local_id + n_schools)
+        next_local_id += n_schools
+        latitude, longitude = draw_coordinates(n_schools)
+        popularity = rng.lognormal(0, 1, n_schools)
+        for grade in level_grades:
+            offered = np.sort(rng.choice(n_schools, size=schools_per_grade, replace=False))
+            vacancies.append(pd.DataFrame({
+                "localId": local_ids[offered],
+                "serviceId": local_ids[offered]*100 + grade,
+                "annex": 0,
+                "areaId": 1,
+                "studentBodyId": 1,
+                "levelId": level,
+                "gradeId": grade,
+                "shiftId": 1,
+                "studentModalityId": 1,
+                "classroomTypeId": 1,
+                "totalVacancyNna": 0,
+                "totalVacancyNnaNee": rng.integers(0, max_nee_vacancies + 1, schools_per_grade),
+                "roundNumber": 1,
+                "roundType": "R",
+                "sendDate": SEND_DATE,
+                "latitude": latitude[offered],
+                "longitude": longitude[offered],
+                "popularity": popularity[offered]}))
+    vacancies = pd.concat(vacancies, ignore_index=True)
+
+    ##Families: applicants of the same guardian share the home
+    family_sizes = np.asarray(family_sizes, dtype=float)
+    sizes = rng.choice(np.arange(1, len(family_sizes) + 1), size=n_applicants, p=family_sizes/family_sizes.sum())
+    guardian = np.repeat(np.arange(1, n_applicants + 1), sizes)[:n_applicants]
+    home_latitude, home_longitude = draw_coordinates(guardian[-1])
+    postulant_ids = np.arange(1, n_applicants + 1)
+    grade = rng.choice(grade_ids, size=n_applicants)
+    priority = rng.random(n_applicants) < nee_share
+
+    postulants = pd.DataFrame({
+        "postulantId": postulant_ids,
+        "guardianId": guardian,
+        "priority": priority,
+        "latitude": home_latitude[guardian - 1],
+        "longitude": home_longitude[guardian - 1],
+        "roundNumber": 1,
+        "roundTypeId": "R",
+        "sendDate": SEND_DATE})
+    postulations = pd.DataFrame({
+        "postulantId": postulant_ids,
+        "guardianId": guardian,
+        "typeId": np.where(rng.random(n_applicants) < linked_share, "G", "I"),
+        "roundNumber": 1,
+        "roundTypeId": "R",
+        "sendDate": SEND_DATE})
+
+    ##Preferences: the schools of the grade are ranked by log(popularity) - distance/distance_decay_km plus Gumbel noise
+    ##(sampling without replacement proportional to exp of the utility), and each applicant keeps the first ones
+    lengths = rng.integers(list_length[0], list_length[1] + 1, n_applicants)
+    demand = []
+    regular_vacancies = np.zeros(len(vacancies), dtype=np.int64)
+    for grade_id in grade_ids:
+        programs = np.flatnonzero(vacancies["gradeId"].values == grade_id)
+        applicants = np.flatnonzero(grade == grade_id)
+        program_latitude = vacancies["latitude"].values[programs]
+        program_longitude = vacancies["longitude"].values[programs]
+        log_popularity = np.log(vacancies["popularity"].values[programs])
+
+        ##Regular vacancies of the grade, split by popularity
+        seats = int(round(seats_per_applicant*len(applicants)))
+        regular_vacancies[programs] = rng.multinomial(seats, rng.dirichlet(np.exp(log_popularity)))
+
+        for start in range(0, len(applicants), 4096):
+            chunk = applicants[start:start+4096]
+            distance = np.hypot(
+                (postulants["latitude"].values[chunk, None] - program_latitude)*KM_PER_DEGREE_LATITUDE,
+                (postulants["longitude"].values[chunk, None] - program_longitude)*longitude_km)
+            utility = log_popularity - distance/distance_decay_km + rng.gumbel(size=distance.shape)
+            ranked = np.argsort(-utility, axis=1)[:, :list_length[1]]
+            chunk_lengths = np.minimum(lengths[chunk], len(programs))
+            rows, order = np.nonzero(np.arange(ranked.shape[1]) < chunk_lengths[:, None])
+            chosen = programs[ranked[rows, order]]
+            demand.append(pd.DataFrame({
+                "postulantId": postulant_ids[chunk[rows]],
+                "levelId": vacancies["levelId"].values[chosen],
+                "gradeId": grade_id,
+                "order": order + 1,
+                "serviceId": vacancies["serviceId"].values[chosen],
+                "annex": 0,
+                "localId": vacancies["localId"].values[chosen],
+                "latitude": vacancies["latitude"].values[chosen],
+                "longitude": vacancies["longitude"].values[chosen],
+                "priority": priority[chunk[rows]],
+                "roundNumber": 1,
+                "roundTypeId": "R",
+                "sendDate": SEND_DATE}))
+    demand = pd.concat(demand, ignore_index=True).sort_values(by=["postulantId", "order"]).reset_index(drop=True)
+    if distance_priority_column:
+        demand["distancePriority"] = False
+    vacancies["totalVacancyNna"] = regular_vacancies
+    vacancies = vacancies.drop(columns=["popularity"])
+
+    data = {"vacancies": vacancies, "demand": demand, "postulants": postulants, "postulations": postulations}
+    if dir is not None:
+        if not os.path.isdir(dir):
+            os.makedirs(dir)
+        for name, df in data.items():
+            df.to_csv(os.path.join(dir, name+".csv"), index=False)
+    return data
+
+
+def generate_synthetic_road_network(
+        dir: str = None,
+        center: Tuple[float, float] = TACNA_CENTER,
+        extent_km: float = 12.0,
+        spacing_km: float = 0.25,
+        jitter_km: float = 0.05,
+        closed_share: float = 0.1,
+        oneway_share: float = 0.05,
+        detour: Tuple[float, float] = (1.0, 1.3),
+        seed: int = 0) -> Dict[str, pd.DataFrame]:
+    '''
+    Generates a road network around Tacna with the files read by
+    RoadNetworkBackend.from_csv (nodes.csv and edges.csv), to benchmark
+    the road network distance without a real map.
+
+    Nodes are a jittered square grid. Each node is joined to its east and
+    north neighbours, some streets are closed or oneway, and each edge is
+    longer than the straight line between its nodes by a random detour.
+
+    Args:
+        dir (str): Folder where the csv files are written. If None, the
+            files are not written.
+        center (Tuple[float, float]): Latitude and longitude of the center
+        extent_km (float): Distance in km from the center to the border of
+            the grid
+        spacing_km (float): Distance in km between neighbour nodes
+        jitter_km (float): Standard deviation in km of the nodes around
+            their grid position
+        closed_share (float): Share of the edges that are removed
+        oneway_share (float): Share of the edges that are oneway
+        detour (Tuple[float, float]): Minimum and maximum ratio between
+            the length of an edge and the straight line
+        seed (int): Seed of the random generator
+
+    Returns:
+        Dict[str, pd.DataFrame]: nodes and edges
+    '''
+    rng = np.random.default_rng(seed)
+    center_latitude, center_longitude = center
+    longitude_km = KM_PER_DEGREE_LONGITUDE*np.cos(np.radians(center_latitude))
+    steps = int(np.ceil(extent_km/spacing_km))
+    side = 2*steps + 1
+
+    ##Grid positions in km from the center, with jitter
+    column, row = np.meshgrid(np.arange(-steps, steps + 1), np.arange(-steps, steps + 1))
+    x = column.ravel()*spacing_km + rng.normal(0, jitter_km, side*side)
+    y = row.ravel()*spacing_km + rng.normal(0, jitter_km, side*side)
+    nodes = pd.DataFrame({
+        "nodeId": np.arange(1, side*side + 1),
+        "latitude": center_latitude + y/KM_PER_DEGREE_LATITUDE,
+        "longitude": center_longitude + x/longitude_km})
+
+    ##East and north neighbours of each node
+    position = np.arange(side*side).reshape(side, side)
+    source = np.concatenate([position[:, :-1].ravel(), position[:-1, :].ravel()])
+    target = np.concatenate([position[:, 1:].ravel(), position[1:, :].ravel()])
+    kept = rng.random(len(source)) >= closed_share
+    source, target = source[kept], target[kept]
+    straight = np.hypot(x[source] - x[target], y[source] - y[target])
+    edges = pd.DataFrame({
+        "source": source + 1,
+        "target": target + 1,
+        "length": straight*rng.uniform(detour[0], detour[1], len(source)),
+        "oneway": rng.random(len(source)) < oneway_share})
+
+    data = {"nodes": nodes, "edges": edges}
+    if dir is not None:
+        if not os.path.isdir(dir):
+            os.makedirs(dir)
+        for name, df in data.items():
+            df.to_csv(os.path.join(dir, name+".csv"), index=False)
+    return data
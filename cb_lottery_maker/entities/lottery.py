@@ -18,6 +18,39 @@ global epsilon
 epsilon = sys.float_info.epsilon
 
 
+def connected_components(n_nodes:int,
+        source:np.ndarray,
+        target:np.ndarray) -> np.ndarray:
+    '''
+    Union-find over the edges (source, target) of a graph with nodes 0 to
+    n_nodes-1. Each round compresses the paths to the roots and hooks the
+    larger root of every edge still crossing two components onto the smaller
+    one, with all edges processed at once.
+
+    Args:
+        n_nodes (int): Number of nodes
+        source (np.ndarray): First node of each edge
+        target (np.ndarray): Second node of each edge
+
+    Returns:
+        roots (np.ndarray): Smallest node of the component of each node
+    '''
+    parent = np.arange(n_nodes)
+    while True:
+        grandparent = parent[parent]
+        while (grandparent!=parent).any():
+            parent = grandparent
+            grandparent = parent[parent]
+        source_root,target_root = parent[source],parent[target]
+        crossing = source_root!=target_root
+        if not crossing.any():
+            return parent
+        source,target = source[crossing],target[crossing]
+        np.minimum.at(parent,
+                        np.maximum(source_root,target_root)[crossing],
+                        np.minimum(source_root,target_root)[crossing])
+
+
 class Lottery():
     def __init__(self,
                 applicants:pd.DataFrame,
@@ -48,10 +81,96 @@ class Lottery():
         '''
         Searches the appropriate lottery method an executes it.
         '''
+        if self._engine=='array':
+            self._run_array()
+            return
         self.tie_break_function = self.get_tie_break_function()
         for applicant_id,application in self.applications_dict.items():
             self.tie_break_function(applicant_id,application)
 
+    def _run_array(self)-> None:
+        '''
+        Array engine. Draws all the lottery numbers in a single call to a
+        numpy Generator seeded with the configured seed, one number per
+        applicant, per (applicant, program) pair or per (applicant, program,
+        quota) triple depending on the tie break rules, and broadcasts them
+        onto the pairs. The numbers do not depend on the order of the rows.
+
+        If sibling lottery is true, each group of siblings (see
+        _get_sibling_groups) shares the numbers of its first member, and the
+        other members get an epsilon tiebreak drawn in a second call.
+        '''
+        rng = np.random.default_rng(int(self._seed))
+        n_pairs = len(self._pair_applicant)
+        n_quotas = len(self._quota_ids)
+        if self._tie_break_method=='single':
+            nodes = self._pair_applicant
+            n_nodes = len(self._applicant_ids)
+        else:
+            nodes = np.arange(n_pairs)
+            n_nodes = n_pairs
+        groups = self._get_sibling_groups() if self._sibling_lottery \
+                                            else np.arange(n_nodes)
+
+        self.lottery_numbers = np.zeros((n_pairs,n_quotas))
+        if self._tie_break_level!='quota' or self._tie_break_method=='single':
+            draws = rng.random(n_nodes)
+            self.lottery_numbers[:] = draws[groups[nodes],None]
+        else:
+            cells = self._row_pair*n_quotas+self._row_quota
+            triples,draw_index = np.unique(groups[self._row_pair]*n_quotas
+                                            +self._row_quota,
+                                            return_inverse=True)
+            draws = rng.random(len(triples))
+            self.lottery_numbers.reshape(-1)[cells] = draws[draw_index]
+
+        if self._sibling_lottery:
+            draws = rng.random(n_nodes)
+            if self._tie_break_method=='single':
+                # Epsilon times a random number from uniform [-1,1] dist
+                sibling_tiebreak = (draws-0.5)*2*epsilon
+            else:
+                # Epsilon times a random number from uniform [-10,10] dist
+                sibling_tiebreak = np.round((draws-0.5)*20,2)*epsilon
+            sibling_tiebreak[groups==np.arange(n_nodes)] = 0
+            self.lottery_numbers += sibling_tiebreak[nodes,None]
+
+    def _get_sibling_groups(self) -> np.ndarray:
+        '''
+        Groups siblings that share lottery numbers, as connected components
+        of the siblings graph. With a single tie break the nodes are the
+        applicants and only siblings in the same grade are linked. With
+        multiple tie break the nodes are the (applicant, program) pairs, and
+        the pairs of two siblings are linked when both apply to the program
+        in the same grade.
+
+        Returns:
+            groups (np.ndarray): Smallest node of the group of each node
+        '''
+        source,target = self._sibling_source,self._sibling_target
+        same_grade = self._applicant_grade[source]==self._applicant_grade[target]
+        source,target = source[same_grade],target[same_grade]
+        if self._tie_break_method=='single':
+            return connected_components(len(self._applicant_ids),source,target)
+
+        # Expanding each sibling edge to the pairs of the applicant
+        pairs_start = np.searchsorted(self._pair_applicant,
+                                        np.arange(len(self._applicant_ids)+1))
+        n_edge_pairs = pairs_start[source+1]-pairs_start[source]
+        edge = np.repeat(np.arange(len(source)),n_edge_pairs)
+        offset = np.arange(len(edge))-np.repeat(np.cumsum(n_edge_pairs)
+                                                -n_edge_pairs,n_edge_pairs)
+        source_pair = pairs_start[source][edge]+offset
+
+        # Looking for the same program in the application of the sibling
+        target_keys = target[edge]*len(self._program_ids) \
+                                        +self._pair_program[source_pair]
+        target_pair = np.minimum(np.searchsorted(self._pair_keys,target_keys),
+                                    len(self._pair_keys)-1)
+        linked = self._pair_keys[target_pair]==target_keys
+        return connected_components(len(self._pair_keys),source_pair[linked],
+                                    target_pair[linked])
+
     def get_output(self) -> pd.DataFrame:
         '''
         Generates a DataFrame similar to applications, but with the
@@ -60,20 +179,35 @@ class Lottery():
         Returns:
             output (pd.DataFrame): Dataframe with lottery
         '''
-        new_dict = {(applicant_id,program_id):program_application
-                for applicant_id,application in self.applications_dict.items()
-                for (program_id,_),program_application in application.items() }
-        output = pd.DataFrame.from_dict(new_dict,'index')
-        output.index = output.index.set_names(['applicant_id','program_id'])
-        output = output.set_index(['institution_id','ranking_program'],
-                                    append=True) \
-                                    .apply(pd.Series.explode) \
-                                    .reset_index()
-        output = output.merge(self.applications)
+        output = self.applications.loc[self._rows].copy()
+        output['lottery_number_quota'] = self.get_lottery_numbers()
         output = output.astype(self.applications_dtypes)
-        output['lottery_number_quota'] = output['lottery_number_quota'].astype(float)
         return output
 
+    def get_lottery_numbers(self) -> np.ndarray:
+        '''
+        Lottery number of each row of the output of get_output, in the same
+        order.
+
+        Returns:
+            lottery_numbers (np.ndarray)
+        '''
+        return self.lottery_numbers[self._row_pair,self._row_quota]
+
+    def rerun(self,
+            seed) -> None:
+        '''
+        Draws all the lottery numbers again with another seed, without
+        reading the applications again.
+
+        Args:
+            seed: Seed for replication
+        '''
+        self._seed = seed
+        np.random.seed(self._seed)
+        self.reset_lottery_numbers()
+        self.run()
+
     def _set_rules(self) -> None:
         '''
         Set rules of the school assignment according to config
@@ -82,6 +216,7 @@ class Lottery():
         self._tie_break_level = self.config['tie_break_level']
         self._sibling_lottery = self.config['sibling_lottery']
         self._seed = self.config['seed']
+        self._engine = self.config.get('engine','object')
 
         np.random.seed(self._seed)
         self._assert_rules()
@@ -99,6 +234,9 @@ class Lottery():
                  is not supported. Please enter "program" or "quota".')
         if type(self._sibling_lottery)!= bool:
             raise ValueError(f'Sibling Lottery parameter must be bool')
+        if self._engine not in ['object','array']:
+            raise ValueError(f'Engine "{self._engine}" is not supported.\
+             Please enter "object" or "array".')
 
     def _read_siblings_data(
             self,
@@ -116,6 +254,10 @@ class Lottery():
             if not (('applicant_id' in siblings.columns) and ('sibling_id' in siblings.columns) and (len(siblings.columns)==2)):
                 raise ValueError('Unexpected column in siblings DataFrame. Expected "applicant_id" and "sibling_id".')
 
+            if self._engine=='array':
+                self._read_siblings_arrays(siblings)
+                return
+
             siblings_gb = siblings.groupby('applicant_id')['sibling_id'].apply(list)
 
             self.siblings_dict = siblings_gb.to_dict()
@@ -124,6 +266,29 @@ class Lottery():
         else:
             self.siblings_dict = None
 
+    def _read_siblings_arrays(
+            self,
+            siblings: pd.DataFrame) -> None:
+        '''
+        Encodes siblings as edges between applicant codes for the array
+        engine. Siblings without applications are left out.
+
+        Args:
+            siblings(pd.DataFrame): Siblings df
+        '''
+        source = np.searchsorted(self._applicant_ids,
+                                    siblings['applicant_id'].values)
+        target = np.searchsorted(self._applicant_ids,
+                                    siblings['sibling_id'].values)
+        n_applicants = len(self._applicant_ids)
+        known = (source<n_applicants) & (target<n_applicants)
+        known[known] = (self._applicant_ids[source[known]]==
+                            siblings['applicant_id'].values[known]) & \
+                        (self._applicant_ids[target[known]]==
+                            siblings['sibling_id'].values[known])
+        self._sibling_source = source[known]
+        self._sibling_target = target[known]
+
     def _read_applications_data(
             self,
             applicants: pd.DataFrame,
@@ -131,7 +296,9 @@ class Lottery():
         '''
         Group applications by applicant_id. Creates applications dict with
         applications of each applicant. It assumes that each quota appears once
-        per program.
+        per program. The lottery numbers are kept in lottery_numbers, one row
+        per (applicant, program) pair and one column per quota, and each
+        program application holds the index of its row.
 
         Args:
             applicants (pd.DataFrame): Applicants df
@@ -139,8 +306,12 @@ class Lottery():
         '''
         self.applications = applications.copy()
         self.applications_dtypes = applications.dtypes
-        quotas = list(applications.quota_id.unique())
-        quotas.sort()
+        self._read_applications_arrays(applicants=applicants,
+                                        applications=applications)
+        self.lottery_numbers = np.zeros((len(self._pair_applicant),
+                                            len(self._quota_ids)))
+        if self._engine=='array':
+            return
         aux_applications = applications[['applicant_id',
                                             'institution_id',
                                             'program_id',
@@ -153,18 +324,61 @@ class Lottery():
         aux_applications = aux_applications.join(aux_applicants,how='inner') \
                                             .set_index('grade_id',append=True)
 
+        pair_keys = np.searchsorted(self._applicant_ids,
+                    aux_applications.index.get_level_values('applicant_id')) \
+                    *len(self._program_ids) \
+                    + np.searchsorted(self._program_ids,
+                    aux_applications.index.get_level_values('program_id'))
+        aux_applications['pair'] = np.searchsorted(self._pair_keys,pair_keys)
+
         applications_dict = {ind:{} for ind in aux_applicants.index}
         aux_dict = aux_applications.to_dict('index')
 
         for (applicant_id,program_id,grade_id),program_application in \
                                                         aux_dict.items():
-            program_application.update({'lottery_number_quota':[0]*len(quotas),
-                                                    'quota_id':quotas})
             applications_dict[applicant_id].update(
                                 {(program_id,grade_id):program_application})
 
         self.applications_dict = applications_dict
 
+    def _read_applications_arrays(
+            self,
+            applicants: pd.DataFrame,
+            applications: pd.DataFrame) -> None:
+        '''
+        Encodes applications as aligned arrays for the array engine.
+        Applications of applicants missing in applicants are left out, as in
+        the object engine. Applicants, (applicant, program) pairs and quotas
+        are numbered in sorted order.
+
+        Args:
+            applicants (pd.DataFrame): Applicants df
+            applications (pd.DataFrame): Applications df
+        '''
+        self._rows = applications['applicant_id'] \
+                                .isin(applicants['applicant_id']).values
+        self._applicant_ids,applicant_codes = np.unique(
+                    applications['applicant_id'].values[self._rows],
+                    return_inverse=True)
+        program_ids,program_codes = np.unique(
+                    applications['program_id'].values[self._rows],
+                    return_inverse=True)
+        self._quota_ids = np.unique(applications['quota_id'].values)
+        self._row_quota = np.searchsorted(self._quota_ids,
+                    applications['quota_id'].values[self._rows])
+
+        pair_keys = applicant_codes.astype(np.int64)*len(program_ids) \
+                                                            + program_codes
+        self._pair_keys,self._row_pair = np.unique(pair_keys,
+                                                    return_inverse=True)
+        self._program_ids = program_ids
+        self._pair_applicant = self._pair_keys//len(program_ids)
+        self._pair_program = self._pair_keys%len(program_ids)
+
+        grades = applicants.drop_duplicates('applicant_id') \
+                                        .set_index('applicant_id')['grade_id']
+        self._applicant_grade = grades.loc[self._applicant_ids].values
+
 
 
     def get_tie_break_function(self):
@@ -207,10 +421,10 @@ class Lottery():
         siblings_list = self.siblings_dict[applicant_id] if \
                             self._sibling_lottery else []
         for (program_id,grade_id),program_application in application.items():
-            if (0 in program_application['lottery_number_quota']):
-                lotterynumbers = list(np.random.random(
-                                        len(program_application['quota_id'])))
-                program_application['lottery_number_quota'] = lotterynumbers
+            pair = program_application['pair']
+            if (0 in self.lottery_numbers[pair]):
+                lotterynumbers = list(np.random.random(len(self._quota_ids)))
+                self.lottery_numbers[pair] = lotterynumbers
                 if len(siblings_list) > 0:
                     for sibling_id in siblings_list:
                         self.propagate_multiple_lottery(sibling_id,
@@ -236,10 +450,10 @@ class Lottery():
         siblings_list = self.siblings_dict[applicant_id] if \
                             self._sibling_lottery else []
         for (program_id,grade_id),program_application in application.items():
-            if (0 in program_application['lottery_number_quota']):
-                lotterynumbers = [np.random.random()]* \
-                                        len(program_application['quota_id'])
-                program_application['lottery_number_quota'] = lotterynumbers
+            pair = program_application['pair']
+            if (0 in self.lottery_numbers[pair]):
+                lotterynumbers = [np.random.random()]*len(self._quota_ids)
+                self.lottery_numbers[pair] = lotterynumbers
                 if len(siblings_list) > 0:
                     for sibling_id in siblings_list:
                         self.propagate_multiple_lottery(sibling_id,
@@ -267,8 +481,7 @@ class Lottery():
         if self.zero_in_lottery(application):
             lotterynumber = np.random.random()
             for (_,grade_id),program_application in application.items():
-                program_application['lottery_number_quota'] = [lotterynumber]* \
-                                            len(program_application['quota_id'])
+                self.lottery_numbers[program_application['pair']] = lotterynumber
             if len(siblings_list) > 0:
                 for sibling_id in siblings_list:
                     self.propagate_single_lottery(sibling_id,
@@ -284,7 +497,7 @@ class Lottery():
             Bool
         '''
         for (program_id,grade_id),program_application in application.items():
-            if (0 in program_application['lottery_number_quota']):
+            if (0 in self.lottery_numbers[program_application['pair']]):
                 return True
         return False
 
@@ -305,21 +518,23 @@ class Lottery():
             grade_id: Numeric.
             lotterynumbers (List): List of lottery numbers
         '''
-        sib_application = self.applications_dict[sibling_id]
-        if (program_id,grade_id) in sib_application.keys():
-
-            sib_program_application = sib_application[(program_id,grade_id)]
-            if (0 in sib_program_application['lottery_number_quota']):
+        # Depth first, with a stack instead of recursion, so large families
+        # do not hit the recursion limit
+        pending = [sibling_id]
+        while pending:
+            sibling_id = pending.pop()
+            sib_application = self.applications_dict[sibling_id]
+            if (program_id,grade_id) not in sib_application.keys():
+                continue
+
+            sib_pair = sib_application[(program_id,grade_id)]['pair']
+            if (0 in self.lottery_numbers[sib_pair]):
                 # Epsilon times a random number from uniform [-10,10] dist
                 sibling_tiebreak = round((np.random.rand()-0.5)*20,2)*epsilon
                 # sibling_tiebreak = np.random.choice([-1,1])*epsilon
-                sib_program_application['lottery_number_quota'] = \
+                self.lottery_numbers[sib_pair] = \
                                     [l+sibling_tiebreak for l in lotterynumbers]
-                for new_sibling_id in self.siblings_dict[sibling_id]:
-                    self.propagate_multiple_lottery(new_sibling_id,
-                                                    program_id,
-                                                    grade_id,
-                                                    lotterynumbers)
+                pending.extend(reversed(self.siblings_dict[sibling_id]))
 
 
     def propagate_single_lottery(self,
@@ -337,26 +552,24 @@ class Lottery():
             grade_id: Numeric.
             lotterynumbers (List): List of lottery numbers
         '''
-        sib_application = self.applications_dict[sibling_id]
-        _,sib_grade_id = next(iter(sib_application.keys()))
-        if sib_grade_id==grade_id:
-            if self.zero_in_lottery(sib_application):
-                # Epsilon times a random number from uniform [-1,1] dist
-                sibling_tiebreak = (np.random.rand()-0.5)*2*epsilon
-                for (sib_program_id,sib_grade_id),sib_program_application in \
-                                                        sib_application.items():
-                    sib_program_application['lottery_number_quota'] = \
-                                    [lotterynumber+sibling_tiebreak]* \
-                                    len(sib_program_application['quota_id'])
-                for new_sibling_id in self.siblings_dict[sibling_id]:
-                    self.propagate_single_lottery(new_sibling_id,
-                                                    grade_id,
-                                                    lotterynumber)
+        # Depth first, with a stack instead of recursion, so large families
+        # do not hit the recursion limit
+        pending = [sibling_id]
+        while pending:
+            sibling_id = pending.pop()
+            sib_application = self.applications_dict[sibling_id]
+            _,sib_grade_id = next(iter(sib_application.keys()))
+            if sib_grade_id==grade_id:
+                if self.zero_in_lottery(sib_application):
+                    # Epsilon times a random number from uniform [-1,1] dist
+                    sibling_tiebreak = (np.random.rand()-0.5)*2*epsilon
+                    for (sib_program_id,sib_grade_id),sib_program_application \
+                                                in sib_application.items():
+                        self.lottery_numbers[sib_program_application['pair']] = \
+                                    lotterynumber+sibling_tiebreak
+                    pending.extend(reversed(self.siblings_dict[sibling_id]))
     def reset_lottery_numbers(self):
         '''
         Sets all lottery numbers to 0.
         '''
-        for applicant_id,application in self.applications_dict.items():
-            for (program_id,grade_id),program_application in application.items():
-                program_application['lottery_number_quota'] = [0]* \
-                                        len(program_application['quota_id'])
+        self.lottery_numbers[:] = 0
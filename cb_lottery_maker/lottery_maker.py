@@ -14,7 +14,8 @@ def lottery_maker(applicants, applications,
         tie_break_method:str = 'single',
         tie_break_level:str = '',
         sibling_lottery:bool = False,
-        seed:float = 0):
+        seed:float = 0,
+        engine:str = 'object'):
     '''
     Main method for the generation of Lottery numbers.
     '''
@@ -26,8 +27,12 @@ def lottery_maker(applicants, applications,
                     'sibling_lottery': sibling_lottery,
                     # If true siblings in same grade will be assigned (almost)
                     # same lottery
-                    'seed': seed
+                    'seed': seed,
                     # Seed for replication
+                    'engine': engine
+                    # Takes values 'object' or 'array'. The array engine
+                    # draws all numbers at once (not with the same numbers
+                    # as 'object' for a given seed)
                     }
     print('*******************************************************')
     print('*******************************************************')
@@ -43,6 +48,7 @@ def lottery_maker(applicants, applications,
     print('Tie Break level: ', config_file['tie_break_level'])
     print('Sibling lottery: ', config_file['sibling_lottery'])
     print('Seed: ', config_file['seed'])
+    print('Engine: ', config_file['engine'])
     print('*******************************************************')
     print('*******************************************************')
 